@@ -0,0 +1,175 @@
+"""Measures the decode throughput and peak memory of the Axona and Intan acquisition readers.
+
+Synthetic, valid recordings of the given duration and channel count are written to a
+temporary directory (see signalstore.utilities.testing.synthetic_recordings), then each
+reader decodes its file --repeats times, each time in a fresh process so that the peak
+memory of one reader does not hide another's. For every reader the report has the file
+size, the median decode time, the decode throughput in MB/s of file, and the peak resident
+set size of the process (peak_rss_mb) and its growth over the process before the read
+(peak_rss_delta_mb), both from getrusage.
+
+The readers are:
+    eeg, egf -- read_eeg_or_egf on the .eeg (250 Hz) and .egf (4.8 kHz) continuous files
+    pos -- _get_position on the .pos file (50 Hz position samples)
+    tetrode, cut -- _read_tetrode_file and _read_cut_file on a tetrode (.1) and its .cut file
+    rhd, rhs -- read_data of the Intan RHD2000 and RHS2000 loaders
+The Axona files have one channel per .eeg/.egf (as Axona writes them) and --channels / 4
+tetrodes; the tetrode and cut readers are run on the first one. Intan spike.dat files are
+written too, but are not benchmarked, since their reader (ReadIntanSpikeFile.py) is an
+interactive script rather than a function.
+
+Usage:
+    python benchmarks/acquisition_readers.py [--duration SECONDS] [--channels N] [--spike-rate HZ]
+                                             [--readers NAME [NAME ...]] [--repeats N] [--output FILE]
+
+(signalstore must be importable, e.g. installed with `pip install -e .`)
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from signalstore.utilities.testing import synthetic_recordings
+
+READERS = ["eeg", "egf", "pos", "tetrode", "cut", "rhd", "rhs"]
+
+
+def write_recordings(directory, duration, n_channels, spike_rate):
+    """Writes the synthetic recordings and returns the file of each reader."""
+    axona = synthetic_recordings.write_axona_session(
+        os.path.join(directory, "axona"), duration, n_tetrodes=max(n_channels // 4, 1), spike_rate=spike_rate)
+    synthetic_recordings.write_intan_spike_dat(os.path.join(directory, "spike.dat"), duration, n_channels=n_channels)
+    return {
+        "eeg": str(axona["eeg"]),
+        "egf": str(axona["egf"]),
+        "pos": str(axona["pos"]),
+        "tetrode": str(axona["tetrodes"][0]),
+        "cut": str(axona["cuts"][0]),
+        "rhd": str(synthetic_recordings.write_intan_rhd(os.path.join(directory, "recording.rhd"), duration, n_channels=n_channels)),
+        "rhs": str(synthetic_recordings.write_intan_rhs(os.path.join(directory, "recording.rhs"), duration, n_channels=n_channels)),
+    }
+
+
+def load_reader(reader):
+    """Returns a function that decodes a file with the reader."""
+    from signalstore.adapters.read_adapters.recording_acquisitions.axona import axona_read_adapter as axona
+
+    def lfp(path):
+        with open(path, "rb") as f:
+            return axona.read_eeg_or_egf(f, reader, "benchmark", None)
+
+    def intan(path):
+        read_data = synthetic_recordings.load_intan_reader(reader)
+        # the Intan loaders print their progress
+        with contextlib.redirect_stdout(io.StringIO()):
+            return read_data(path)
+
+    return {
+        "eeg": lfp,
+        "egf": lfp,
+        "pos": axona._get_position,
+        "tetrode": lambda path: axona._read_tetrode_file(path, "benchmark"),
+        "cut": lambda path: axona._read_cut_file(path, "benchmark"),
+        "rhd": intan,
+        "rhs": intan,
+    }[reader]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def measure(reader, path, queue):
+    """Decodes the file once (in a fresh process) and puts the decode time and peak memory on the queue."""
+    import xarray as xr
+
+    decode = load_reader(reader)
+    # finish the (lazy) imports before the baseline is taken, so they are not timed as decoding
+    xr.DataArray(np.zeros(1), dims=["time"])
+    if reader in ("rhd", "rhs"):
+        synthetic_recordings.load_intan_reader(reader)
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    decode(path)
+    seconds = time.perf_counter() - start
+    peak = _peak_rss_mb()
+    queue.put({"seconds": seconds, "peak_rss_mb": peak, "peak_rss_delta_mb": peak - baseline})
+
+
+def run_reader(reader, path, repeats):
+    context = multiprocessing.get_context("spawn")
+    measurements = []
+    for _ in range(repeats):
+        queue = context.Queue()
+        process = context.Process(target=measure, args=(reader, path, queue))
+        process.start()
+        measurement = queue.get()
+        process.join()
+        measurements.append(measurement)
+    nbytes = os.path.getsize(path)
+    seconds = float(np.median([m["seconds"] for m in measurements]))
+    return {
+        "reader": reader,
+        "file": os.path.basename(path),
+        "nbytes": nbytes,
+        "seconds": seconds,
+        "mb_per_s": nbytes / 1e6 / seconds if seconds > 0 else None,
+        "peak_rss_mb": max(m["peak_rss_mb"] for m in measurements),
+        "peak_rss_delta_mb": max(m["peak_rss_delta_mb"] for m in measurements),
+    }
+
+
+def run(duration, n_channels, spike_rate, readers, repeats):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"writing {duration} s recordings of {n_channels} channels", file=sys.stderr)
+        paths = write_recordings(directory, duration, n_channels, spike_rate)
+        for reader in readers:
+            print(f"reading: {reader}", file=sys.stderr)
+            results.append(run_reader(reader, paths[reader], repeats))
+    return {
+        "benchmark": "acquisition_readers",
+        "time": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+        },
+        "parameters": {"duration": duration, "n_channels": n_channels, "spike_rate": spike_rate, "repeats": repeats},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=600.0)
+    parser.add_argument("--channels", type=int, default=32)
+    parser.add_argument("--spike-rate", type=float, default=20.0)
+    parser.add_argument("--readers", nargs="+", choices=READERS, default=READERS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    report = run(args.duration, args.channels, args.spike_rate, args.readers, args.repeats)
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
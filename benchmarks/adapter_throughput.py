@@ -0,0 +1,92 @@
+"""Compares the write and read throughput of the NetCDF, Zarr and raw NumPy data file adapters.
+
+Each adapter writes and reads float32 (time, channel) arrays of increasing size
+through a FileSystemDAO on a local temporary directory. Reads are timed until
+the data is fully loaded, so lazily loading and memory mapping adapters pay for
+the bytes they touch like the others.
+
+Usage:
+    python benchmarks/adapter_throughput.py [--repeats N] [--channels N]
+
+(signalstore must be importable, e.g. installed with `pip install -e .`)
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import xarray as xr
+from fsspec.implementations.local import LocalFileSystem
+
+from signalstore.store.data_access_objects import FileSystemDAO
+from signalstore.store.datafile_adapters import (
+    XarrayDataArrayNetCDFAdapter,
+    XarrayDataArrayZarrAdapter,
+    XarrayDataArrayRawNumpyAdapter,
+)
+
+ARRAY_SIZES = [2**16, 2**20, 2**24, 2**27] # bytes
+ADAPTERS = [
+    ("netcdf", XarrayDataArrayNetCDFAdapter),
+    ("zarr", XarrayDataArrayZarrAdapter),
+    ("numpy", XarrayDataArrayRawNumpyAdapter),
+]
+
+
+def make_dataarray(nbytes, n_channels, data_name):
+    n_samples = max(nbytes // (4 * n_channels), 1)
+    return xr.DataArray(
+        np.random.rand(n_samples, n_channels).astype("float32"),
+        dims=("time", "channel"),
+        coords={"time": np.arange(n_samples) / 30000},
+        attrs={"schema_ref": "benchmark", "data_name": data_name, "version_timestamp": 0},
+    )
+
+
+def throughput(function, nbytes, repeats):
+    """Returns the median throughput of a call in MB/s."""
+    durations = []
+    for n in range(repeats):
+        start = time.perf_counter()
+        function(n)
+        durations.append(time.perf_counter() - start)
+    return nbytes / float(np.median(durations)) / 1e6
+
+
+def run(repeats, n_channels):
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for adapter_name, adapter_class in ADAPTERS:
+            dao = FileSystemDAO(LocalFileSystem(auto_mkdir=True), f"{tmpdir}/{adapter_name}", default_data_adapter=adapter_class())
+            for nbytes in ARRAY_SIZES:
+                dataarray = make_dataarray(nbytes, n_channels, f"size_{nbytes}")
+
+                def write(n):
+                    dao.add(data_object=dataarray.copy().assign_attrs(data_name=f"size_{nbytes}_{n}"))
+
+                def read(n):
+                    float(dao.get("benchmark", f"size_{nbytes}_{n}").sum())
+
+                results.append({
+                    "adapter": adapter_name,
+                    "nbytes": int(dataarray.nbytes),
+                    "write_mb_s": throughput(write, dataarray.nbytes, repeats),
+                    "read_mb_s": throughput(read, dataarray.nbytes, repeats),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=64)
+    args = parser.parse_args()
+    results = run(args.repeats, args.channels)
+    print(f"{'adapter':<8}{'nbytes':>12}{'write (MB/s)':>15}{'read (MB/s)':>14}")
+    for result in results:
+        print(f"{result['adapter']:<8}{result['nbytes']:>12}{result['write_mb_s']:>15.1f}{result['read_mb_s']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
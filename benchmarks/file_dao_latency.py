@@ -0,0 +1,83 @@
+"""Measures FileSystemDAO.exists / add / mark_for_deletion / restore latency as a function of array size.
+
+These operations only need filesystem metadata, so their latency should not
+depend on the size of the stored array.
+
+Usage:
+    python benchmarks/file_dao_latency.py [--repeats N]
+
+(signalstore must be importable, e.g. installed with `pip install -e .`)
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import xarray as xr
+from datetime import datetime, timezone
+from fsspec.implementations.local import LocalFileSystem
+
+from signalstore.store.data_access_objects import FileSystemDAO
+from signalstore.store.datafile_adapters import XarrayDataArrayNetCDFAdapter, XarrayDataArrayZarrAdapter
+
+ARRAY_SIZES = [2**10, 2**16, 2**20, 2**24, 2**26] # bytes
+
+
+def make_dataarray(nbytes, data_name):
+    n = max(nbytes // 8, 1)
+    return xr.DataArray(
+        np.random.rand(n, 1),
+        dims=("time", "channel"),
+        attrs={"schema_ref": "benchmark", "data_name": data_name, "version_timestamp": 0},
+    )
+
+
+def time_call(function, repeats):
+    """Returns the median latency of a call in microseconds."""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies)) * 1e6
+
+
+def run(repeats):
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for adapter_name, adapter in [("netcdf", XarrayDataArrayNetCDFAdapter()), ("zarr", XarrayDataArrayZarrAdapter())]:
+            dao = FileSystemDAO(LocalFileSystem(auto_mkdir=True), f"{tmpdir}/{adapter_name}", default_data_adapter=adapter)
+            for nbytes in ARRAY_SIZES:
+                data_name = f"size_{nbytes}"
+                dataarray = make_dataarray(nbytes, data_name)
+                dao.add(data_object=dataarray)
+                key = {"schema_ref": "benchmark", "data_name": data_name, "version_timestamp": 0}
+
+                def remove_and_restore():
+                    dao.mark_for_deletion(time_of_removal=datetime.now(timezone.utc), **key)
+                    dao.restore(**key)
+
+                results.append({
+                    "adapter": adapter_name,
+                    "nbytes": nbytes,
+                    "exists_us": time_call(lambda: dao.exists(**key), repeats),
+                    # adding an object that already exists is skipped after the existence check
+                    "add_existing_us": time_call(lambda: dao.add(data_object=dataarray), repeats),
+                    "remove_restore_us": time_call(remove_and_restore, repeats),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    results = run(args.repeats)
+    print(f"{'adapter':<8}{'nbytes':>12}{'exists (us)':>14}{'add existing (us)':>20}{'remove+restore (us)':>22}")
+    for result in results:
+        print(f"{result['adapter']:<8}{result['nbytes']:>12}{result['exists_us']:>14.1f}{result['add_existing_us']:>20.1f}{result['remove_restore_us']:>22.1f}")
+
+
+if __name__ == "__main__":
+    main()
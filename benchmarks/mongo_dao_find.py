@@ -0,0 +1,83 @@
+"""Measures MongoDAO document (de)serialization throughput on large finds.
+
+Reports documents per second for deserializing 100k raw documents (as a find
+over 100k records returns them) and for an end-to-end MongoDAO.find. The
+end-to-end find runs against an in-memory mongomock collection, whose unique
+index makes inserts quadratic, so it uses a smaller collection and includes
+mongomock's own query overhead; against a real server the deserialization
+share of a find is larger.
+
+Usage:
+    python benchmarks/mongo_dao_find.py [--n-records N] [--n-find-records N] [--repeats N]
+
+(signalstore must be importable, e.g. installed with `pip install -e .` or run with PYTHONPATH=.)
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import numpy as np
+
+from signalstore.store.data_access_objects import MongoDAO
+
+
+def make_records(n_records):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "schema_ref": "session",
+            "data_name": f"session_{i}",
+            "version_timestamp": 0 if i % 2 else start + timedelta(seconds=i),
+            "has_file": False,
+            "subject": f"subject_{i % 100}",
+            "duration": float(i),
+            "session_description": "benchmark session",
+        }
+        for i in range(n_records)
+    ]
+
+
+def time_call(function, repeats):
+    """Returns the median duration of a call in seconds."""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations))
+
+
+def run(n_records, n_find_records, repeats):
+    dao = MongoDAO(mongomock.MongoClient(), "benchmark", "records", ["schema_ref", "data_name", "version_timestamp"])
+    timestamp = datetime.now(timezone.utc)
+    # raw documents as a find returns them: serialized and with naive UTC datetimes
+    raw_documents = [dao._serialize({**record, "time_of_save": timestamp, "time_of_removal": None}) for record in make_records(n_records)]
+    for document in raw_documents:
+        if document["version_timestamp"] != 0:
+            document["version_timestamp"] = document["version_timestamp"].replace(tzinfo=None)
+    deserialize_s = time_call(lambda: [dao._deserialize(document) for document in raw_documents], repeats)
+    dao._collection.insert_many(raw_documents[:n_find_records])
+    find_s = time_call(lambda: dao.find({"schema_ref": "session"}), repeats)
+    return {
+        "n_records": n_records,
+        "deserialize_docs_per_s": n_records / deserialize_s,
+        "n_find_records": n_find_records,
+        "find_docs_per_s": n_find_records / find_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-records", type=int, default=100_000)
+    parser.add_argument("--n-find-records", type=int, default=2_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    result = run(args.n_records, args.n_find_records, args.repeats)
+    print(f"deserialize: {result['deserialize_docs_per_s']:.0f} docs/s ({result['n_records']} documents)")
+    print(f"find:        {result['find_docs_per_s']:.0f} docs/s ({result['n_find_records']} records, mongomock)")
+
+
+if __name__ == "__main__":
+    main()
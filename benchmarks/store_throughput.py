@@ -0,0 +1,283 @@
+"""Measures the throughput of the store layer (DataRepository on MongoDAO and FileSystemDAO, and UnitOfWork).
+
+Record benchmarks add, get, find, remove (remove_many), restore (undo_all) and purge
+records without files at increasing collection sizes. Array benchmarks add, get
+(until fully loaded), remove, restore and purge data arrays of increasing size with
+each data adapter. A unit of work benchmark commits and rolls back transactions of
+record adds. Every benchmark starts from an empty project, so results of different
+sizes do not share state.
+
+Records go to an in-memory mongomock client unless --mongo-uri points at a mongod
+(e.g. a throwaway local one: `mongod --dbpath /tmp/bench --port 27018`). mongomock's
+unique index makes inserts quadratic, so its 100k record results mostly measure
+mongomock; run the large sizes against a mongod to measure signalstore. Files go to
+a temporary local directory or, with --filesystem memory, to fsspec's memory filesystem.
+Arrays of 1 GiB need several GiB of memory, so the largest size is opt-in:
+`--max-nbytes 1073741824`.
+
+The results are written as JSON (to stdout or --output) for tracking over time.
+Given --baseline, a previous result file, every measurement is compared with the
+baseline one and the script exits with status 1 if any is more than --tolerance slower.
+
+Usage:
+    python benchmarks/store_throughput.py [--n-records N [N ...]] [--max-nbytes N] [--filesystem {local,memory}]
+                                          [--mongo-uri URI] [--repeats N] [--output FILE] [--baseline FILE] [--tolerance F]
+
+(signalstore must be importable, e.g. installed with `pip install -e .`)
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import fsspec
+import mongomock
+import numpy as np
+import xarray as xr
+from fsspec.implementations.local import LocalFileSystem
+
+from signalstore.store import UnitOfWorkProvider
+
+N_RECORDS = [1_000, 10_000, 100_000]
+ARRAY_SIZES = [2**10, 2**15, 2**20, 2**25, 2**27, 2**30] # bytes
+ADAPTERS = ["netcdf", "zarr"]
+# gets are timed on a sample of the records, since each one is a separate query
+N_GETS = 1_000
+
+# the smallest controlled vocabulary and data models that the benchmark records validate against
+DOMAIN_MODELS = [
+    {"schema_name": "schema_ref", "schema_type": "property_model", "json_schema": {"type": "string"}},
+    {"schema_name": "data_name", "schema_type": "property_model", "json_schema": {"type": "string"}},
+    {"schema_name": "version_timestamp", "schema_type": "property_model", "json_schema": {"type": ["datetime", "integer"]}},
+    {"schema_name": "has_file", "schema_type": "property_model", "json_schema": {"type": "boolean"}},
+    {"schema_name": "time_of_save", "schema_type": "property_model", "json_schema": {"type": "datetime"}},
+    {"schema_name": "time_of_removal", "schema_type": "property_model", "json_schema": {"type": ["datetime", "null"]}},
+    {"schema_name": "duration", "schema_type": "property_model", "json_schema": {"type": "number"}},
+    {"schema_name": "benchmark_metamodel", "schema_type": "metamodel", "json_schema": {"type": "object"}},
+    {"schema_name": "benchmark_record", "schema_type": "data_model", "metamodel_ref": "benchmark_metamodel",
+     "json_schema": {"type": "object", "required": ["schema_ref", "data_name", "has_file"]}},
+    {"schema_name": "benchmark_array", "schema_type": "data_model", "metamodel_ref": "benchmark_metamodel",
+     "json_schema": {"type": "object", "required": ["schema_ref", "data_name", "has_file"]}},
+]
+
+
+class Store:
+    """A fresh project for each benchmark, with the benchmark's domain models."""
+
+    def __init__(self, mongo_uri, filesystem, default_filetype):
+        if mongo_uri is None:
+            self.client = mongomock.MongoClient()
+        else:
+            from pymongo import MongoClient
+            self.client = MongoClient(mongo_uri)
+        if filesystem == "memory":
+            fs = fsspec.filesystem("memory")
+        else:
+            # the project directory is relative to the working directory (zarr cannot write through a DirFileSystem)
+            fs = LocalFileSystem(auto_mkdir=True)
+        self.provider = UnitOfWorkProvider(mongo_client=self.client, filesystem=fs, memory_store={}, default_filetype=default_filetype)
+        self.project = f"benchmark_{uuid.uuid4().hex[:12]}"
+        with self.provider(self.project) as uow:
+            for model in DOMAIN_MODELS:
+                uow.domain_models.add({
+                    "schema_title": " ".join(part.title() for part in model["schema_name"].split("_")),
+                    "schema_description": f"The {model['schema_name']} of the store benchmark.",
+                    **model,
+                })
+            uow.commit()
+
+    def __call__(self):
+        return self.provider(self.project)
+
+    def drop(self):
+        self.client.drop_database(self.project)
+
+
+def make_records(n_records):
+    return [
+        {"schema_ref": "benchmark_record", "data_name": f"record_{i}", "has_file": False, "duration": float(i)}
+        for i in range(n_records)
+    ]
+
+
+def make_dataarray(nbytes, data_name):
+    n_samples = max(nbytes // 8, 1)
+    return xr.DataArray(
+        np.random.rand(n_samples),
+        dims=("time",),
+        coords={"time": np.arange(n_samples, dtype="float64")},
+        attrs={"schema_ref": "benchmark_array", "data_name": data_name, "has_file": True},
+    )
+
+
+def timed(function):
+    """Returns the result and the duration of a call in seconds."""
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def result(group, operation, n, seconds, **labels):
+    return {"group": group, "operation": operation, **labels, "n": n, "seconds": seconds, "per_s": n / seconds if seconds > 0 else None}
+
+
+def run_records(store, n_records):
+    results = []
+    labels = {"n_records": n_records}
+    with store() as uow:
+        repo = uow.data
+        records = make_records(n_records)
+        _, seconds = timed(lambda: [repo.add(record) for record in records])
+        results.append(result("records", "add", n_records, seconds, **labels))
+        repo.clear_operation_history()
+        sample = [f"record_{i}" for i in np.linspace(0, n_records - 1, min(N_GETS, n_records), dtype=int)]
+        _, seconds = timed(lambda: [repo.get("benchmark_record", data_name) for data_name in sample])
+        results.append(result("records", "get", len(sample), seconds, **labels))
+        found, seconds = timed(lambda: repo.find({"schema_ref": "benchmark_record"}))
+        results.append(result("records", "find", len(found), seconds, **labels))
+        _, seconds = timed(lambda: repo.remove_many({"schema_ref": "benchmark_record"}))
+        results.append(result("records", "remove", n_records, seconds, **labels))
+        undone, seconds = timed(repo.undo_all)
+        results.append(result("records", "undo_all", len(undone), seconds, **labels))
+        repo.remove_many({"schema_ref": "benchmark_record"})
+        report, seconds = timed(repo.purge)
+        results.append(result("records", "purge", report.n_records, seconds, **labels))
+        uow.commit()
+    return results
+
+
+def run_unit_of_work(store, n_records):
+    results = []
+    labels = {"n_records": n_records}
+
+    def transaction(records, commit):
+        with store() as uow:
+            for record in records:
+                uow.data.add(record)
+            if commit:
+                uow.commit()
+            # leaving the context without a commit rolls the transaction back
+
+    _, seconds = timed(lambda: transaction(make_records(n_records), commit=True))
+    results.append(result("unit_of_work", "commit", n_records, seconds, **labels))
+    records = [{**record, "data_name": f"rolled_back_{i}"} for i, record in enumerate(make_records(n_records))]
+    _, seconds = timed(lambda: transaction(records, commit=False))
+    results.append(result("unit_of_work", "rollback", n_records, seconds, **labels))
+    return results
+
+
+def run_arrays(store, adapter, nbytes, repeats):
+    """Reports MB/s for add and get and objects per second for the operations that only move files."""
+    results = []
+    labels = {"adapter": adapter, "nbytes": nbytes}
+    with store() as uow:
+        repo = uow.data
+        data_names = [f"array_{n}" for n in range(repeats)]
+        durations = []
+        for data_name in data_names:
+            dataarray = make_dataarray(nbytes, data_name)
+            durations.append(timed(lambda: repo.add(dataarray))[1])
+        results.append(result("arrays", "add", nbytes / 1e6, float(np.median(durations)), unit="MB", **labels))
+        durations = [timed(lambda: repo.get("benchmark_array", data_name).load())[1] for data_name in data_names]
+        results.append(result("arrays", "get", nbytes / 1e6, float(np.median(durations)), unit="MB", **labels))
+        repo.clear_operation_history()
+        _, seconds = timed(lambda: [repo.remove("benchmark_array", data_name) for data_name in data_names])
+        results.append(result("arrays", "remove", repeats, seconds, **labels))
+        _, seconds = timed(repo.undo_all)
+        results.append(result("arrays", "undo_all", repeats, seconds, **labels))
+        repo.remove_many({"schema_ref": "benchmark_array"})
+        report, seconds = timed(repo.purge)
+        results.append(result("arrays", "purge", report.n_files, seconds, **labels))
+        uow.commit()
+    return results
+
+
+def run(n_records, max_nbytes, filesystem, mongo_uri, repeats):
+    results = []
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # the provider keeps each project's files in a directory named after the project
+        os.chdir(directory)
+
+        def benchmark(function, *args, default_filetype="netcdf"):
+            store = Store(mongo_uri, filesystem, default_filetype)
+            try:
+                results.extend(function(store, *args))
+            finally:
+                store.drop()
+
+        for n in n_records:
+            print(f"records: {n}", file=sys.stderr)
+            benchmark(run_records, n)
+            benchmark(run_unit_of_work, n)
+        for adapter in ADAPTERS:
+            for nbytes in [nbytes for nbytes in ARRAY_SIZES if nbytes <= max_nbytes]:
+                print(f"arrays: {adapter} {nbytes} bytes", file=sys.stderr)
+                benchmark(run_arrays, adapter, nbytes, repeats, default_filetype=adapter)
+        os.chdir(working_directory)
+    return {
+        "benchmark": "store_throughput",
+        "time": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongo": "mongomock" if mongo_uri is None else "mongod",
+            "filesystem": filesystem,
+        },
+        "results": results,
+    }
+
+
+def _key(result):
+    return tuple((name, value) for name, value in result.items() if name not in ("seconds", "per_s", "n"))
+
+
+def compare(report, baseline, tolerance):
+    """Returns the measurements that are more than tolerance (a fraction) slower than in the baseline."""
+    baseline_results = {_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        reference = baseline_results.get(_key(result))
+        if reference is None or not reference["per_s"] or result["per_s"] is None:
+            continue
+        ratio = result["per_s"] / reference["per_s"]
+        if ratio < 1 - tolerance:
+            regressions.append({**dict(_key(result)), "per_s": result["per_s"], "baseline_per_s": reference["per_s"], "ratio": ratio})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-records", type=int, nargs="+", default=N_RECORDS)
+    parser.add_argument("--max-nbytes", type=int, default=2**27)
+    parser.add_argument("--filesystem", choices=["local", "memory"], default="local")
+    parser.add_argument("--mongo-uri", default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    report = run(args.n_records, args.max_nbytes, args.filesystem, args.mongo_uri, args.repeats)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            print(f"regression: {regression}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from signalstore.operations.importers.adapters.abstract_read_adapter import AbstractReadAdapter
+from signalstore.adapters.read_adapters.abstract_read_adapter import AbstractReadAdapter
 
 class AxonaReadAdapter(AbstractReadAdapter):
     def __init__(self, directory):
@@ -866,10 +866,10 @@ def _extract_spike_waveforms(raw_data):
 
         # acquiring the channel bytes
         bts = spike_data[chan_start_indices]
+        # the samples are signed bytes, casting wraps values above 127 to negative ones
         bts = bts.reshape(num_spikes, samples_per_spike).astype('int8')
         channels.append(bts)
 
-        channels[chan][np.where(channels[chan][:][:] > 127)] -= 256
         channels[chan] = np.multiply(channels[chan][:][:],
                                      little_endian_matrix,
                                      dtype=np.float16)
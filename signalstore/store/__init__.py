@@ -2,7 +2,13 @@ from signalstore.store.unit_of_work_provider import UnitOfWorkProvider
 
 from signalstore.store.datafile_adapters import (
     XarrayDataArrayNetCDFAdapter,
-    XarrayDataArrayZarrAdapter
+    XarrayDataArrayZarrAdapter,
+    XarrayDataArrayRawNumpyAdapter,
+    PandasDataFrameParquetAdapter,
+    register_data_adapter
 )
 
-__all__ = ['UnitOfWorkProvider', 'XarrayDataArrayNetCDFAdapter', 'XarrayDataArrayZarrAdapter']
\ No newline at end of file
+from signalstore.store.adapter_policy import DataAdapterPolicy
+from signalstore.store.file_cache import LocalFileCache
+
+__all__ = ['UnitOfWorkProvider', 'XarrayDataArrayNetCDFAdapter', 'XarrayDataArrayZarrAdapter', 'XarrayDataArrayRawNumpyAdapter', 'PandasDataFrameParquetAdapter', 'register_data_adapter', 'DataAdapterPolicy', 'LocalFileCache']
\ No newline at end of file
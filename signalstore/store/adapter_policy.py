@@ -0,0 +1,99 @@
+from signalstore.store.store_errors import *
+
+
+class DataAdapterPolicyConfigError(ConfigError):
+    pass
+
+
+class DataAdapterPolicy:
+    """Chooses the data adapter of each data object from its size, shape, dtype and schema_ref.
+
+    Rules are checked in order. The first rule that matches the object, and whose adapter
+    accepts the object's type, picks the adapter. Objects that no rule matches get the default
+    adapter, or else the first adapter that accepts their type (e.g. DataFrames get the Parquet
+    adapter). A rule is a dict with the name of an 'adapter' and any of these conditions:
+        schema_ref {str | list[str]} -- The schema_ref of the object is (one of) these.
+        min_nbytes {int} -- The object has at least this many bytes.
+        max_nbytes {int} -- The object has fewer than this many bytes.
+        ndim {int | list[int]} -- The object has (one of) these numbers of dimensions.
+        dtype_kinds {str} -- The numpy kind of the object's dtype is one of these characters (e.g. 'iuf').
+    Size conditions never match streamed objects (iterators of chunks), since their size is unknown
+    when the adapter is chosen; streams only get adapters that support appending.
+    """
+    # small arrays stay single files instead of zarr directories of tiny chunk files,
+    # large arrays are chunked and compressed so they can be read lazily
+    default_rules = (
+        {"max_nbytes": 2**20, "adapter": "netcdf"},
+        {"min_nbytes": 2**28, "adapter": "zarr"},
+    )
+    _conditions = ("schema_ref", "min_nbytes", "max_nbytes", "ndim", "dtype_kinds")
+
+    def __init__(self, data_adapters, default, rules=default_rules):
+        """
+        Arguments:
+            data_adapters {dict} -- The adapters to choose from by name.
+            default {str} -- The name of the adapter of objects that no rule matches.
+            rules {list[dict]} -- The rules, in order of precedence.
+        Raises:
+            DataAdapterPolicyConfigError -- If a rule or the default names an unknown adapter or has unknown conditions.
+        """
+        self._data_adapters = dict(data_adapters)
+        if default not in self._data_adapters:
+            raise DataAdapterPolicyConfigError(f"The default adapter '{default}' is not one of {list(self._data_adapters)}.")
+        for rule in rules:
+            if rule.get("adapter") not in self._data_adapters:
+                raise DataAdapterPolicyConfigError(f"The rule {rule} must name one of the adapters {list(self._data_adapters)}.")
+            unknown = set(rule) - {"adapter", *self._conditions}
+            if unknown:
+                raise DataAdapterPolicyConfigError(f"The rule {rule} has unknown conditions {sorted(unknown)}; use {list(self._conditions)}.")
+        self._default = default
+        self._rules = [dict(rule) for rule in rules]
+
+    @property
+    def data_adapters(self):
+        return dict(self._data_adapters)
+
+    def select(self, data_object, streamed=False):
+        """Returns the data adapter for a data object (or for the first chunk of a stream if streamed is True)."""
+        attrs = getattr(data_object, "attrs", {})
+        candidates = {
+            name: adapter for name, adapter in self._data_adapters.items()
+            if isinstance(data_object, adapter.data_object_type) and (adapter.supports_append or not streamed)
+        }
+        nbytes = None if streamed else _nbytes(data_object)
+        for rule in self._rules:
+            if rule["adapter"] in candidates and self._matches(rule, attrs.get("schema_ref"), nbytes, data_object):
+                return candidates[rule["adapter"]]
+        if self._default in candidates:
+            return candidates[self._default]
+        if candidates:
+            return next(iter(candidates.values()))
+        return self._data_adapters[self._default]
+
+    @staticmethod
+    def _matches(rule, schema_ref, nbytes, data_object):
+        if "schema_ref" in rule:
+            schema_refs = rule["schema_ref"] if isinstance(rule["schema_ref"], (list, tuple)) else [rule["schema_ref"]]
+            if schema_ref not in schema_refs:
+                return False
+        if "min_nbytes" in rule and (nbytes is None or nbytes < rule["min_nbytes"]):
+            return False
+        if "max_nbytes" in rule and (nbytes is None or nbytes >= rule["max_nbytes"]):
+            return False
+        if "ndim" in rule:
+            ndims = rule["ndim"] if isinstance(rule["ndim"], (list, tuple)) else [rule["ndim"]]
+            if getattr(data_object, "ndim", None) not in ndims:
+                return False
+        if "dtype_kinds" in rule:
+            dtype = getattr(data_object, "dtype", None)
+            if dtype is None or dtype.kind not in rule["dtype_kinds"]:
+                return False
+        return True
+
+
+def _nbytes(data_object):
+    """The in-memory size of an array or table (None if it is unknown)."""
+    nbytes = getattr(data_object, "nbytes", None)
+    if nbytes is None and hasattr(data_object, "memory_usage"):
+        nbytes = data_object.memory_usage(index=False).sum()
+    return None if nbytes is None else int(nbytes)
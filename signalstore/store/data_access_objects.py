@@ -1,16 +1,24 @@
 from abc import ABC, abstractmethod
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import os
 import re
+import threading
+import uuid
+from time import time_ns
+import copy
+import fsspec
+from fsspec.implementations.dirfs import DirFileSystem
 import numpy as np
+import base64
+from collections.abc import Iterator
 import json
 import traceback
-from time import sleep
 import xarray as xr
 
 from signalstore.store.store_errors import *
 
 from signalstore.store.datafile_adapters import AbstractDataFileAdapter, XarrayDataArrayNetCDFAdapter
+from signalstore.store.file_cache import LocalFileCache
 from concurrent.futures import ThreadPoolExecutor
 
 class AbstractDataAccessObject(ABC):
@@ -103,6 +111,23 @@ class MongoDAO(AbstractQueriableDataAccessObject):
         index_field_tuples.append(('time_of_removal', 1))
         self._collection.create_index(index_field_tuples, unique=True) # create index
         self._set_argument_types(index_fields)
+        self._batch_size = 1000 # maximum number of documents per bulk query or update
+        self._managed_index_prefix = 'live__' # names of the partial indexes maintained by ensure_indexes
+        # the unique key of a live document, in index order; used for keyset pagination
+        self._key_fields = [field for field in index_fields if field != 'version_timestamp'] + ['version_timestamp']
+        # (key, function) tables built once; _serialize and _deserialize only visit these keys
+        self._property_serializer_items = (
+            ('time_of_save', datetime_to_microseconds),
+            ('time_of_removal', datetime_to_microseconds),
+            ('version_timestamp', self._serialize_version_timestamp),
+            ('json_schema', dict_to_json_bytes),
+        )
+        self._property_deserializer_items = (
+            ('time_of_save', microseconds_to_datetime),
+            ('time_of_removal', microseconds_to_datetime),
+            ('version_timestamp', self._deserialize_version_timestamp),
+            ('json_schema', json_bytes_to_dict),
+        )
 
     def get(self, version_timestamp=0, **kwargs):
         """Gets a document from the repository.
@@ -148,9 +173,177 @@ class MongoDAO(AbstractQueriableDataAccessObject):
             projection = projection.copy() # avoid mutations to the input dict
             projection['_id'] = 0
 
-        with ThreadPoolExecutor() as executor:
-            documents = list(executor.map(self._deserialize, self._collection.find(filter, projection, **kwargs)))
-        return documents
+        # deserialization is pure python, so a thread pool only adds GIL contention
+        return [self._deserialize(document) for document in self._collection.find(filter, projection, **kwargs)]
+
+    def find_page(self, filter=None, projection=None, page_size=1000, resume_token=None):
+        """Returns one page of documents in index order using keyset pagination.
+        Instead of skipping documents, each page starts right after the key of the last document
+        of the previous page, so every page costs the same as the first one.
+        Arguments:
+            filter {dict} -- The filter to apply to the query.
+            projection {dict} -- The projection to apply to the documents.
+            page_size {int} -- The maximum number of documents per page.
+            resume_token {str} -- The opaque token returned with the previous page (None for the first page).
+        Returns:
+            tuple[list[dict], str] -- The documents and the token of the next page (None after the last page).
+        """
+        self._check_args(filter=filter, projection=projection, page_size=page_size)
+        if page_size < 1:
+            raise MongoDAORangeError(f'page_size must be a positive integer, not {page_size}.')
+        query = self._live_filter(filter)
+        if resume_token is not None:
+            query = {'$and': [query, self._keyset_filter(self._decode_resume_token(resume_token))]}
+        fetch_projection, unrequested_fields = self.projection_with_fields(projection, self._key_fields)
+        cursor = self._collection.find(query, fetch_projection, sort=[(field, 1) for field in self._key_fields], limit=page_size)
+        documents = [self._deserialize(document) for document in cursor]
+        next_token = None
+        if len(documents) == page_size:
+            next_token = self._encode_resume_token(documents[-1])
+        for document in documents:
+            for field in unrequested_fields:
+                document.pop(field, None)
+        return documents, next_token
+
+    def iterate_pages(self, filter=None, projection=None, page_size=1000, resume_token=None):
+        """Yields (documents, resume_token) pages until the documents are exhausted.
+        Passing a yielded resume_token to a later call continues right after that page, e.g. after a crash.
+        """
+        while True:
+            documents, resume_token = self.find_page(filter=filter, projection=projection, page_size=page_size, resume_token=resume_token)
+            if len(documents) > 0:
+                yield documents, resume_token
+            if resume_token is None:
+                return
+
+    @staticmethod
+    def projection_with_fields(projection, fields):
+        """Extends a projection so that the given fields are always fetched.
+        Returns:
+            tuple[dict, list[str]] -- The projection to query with and the fields to strip from the
+                results afterwards because the original projection did not ask for them.
+        """
+        if projection is None:
+            return {'_id': 0}, []
+        inclusion = any(value for key, value in projection.items() if key != '_id')
+        fetch_projection = {key: value for key, value in projection.items() if key not in fields}
+        fetch_projection['_id'] = 0
+        if inclusion:
+            fetch_projection.update({field: 1 for field in fields})
+            return fetch_projection, [field for field in fields if not projection.get(field)]
+        return fetch_projection, [field for field in fields if field in projection]
+
+    def _keyset_filter(self, last_key):
+        # documents whose key sorts after last_key: (k1 > v1) or (k1 == v1 and k2 > v2) or ...
+        clauses = []
+        for i, field in enumerate(self._key_fields):
+            clause = {previous: last_key[previous] for previous in self._key_fields[:i]}
+            if field == 'version_timestamp' and last_key[field] == 0:
+                # unversioned documents (0) sort before all versioned ones; $gt never compares numbers with dates
+                clause[field] = {'$type': 'date'}
+            else:
+                clause[field] = {'$gt': last_key[field]}
+            clauses.append(clause)
+        return {'$or': clauses}
+
+    def _encode_resume_token(self, document):
+        key = [document[field] for field in self._key_fields[:-1]]
+        key.append(datetime_to_microseconds(document['version_timestamp']) or 0)
+        return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+    def _decode_resume_token(self, resume_token):
+        try:
+            key = json.loads(base64.urlsafe_b64decode(resume_token.encode('ascii')))
+            if not isinstance(key, list) or len(key) != len(self._key_fields):
+                raise ValueError(f'expected {len(self._key_fields)} key values')
+        except Exception as e:
+            raise MongoDAOTypeError(f'Invalid resume token {resume_token!r}: {e}')
+        key[-1] = microseconds_to_datetime(key[-1])
+        return dict(zip(self._key_fields, key))
+
+    def update(self, update, version_timestamp=0, **kwargs):
+        """Applies a MongoDB update (e.g. {'$inc': ..., '$max': ...}) to a live document in one atomic operation.
+        Arguments:
+            update {dict} -- The update operators.
+            **kwargs {dict} -- Only the index fields are allowed as keyword arguments.
+        Raises:
+            MongoDAODocumentNotFoundError -- If the document does not exist.
+        Returns:
+            None
+        """
+        self._check_kwargs_are_only_index_args(**kwargs)
+        self._check_args(version_timestamp=version_timestamp, **kwargs)
+        result = self._collection.update_one(
+            {'time_of_removal': None, 'version_timestamp': self._serialize_version_timestamp(version_timestamp), **kwargs},
+            update
+            )
+        if result.matched_count == 0:
+            raise MongoDAODocumentNotFoundError(
+                f'Cannot update document with index fields {kwargs} and version_timestamp {version_timestamp} because it does not exist in repository.'
+            )
+        return None
+
+    def count(self, filter=None):
+        """Counts the live documents matching the filter on the server."""
+        self._check_args(filter=filter)
+        return self._collection.count_documents(self._live_filter(filter))
+
+    def distinct(self, field, filter=None, include_removed=False):
+        """Returns the distinct values of a field over the live documents matching the filter
+        (and over the documents marked for deletion too if include_removed is True)."""
+        self._check_args(filter=filter)
+        values = self._collection.distinct(field, dict(filter or {}) if include_removed else self._live_filter(filter))
+        deserializer = dict(self._property_deserializer_items).get(field)
+        if deserializer is not None:
+            values = [deserializer(value) for value in values]
+        return values
+
+    def aggregate(self, pipeline):
+        """Runs an aggregation pipeline over the live documents.
+        A {'$match': {'time_of_removal': None}} stage is prepended to the pipeline.
+        Arguments:
+            pipeline {list[dict]} -- The aggregation stages.
+        Returns:
+            list[dict] -- The raw (not deserialized) result documents.
+        """
+        if not isinstance(pipeline, list):
+            raise MongoDAOTypeError(f'Invalid type {type(pipeline)} for argument pipeline. Must be list.')
+        return list(self._collection.aggregate([{'$match': {'time_of_removal': None}}, *pipeline]))
+
+    def _live_filter(self, filter=None):
+        filter = {} if filter is None else filter.copy()
+        filter['time_of_removal'] = None
+        return filter
+
+    def explain(self, filter=None):
+        """Returns the query plan MongoDB would use for find(filter).
+        Requires a MongoDB server (mongomock does not implement explain).
+        """
+        self._check_args(filter=filter)
+        return self._collection.find(self._live_filter(filter), {'_id': 0}).explain()
+
+    def ensure_indexes(self, fields):
+        """Maintains one partial index per field over the live (not removed) documents.
+        Indexes created by an earlier call for fields that are no longer listed are dropped.
+        Arguments:
+            fields {list[str | tuple[str]]} -- The fields to index; a tuple of fields makes a compound index.
+        Returns:
+            list[str] -- The names of the maintained indexes.
+        """
+        wanted = {}
+        for field in fields:
+            keys = (field,) if isinstance(field, str) else tuple(field)
+            if len(keys) == 0 or not all(isinstance(key, str) for key in keys):
+                raise MongoDAOTypeError(f'Invalid indexed field {field}. Must be a str or a tuple of str.')
+            wanted[self._managed_index_prefix + '__'.join(keys)] = keys
+        existing = self._collection.index_information()
+        for name in existing:
+            if name.startswith(self._managed_index_prefix) and name not in wanted:
+                self._collection.drop_index(name)
+        for name, keys in wanted.items():
+            if name not in existing:
+                self._collection.create_index([(key, 1) for key in keys], name=name, partialFilterExpression={'time_of_removal': None})
+        return sorted(wanted)
 
     def exists(self, version_timestamp=0, **kwargs):
         self._check_kwargs_are_only_index_args(**kwargs)
@@ -191,6 +384,33 @@ class MongoDAO(AbstractQueriableDataAccessObject):
         result = self._collection.insert_one(self._serialize(document))
         return None
 
+    def add_many(self, documents, timestamp):
+        """Adds many documents with batched insert_many calls, e.g. to publish a staged transaction at once.
+        The documents must carry their version_timestamp (0 for unversioned documents).
+        Arguments:
+            documents {list[dict]} -- The documents to add.
+            timestamp {datetime.timestamp} -- The time_of_save of the documents.
+        Raises:
+            MongoDAODocumentAlreadyExistsError -- If some of the documents already exist; then none are added.
+        Returns:
+            int -- The number of added documents.
+        """
+        self._check_args(timestamp=timestamp)
+        key_filters = []
+        for document in documents:
+            key = {field: document.get(field) for field in self._index_args}
+            key['version_timestamp'] = document.get('version_timestamp') or 0
+            key_filters.append(self._key_filter(key))
+        for batch in batch_list(key_filters, self._batch_size):
+            if self._collection.find_one({'time_of_removal': None, '$or': batch}, {'_id': 1}) is not None:
+                raise MongoDAODocumentAlreadyExistsError(
+                    f'Cannot add documents because some of them already exist in repository: {batch}.'
+                )
+        serialized = [self._serialize({**document, 'time_of_save': timestamp, 'time_of_removal': None}) for document in documents]
+        for batch in batch_list(serialized, self._batch_size):
+            self._collection.insert_many(batch, ordered=True)
+        return len(serialized)
+
     def mark_for_deletion(self, timestamp, version_timestamp=0, **kwargs):
         """Marks a document for deletion.
         Arguments:
@@ -201,7 +421,6 @@ class MongoDAO(AbstractQueriableDataAccessObject):
         Returns:
             None
         """
-        sleep(0.0000001) # sleep for a very short time to avoid
         self._check_args(timestamp=timestamp, version_timestamp=version_timestamp, **kwargs)
         self._check_kwargs_are_only_index_args(**kwargs)
         document = self.get(**kwargs, version_timestamp=version_timestamp)
@@ -213,6 +432,112 @@ class MongoDAO(AbstractQueriableDataAccessObject):
             self._collection.update_one({'time_of_removal': None, **kwargs}, {'$set':{"time_of_removal": datetime_to_microseconds(timestamp)}})
             return None
 
+    def mark_many_for_deletion(self, keys, timestamp):
+        """Marks many documents for deletion with batched update_many calls.
+        Keys that occur more than once are marked once.
+        Arguments:
+            keys {list[dict]} -- The index fields (and optionally version_timestamp) of each document.
+            timestamp {datetime.timestamp} -- The timestamp to mark the documents for deletion with.
+        Raises:
+            MongoDAODocumentNotFoundError -- If some of the documents do not exist; then none are marked.
+        Returns:
+            int -- The number of documents marked for deletion.
+        """
+        self._check_args(timestamp=timestamp)
+        key_filters = list({self._key_id(key_filter): key_filter for key_filter in map(self._key_filter, keys)}.values())
+        index_projection = {field: 1 for field in self._index_args | {'version_timestamp'}}
+        index_projection['_id'] = 0
+        # check before marking, so that a missing document does not leave the others half marked
+        live = set()
+        for batch in batch_list(key_filters, self._batch_size):
+            for document in self._collection.find({'time_of_removal': None, '$or': batch}, index_projection):
+                live.add(self._key_id(document))
+        missing = [key_filter for key_filter in key_filters if self._key_id(key_filter) not in live]
+        if missing:
+            raise MongoDAODocumentNotFoundError(
+                f'Cannot mark documents for deletion that do not exist in the repository: {missing}. No documents were marked.'
+            )
+        count = 0
+        for batch in batch_list(key_filters, self._batch_size):
+            result = self._collection.update_many(
+                {'time_of_removal': None, '$or': batch},
+                {'$set': {'time_of_removal': datetime_to_microseconds(timestamp)}}
+                )
+            count += result.modified_count
+        if count != len(key_filters):
+            # another process removed some of the documents after they were checked
+            raise MongoDAODocumentNotFoundError(
+                f'Only {count} of {len(key_filters)} documents could be marked for deletion. The remaining documents were removed concurrently.'
+            )
+        return count
+
+    def restore_many(self, keys):
+        """Restores the most recently deleted version of many documents with batched queries and updates.
+        A document whose key is taken by a live document (e.g. one added again after the removal) cannot
+        be restored; it is skipped and reported, and the other documents are restored.
+        Arguments:
+            keys {list[dict]} -- The index fields (and optionally version_timestamp) of each document.
+        Raises:
+            MongoDAORangeError -- If no deleted instances exist for some of the documents; then none are restored.
+        Returns:
+            list[dict] -- The keys of the documents that were skipped because a live document has their key.
+        """
+        key_filters = [self._key_filter(key) for key in keys]
+        index_projection = {field: 1 for field in self._index_args | {'version_timestamp', 'time_of_removal'}}
+        index_projection['_id'] = 0
+        # keys taken by live documents are skipped
+        live = set()
+        for batch in batch_list(key_filters, self._batch_size):
+            for document in self._collection.find({'time_of_removal': None, '$or': batch}, index_projection):
+                live.add(self._key_id(document))
+        key_ids = [self._key_id(key_filter) for key_filter in key_filters]
+        conflicts = [key for key, key_id in zip(keys, key_ids) if key_id in live]
+        key_filters = [key_filter for key_filter, key_id in zip(key_filters, key_ids) if key_id not in live]
+        # pick the most recently removed document for each key
+        most_recent = {}
+        for batch in batch_list(key_filters, self._batch_size):
+            removed = self._collection.find(
+                {'time_of_removal': {'$ne': None}, '$or': batch},
+                index_projection,
+                sort=[('time_of_removal', -1)]
+                )
+            for document in removed:
+                most_recent.setdefault(self._key_id(document), document)
+        if len(most_recent) != len(key_filters):
+            raise MongoDAORangeError(
+                f'Cannot restore documents: deleted instances were found for only {len(most_recent)} of {len(key_filters)} documents.'
+            )
+        # documents removed together share a time_of_removal, so group them into one update each
+        by_time_of_removal = {}
+        for document in most_recent.values():
+            time_of_removal = document.pop('time_of_removal')
+            by_time_of_removal.setdefault(time_of_removal, []).append(document)
+        for time_of_removal, documents in by_time_of_removal.items():
+            for batch in batch_list(documents, self._batch_size):
+                self._collection.update_many(
+                    {'time_of_removal': time_of_removal, '$or': batch},
+                    {'$set': {'time_of_removal': None}}
+                    )
+        return conflicts
+
+    def _key_id(self, key):
+        """Returns a hashable id of a document's key, with datetimes at MongoDB's millisecond precision."""
+        key_id = []
+        for field in sorted(self._index_args | {'version_timestamp'}):
+            value = key.get(field)
+            if isinstance(value, datetime):
+                value = datetime_to_microseconds(value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)) // 1000
+            key_id.append((field, value))
+        return tuple(key_id)
+
+    def _key_filter(self, key):
+        """Returns a query filter for one document from its index fields."""
+        key = dict(key)
+        version_timestamp = key.pop('version_timestamp', 0)
+        self._check_kwargs_are_only_index_args(**key)
+        self._check_args(version_timestamp=version_timestamp, **key)
+        return {**key, 'version_timestamp': self._serialize_version_timestamp(version_timestamp)}
+
     def list_marked_for_deletion(self, time_threshold=None):
         """Returns a list of all deleted documents from the repository."""
         self._check_args(time_threshold=time_threshold)
@@ -266,15 +591,22 @@ class MongoDAO(AbstractQueriableDataAccessObject):
 
 
     def purge(self, time_threshold=None):
-        """Purges deleted documents from the repository older than the time threshold."""
+        """Purges deleted documents from the repository older than the time threshold.
+        The deletion runs server side as a single delete_many.
+        """
         self._check_args(time_threshold=time_threshold)
+        result = self._collection.delete_many(self._trash_filter(time_threshold))
+        return result.deleted_count
+
+    def count_marked_for_deletion(self, time_threshold=None):
+        """Returns the number of deleted documents that purge would remove, without fetching them."""
+        self._check_args(time_threshold=time_threshold)
+        return self._collection.count_documents(self._trash_filter(time_threshold))
+
+    def _trash_filter(self, time_threshold=None):
         if time_threshold is None:
-            result = self._collection.delete_many({"time_of_removal": {"$ne": None}})
-            count = result.deleted_count
-        else:
-            result = self._collection.delete_many({"time_of_removal": {"$lt": datetime_to_microseconds(time_threshold)}})
-            count = result.deleted_count
-        return count
+            return {"time_of_removal": {"$ne": None}}
+        return {"time_of_removal": {"$lt": datetime_to_microseconds(time_threshold)}}
 
     def _check_args(self, **kwargs):
         for key, value in kwargs.items():
@@ -299,17 +631,17 @@ class MongoDAO(AbstractQueriableDataAccessObject):
 
     def _serialize(self, document):
         """Serializes a document object.
+        Only the keys with a property serializer are touched.
         Arguments:
             document {dict} -- The document object to serialize.
         Returns:
             dict -- The serialized document.
         """
         result = document.copy()
-        for key, value in document.items():
-            serializer = self.property_serializers.get(key)
-            if serializer is not None:
+        for key, serializer in self._property_serializer_items:
+            if key in result:
                 try:
-                    result[key] = self.property_serializers[key](value)
+                    result[key] = serializer(result[key])
                 except Exception as e:
                     raise MongoDAOUncaughtError(
                         f'An error occurred while serializing property {key}\n\nof document {document}.\n\nThe error was: {e}'
@@ -318,17 +650,17 @@ class MongoDAO(AbstractQueriableDataAccessObject):
 
     def _deserialize(self, document):
         """Deserializes a document object.
+        Only the keys with a property deserializer are touched.
         Arguments:
             document {dict} -- The document object to deserialize.
         Returns:
             dict -- The deserialized document.
         """
         result = document.copy()
-        for key, value in result.items():
-            deserializer = self.property_deserializers.get(key)
-            if deserializer is not None:
+        for key, deserializer in self._property_deserializer_items:
+            if key in result:
                 try:
-                    result[key] = self.property_deserializers[key](value)
+                    result[key] = deserializer(result[key])
                 except Exception as e:
                     raise MongoDAOUncaughtError(
                         f'An uncaught error occurred while deserializing property: "{key}" from document: \n\n{document}.\n\nThe error was: {e}'
@@ -337,21 +669,11 @@ class MongoDAO(AbstractQueriableDataAccessObject):
 
     @property
     def property_serializers(self):
-        return {
-            'time_of_save': datetime_to_microseconds,
-            'time_of_removal': datetime_to_microseconds,
-            'version_timestamp': self._serialize_version_timestamp,
-            'json_schema': dict_to_json_bytes,
-        }
+        return dict(self._property_serializer_items)
 
     @property
     def property_deserializers(self):
-        return {
-            'time_of_save': microseconds_to_datetime,
-            'time_of_removal': microseconds_to_datetime,
-            'version_timestamp': self._deserialize_version_timestamp,
-            'json_schema': json_bytes_to_dict,
-        }
+        return dict(self._property_deserializer_items)
 
     @property
     def collection_name(self):
@@ -370,6 +692,7 @@ class MongoDAO(AbstractQueriableDataAccessObject):
             'override_existing_document': (bool),
             'not_exist_ok': (bool),
             'document': (dict),
+            'page_size': (int),
         }
         # set all the index names as argument options with string type
         for field in index_fields:
@@ -422,7 +745,18 @@ class FileSystemDAOUncaughtError(UncaughtError):
     pass
 
 class FileSystemDAO(AbstractDataAccessObject):
-    def __init__(self, filesystem, project_dir, default_data_adapter=XarrayDataArrayNetCDFAdapter()):
+    # versions with identical payloads share one blob; their own path holds a small reference file
+    _blob_dirname = '_blobs'
+    _blob_ref_header = b'signalstore-blob-ref\n'
+    _blob_ref_max_bytes = 2**20
+    _temporary_blob_prefix = 'writing-' # blobs are written under a temporary name and renamed into place
+    # files of uncommitted (staged) transactions; promoted into the project directory on commit
+    _staging_dirname = '_staging'
+    # small objects packed together into one file; their records hold the (pack, offset, length) of each object
+    _pack_dirname = '_packs'
+    _pack_extension = '.pack'
+
+    def __init__(self, filesystem, project_dir, default_data_adapter=XarrayDataArrayNetCDFAdapter(), file_cache=None, deduplicate=False):
         # add / to end of directory if it doesn't already exist
         self._fs = filesystem
         # make sure the project directory exists
@@ -431,13 +765,31 @@ class FileSystemDAO(AbstractDataAccessObject):
         self._directory = project_dir
         default_data_adapter.set_filesystem(self._fs)
         self._default_data_adapter = default_data_adapter
+        if not isinstance(file_cache, (LocalFileCache, type(None))):
+            raise FileSystemDAOConfigError(
+                f"file_cache must be a LocalFileCache or None, not {type(file_cache)}."
+            )
+        self._file_cache = file_cache
+        if not isinstance(deduplicate, bool):
+            raise FileSystemDAOConfigError(
+                f"deduplicate must be a bool, not {type(deduplicate)}."
+            )
+        self._deduplicate = deduplicate
+        self._blob_dir = self._directory + '/' + self._blob_dirname
+        self._has_blobs = deduplicate or self._fs.exists(self._blob_dir)
+        self._pack_dir = self._directory + '/' + self._pack_dirname
 
-    def get(self, schema_ref, data_name, version_timestamp=0, nth_most_recent=1, data_adapter=None):
+    def get(self, schema_ref, data_name, version_timestamp=0, nth_most_recent=1, data_adapter=None, lazy=False, blob_ref=None):
         """Gets an object from the repository.
         Arguments:
             schema_ref {str} -- The type of object to get.
             data_name {str} -- The name of the object to get.
             version_timestamp {str} -- The version_timestamp of the object to get.
+            lazy {bool} -- Open the file lazily (see the data adapter's open_file), so that only the
+                           data that is accessed is read.
+            blob_ref {dict | bool} -- The blob reference of the object as returned by add (e.g. kept in its record),
+                                      or False if the object holds its own data. If None, the file at the
+                                      object's path is opened to find out.
         Raises:
             FileSystemDAOFileNotFoundError -- If the object is not found.
         Returns:
@@ -457,10 +809,89 @@ class FileSystemDAO(AbstractDataAccessObject):
         path = self._get_file_path(schema_ref, data_name, version_timestamp, nth_most_recent, data_adapter)
         if path is None:
             return None
-        data_object = data_adapter.read_file(path)
+        if blob_ref is None:
+            blob_ref = self._read_blob_ref(path)
+        if not blob_ref:
+            data_object = self._read_file(path, data_adapter, lazy)
+        else:
+            data_object = self._read_file(self._blob_dir + '/' + blob_ref['blob'], data_adapter, lazy)
+            if blob_ref['name'] is not None:
+                data_object.name = blob_ref['name']
+            data_object.attrs = blob_ref['attrs']
         data_object = self._deserialize(data_object)
         return data_object
 
+    def _read_file(self, path, data_adapter, lazy=False):
+        """Reads a file with the data adapter, going through the local file cache if one is configured.
+        Only versioned files and blobs are cached because they are immutable once written;
+        unversioned paths can be reused after the object is marked for deletion.
+        """
+        read = data_adapter.open_file if lazy else data_adapter.read_file
+        if self._file_cache is None or not (self._is_versioned_path(path) or str(path).startswith(self._blob_dir + '/')):
+            return read(path)
+        key = self._file_cache.make_key(self._absolute_url(path))
+        local_path = self._file_cache.get(key)
+        if local_path is None:
+            local_path = self._file_cache.put(key, self._fs, path)
+            if local_path is None:
+                return read(path) # too large for the cache
+        local_adapter = copy.copy(data_adapter)
+        local_adapter.set_filesystem(fsspec.filesystem('file'))
+        try:
+            return local_adapter.open_file(local_path) if lazy else local_adapter.read_file(local_path)
+        except FileNotFoundError:
+            # the entry was evicted by another process between lookup and read
+            return read(path)
+
+    @staticmethod
+    def _is_versioned_path(path):
+        return '__version_' in os.path.basename(str(path))
+
+    def _invalidate_cached(self, path):
+        """Drops the cached copy of a file that was replaced by a blob reference (see update_attrs)."""
+        if self._file_cache is not None:
+            self._file_cache.invalidate(self._file_cache.make_key(self._absolute_url(path)))
+
+    def scan(self, keys, columns=None, filter=None, data_adapter=None):
+        """Reads the files of many objects as a single dataset (e.g. all spike times of an animal).
+        Arguments:
+            keys {list[dict]} -- The schema_ref, data_name and (optionally) version_timestamp and blob_ref
+                                 (see get) of each object.
+            columns {list[str]} -- The columns to read (all if None).
+            filter -- A row filter pushed down to the files (see the data adapter's scan).
+            data_adapter {AbstractDataFileAdapter} -- The data adapter of the files; it must support scanning.
+        Raises:
+            FileSystemDAOTypeError -- If the data adapter does not support scanning.
+            FileSystemDAOFileNotFoundError -- If the file of an object is missing.
+        Returns:
+            The rows of all objects with a data_name column naming the object of each row
+            (e.g. a pyarrow.Table), or None if keys is empty.
+        """
+        self._check_args(data_adapter=data_adapter)
+        if data_adapter is None:
+            data_adapter = self._default_data_adapter
+        else:
+            data_adapter.set_filesystem(self._fs)
+        if not data_adapter.supports_scan:
+            raise FileSystemDAOTypeError(
+                f"Cannot scan files with {type(data_adapter).__name__}. Use a data adapter that supports scanning (e.g. PandasDataFrameParquetAdapter)."
+            )
+        if len(keys) == 0:
+            return None
+        paths = []
+        for key in keys:
+            path = self._get_file_path(key["schema_ref"], key["data_name"], key.get("version_timestamp") or 0, 1, data_adapter)
+            if path is None:
+                raise FileSystemDAOFileNotFoundError(
+                    f"Cannot scan the object with schema_ref: {key['schema_ref']}, data_name: {key['data_name']} and version_timestamp: {key.get('version_timestamp') or 0} because its file does not exist."
+                )
+            blob_ref = key.get('blob_ref')
+            if blob_ref is None:
+                blob_ref = self._read_blob_ref(path)
+            paths.append(self._blob_dir + '/' + blob_ref['blob'] if blob_ref else path)
+        labels = {"data_name": [key["data_name"] for key in keys]}
+        return data_adapter.scan(paths, columns=columns, filter=filter, labels=labels)
+
     def _get_file_path(self, schema_ref, data_name, version_timestamp, nth_most_recent, data_adapter):
         if data_adapter is None:
             data_adapter = self._default_data_adapter
@@ -510,6 +941,14 @@ class FileSystemDAO(AbstractDataAccessObject):
                         return None
         return path
 
+    def _absolute_url(self, path):
+        """Returns a URL for the path that is unique across filesystems (used for cache keys)."""
+        filesystem, path = self._fs, str(path)
+        while isinstance(filesystem, DirFileSystem):
+            path = filesystem._join(path)
+            filesystem = filesystem.fs
+        return filesystem.unstrip_protocol(path)
+
     def exists(self, schema_ref, data_name, version_timestamp=0, data_adapter=None):
         """Checks if an object exists in the repository.
         Arguments:
@@ -520,9 +959,9 @@ class FileSystemDAO(AbstractDataAccessObject):
             bool -- True if the object exists, else False.
         """
         self._check_args(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, data_adapter=data_adapter)
-        # try getting the object
+        # only filesystem metadata is needed; the file itself is never opened
         try:
-            return self.get(schema_ref, data_name, version_timestamp, data_adapter=data_adapter) is not None
+            return self._path_exists(schema_ref, data_name, version_timestamp, data_adapter)
         except FileSystemDAOFileNotFoundError as e:
             raise FileSystemDAOFileNotFoundError(
                 f"An error occurred while checking if the object with schema_ref: {schema_ref}, data_name: {data_name}, and version_timestamp: {version_timestamp} exists in the repository. Traceback was: {traceback.format_exc()}"
@@ -538,23 +977,33 @@ class FileSystemDAO(AbstractDataAccessObject):
         paths = filter(lambda path: '_time_of_removal_' not in path, glob)
         return len(list(paths))
 
-    def add(self, data_object, data_adapter=None):
+    def add(self, data_object, data_adapter=None, dim='time', blob_ref=None):
         """Adds an object to the repository.
+        Objects larger than memory can be added as a dask-backed DataArray, which the zarr adapter
+        writes chunk by chunk, or as an iterator (e.g. a generator) of chunks. The first chunk carries
+        the attrs of the object and later chunks are appended along dim, so only one chunk is in memory.
         Arguments:
-            data_object -- The object to add.
+            data_object -- The object to add, or an iterator of chunks of it.
             data_adapter -- The data adapter to use.
                             If none, the default data adapter is used.
                             The default data adapter is given to the constructor.
+            dim {str} -- The dimension along which the chunks of an iterator are concatenated.
+            blob_ref {dict | bool} -- The result of make_blob_ref for the object, which saves hashing it again
+                                      (False if it is not deduplicated). If None, it is made here.
         Raises:
             FileSystemDAOFileAlreadyExistsError -- If the object already exists.
+            FileSystemDAOTypeError -- If chunks are given to a data adapter that cannot append.
         Returns:
-            None
+            dict -- The blob reference written at the object's path if its payload was deduplicated, else None.
+                    Callers that keep records store it and pass it to get, update_attrs and scan.
         """
-        self._check_args(data_adapter=data_adapter)
+        self._check_args(data_adapter=data_adapter, dim=dim)
         if data_adapter is None:
             data_adapter = self._default_data_adapter
         else:
             data_adapter.set_filesystem(self._fs)
+        if isinstance(data_object, Iterator):
+            return self._add_chunks(data_object, data_adapter, dim)
         # separately check object using data adapter
         if not isinstance(data_object, data_adapter.data_object_type):
             raise FileSystemDAOTypeError(
@@ -565,9 +1014,8 @@ class FileSystemDAO(AbstractDataAccessObject):
         idkwargs = data_adapter.get_id_kwargs(data_object) # (schema_ref, data_name, version_timestamp)
         path = self.make_filepath(**idkwargs, data_adapter=data_adapter)
 
-        # hack to bypass current issue with exists function
         try:
-            if self.exists(**idkwargs, data_adapter=data_adapter):
+            if self._path_exists(**idkwargs, data_adapter=data_adapter):
                 print(f'Skipping object with path "{path}" because it already exists in repository.')
                 return None
                 # raise FileSystemDAOFileAlreadyExistsError(
@@ -575,10 +1023,313 @@ class FileSystemDAO(AbstractDataAccessObject):
                 # )
         except: 
             pass
+        return self._write_object(path, data_object, data_adapter, blob_ref)
+
+    def make_blob_ref(self, data_object, data_adapter=None):
+        """Returns the blob reference add stores at the path of an object whose payload is deduplicated.
+        Only versions are deduplicated: they are immutable, while unversioned objects can be appended to.
+        Arguments:
+            data_object -- The object to add.
+            data_adapter -- The data adapter to use.
+        Returns:
+            dict -- {'blob', 'name', 'attrs'}, or None if the object is not deduplicated.
+        """
+        if data_adapter is None:
+            data_adapter = self._default_data_adapter
+        if not self._deduplicate or not data_object.attrs.get('version_timestamp'):
+            return None
+        digest = data_adapter.content_hash(data_object)
+        if digest is None:
+            return None
+        name = data_object.name if data_object.name is not None else f"{data_object.attrs.get('schema_ref')}__{data_object.attrs.get('data_name')}"
+        # attrs are stored as strings, like the data adapters store them in files
+        attrs = self._serialize_attrs(data_object.attrs)
+        return {'blob': digest + data_adapter.file_extension, 'name': str(name), 'attrs': {str(k): str(v) for k, v in attrs.items()}}
+
+    def _write_object(self, path, data_object, data_adapter, blob_ref=None):
+        if blob_ref is None:
+            blob_ref = self.make_blob_ref(data_object, data_adapter)
         data_object = self._serialize(data_object)
-        #get os environment variable 'DEBUG' to check if we should print the data_object
-        data_adapter.write_file(path=path, data_object=data_object)
+        if not blob_ref:
+            data_adapter.write_file(path=path, data_object=data_object)
+        else:
+            self._write_blob(blob_ref['blob'], data_object, data_adapter)
+            self._write_blob_ref_file(path, blob_ref)
         self._deserialize(data_object) # undo the serialization in case the object is mutated
+        return blob_ref or None
+
+    def stage(self, data_object, staging_id, data_adapter=None, blob_ref=None):
+        """Writes an object into a staging area instead of the project directory, where readers cannot see it.
+        Staged files are published with promote or thrown away with discard_staging.
+        Arguments:
+            data_object -- The object to stage.
+            staging_id {str} -- The staging area (e.g. one per transaction).
+            data_adapter -- The data adapter to use.
+            blob_ref {dict | bool} -- The result of make_blob_ref for the object (see add).
+        Raises:
+            FileSystemDAOTypeError -- If the object does not match the data adapter.
+        Returns:
+            tuple[str, str] -- The staging path and the path the file is promoted to.
+        """
+        self._check_args(data_adapter=data_adapter, staging_id=staging_id)
+        if data_adapter is None:
+            data_adapter = self._default_data_adapter
+        else:
+            data_adapter.set_filesystem(self._fs)
+        if not isinstance(data_object, data_adapter.data_object_type):
+            raise FileSystemDAOTypeError(
+                f"Type mismatch: Received {type(data_object).__name__}, but expected {data_adapter.data_object_type.__name__}."
+            )
+        if data_object.attrs.get('version_timestamp') is None:
+            data_object.attrs['version_timestamp'] = 0
+        idkwargs = data_adapter.get_id_kwargs(data_object)
+        path = self.make_filepath(**idkwargs, data_adapter=data_adapter)
+        staging_dir = self._directory + '/' + self._staging_dirname + '/' + staging_id
+        self._fs.makedirs(staging_dir, exist_ok=True)
+        staging_path = staging_dir + '/' + os.path.basename(path)
+        self._write_object(staging_path, data_object, data_adapter, blob_ref)
+        return staging_path, path
+
+    def promote(self, staged, batch_size=1000):
+        """Moves staged files to their paths in the project directory with concurrent renames.
+        Arguments:
+            staged {list[tuple[str, str]]} -- (staging path, path) pairs as returned by stage.
+            batch_size {int} -- The number of renames per worker task.
+        Raises:
+            FileSystemDAOFileAlreadyExistsError -- If one of the paths is taken; then nothing is moved.
+        Returns:
+            int -- The number of promoted files.
+        """
+        taken = [path for _, path in staged if self._fs.exists(path)]
+        if taken:
+            raise FileSystemDAOFileAlreadyExistsError(
+                f'Cannot promote staged files because these paths already exist in repository: {taken}.'
+            )
+        return self._move_all(staged, batch_size)
+
+    def demote(self, staged, batch_size=1000):
+        """Moves promoted files back into their staging area, e.g. when their records could not be published.
+        Arguments:
+            staged {list[tuple[str, str]]} -- (staging path, path) pairs as returned by stage and passed to promote.
+            batch_size {int} -- The number of renames per worker task.
+        Returns:
+            int -- The number of demoted files.
+        """
+        return self._move_all([(path, staging_path) for staging_path, path in staged], batch_size)
+
+    def _move_all(self, moves, batch_size):
+        """Renames (source, destination) pairs concurrently; if a rename fails, the files already moved are moved back."""
+        moved = []
+        def move(batch):
+            for source, destination in batch:
+                self._fs.mv(source, destination, recursive=True)
+                moved.append((source, destination))
+        try:
+            with ThreadPoolExecutor() as executor:
+                list(executor.map(move, batch_list(moves, batch_size)))
+        except Exception:
+            for source, destination in moved:
+                self._fs.mv(destination, source, recursive=True)
+            raise
+        return len(moves)
+
+    def discard_staging(self, staging_id=None):
+        """Deletes a staging area, or all staging areas if staging_id is None (e.g. after a crash)."""
+        self._check_args(staging_id=staging_id)
+        staging_dir = self._directory + '/' + self._staging_dirname
+        if staging_id is not None:
+            staging_dir += '/' + staging_id
+        if self._fs.exists(staging_dir):
+            self._fs.rm(staging_dir, recursive=True)
+
+    def _write_blob(self, blob, data_object, data_adapter):
+        """Writes the payload as a blob unless an identical one exists. The blob is written under a temporary
+        name and renamed into place, so that a blob that exists is always complete."""
+        blob_path = self._blob_dir + '/' + blob
+        if not self._fs.exists(self._blob_dir):
+            self._fs.makedirs(self._blob_dir, exist_ok=True)
+        self._has_blobs = True
+        if self._fs.exists(blob_path):
+            return
+        temporary_path = f"{self._blob_dir}/{self._temporary_blob_prefix}{uuid.uuid4().hex}-{blob}"
+        data_adapter.write_file(path=temporary_path, data_object=data_object.copy(deep=False))
+        if self._fs.exists(blob_path):
+            # an identical blob was written concurrently
+            self._fs.rm(temporary_path, recursive=True)
+        else:
+            self._fs.mv(temporary_path, blob_path, recursive=True)
+
+    def _write_blob_ref_file(self, path, blob_ref):
+        with self._fs.open(path, mode='wb') as f:
+            f.write(self._blob_ref_header + json.dumps(blob_ref).encode())
+
+    def update_attrs(self, schema_ref, data_name, set_attrs, unset_attrs=(), version_timestamp=0, data_adapter=None, blob_ref=None):
+        """Sets and removes attrs of a stored object without rewriting its array data.
+        Adapters that support it (e.g. zarr) update the attrs of unversioned objects in place. Otherwise
+        the data file is moved (not copied) into the blob store and replaced by a reference file carrying
+        the new attrs, the same layout that deduplicated versions use. Versioned files are never changed
+        in place because other processes may hold cached copies of them (see _read_file).
+        Arguments:
+            schema_ref {str} -- The type of the object.
+            data_name {str} -- The name of the object.
+            set_attrs {dict} -- The attrs to set.
+            unset_attrs {list[str]} -- The attrs to remove.
+            version_timestamp {datetime | int} -- The version of the object.
+            data_adapter -- The data adapter of the file.
+            blob_ref {dict | bool} -- The current blob reference of the object (see get).
+        Raises:
+            FileSystemDAOFileNotFoundError -- If the object does not exist.
+        Returns:
+            dict -- The new blob reference of the object, or None if its file was updated in place.
+        """
+        self._check_args(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, data_adapter=data_adapter)
+        if data_adapter is None:
+            data_adapter = self._default_data_adapter
+        else:
+            data_adapter.set_filesystem(self._fs)
+        path = self._get_file_path(schema_ref, data_name, version_timestamp, 1, data_adapter)
+        if path is None:
+            raise FileSystemDAOFileNotFoundError(
+                f'Cannot update the attrs of object with schema_ref: {schema_ref}, data_name: {data_name}, and version_timestamp: {version_timestamp} because it does not exist in repository.'
+            )
+        # serialize the values like add does, so that get deserializes them to the same values
+        set_attrs = self._serialize_attrs(set_attrs)
+        if blob_ref is None:
+            blob_ref = self._read_blob_ref(path)
+        if not blob_ref and data_adapter.supports_attrs_update and not self._is_versioned_path(path):
+            data_adapter.update_attrs(path, set_attrs, unset_attrs)
+            return None
+        if blob_ref:
+            blob_ref = {**blob_ref, 'attrs': dict(blob_ref['attrs'])}
+        else:
+            data_object = data_adapter.read_file(path)
+            blob = f"moved-{time_ns()}-{os.path.basename(str(path))}"
+            if not self._fs.exists(self._blob_dir):
+                self._fs.makedirs(self._blob_dir, exist_ok=True)
+            self._fs.mv(str(path), self._blob_dir + '/' + blob, recursive=True)
+            self._has_blobs = True
+            # tables (e.g. DataFrames) have no name
+            name = getattr(data_object, 'name', None)
+            blob_ref = {'blob': blob, 'name': None if name is None else str(name), 'attrs': {str(k): str(v) for k, v in data_object.attrs.items()}}
+        blob_ref['attrs'].update({str(k): str(v) for k, v in set_attrs.items()})
+        for key in unset_attrs:
+            blob_ref['attrs'].pop(key, None)
+        self._write_blob_ref_file(path, blob_ref)
+        # the cached copy is still valid, but nothing reads it any more
+        self._invalidate_cached(path)
+        return blob_ref
+
+    def _read_blob_ref(self, path, size=None):
+        """Returns the blob reference stored at path, or None if path holds the data itself."""
+        if not self._has_blobs and self._file_cache is not None:
+            # another process may have moved a cached versioned file into the blob store since
+            self._has_blobs = self._fs.exists(self._blob_dir)
+        if not self._has_blobs or (size is not None and size > self._blob_ref_max_bytes):
+            return None
+        try:
+            with self._fs.open(path, mode='rb') as f:
+                if f.read(len(self._blob_ref_header)) != self._blob_ref_header:
+                    return None
+                return json.loads(f.read())
+        except (IsADirectoryError, FileNotFoundError):
+            return None # directory stores (e.g. zarr) are never references
+
+    def _add_chunks(self, chunks, data_adapter, dim):
+        """Writes the first chunk as a new file and appends the others to it; a partial file is removed on failure."""
+        if not data_adapter.supports_append:
+            raise FileSystemDAOTypeError(
+                f"Cannot add an iterator of chunks with {type(data_adapter).__name__} because it does not support appending. Use a data adapter that does (e.g. XarrayDataArrayZarrAdapter)."
+            )
+        try:
+            first_chunk = next(chunks)
+        except StopIteration:
+            raise FileSystemDAOTypeError("Cannot add an empty iterator of chunks.")
+        if not isinstance(first_chunk, data_adapter.data_object_type):
+            raise FileSystemDAOTypeError(
+                f"Type mismatch: Received chunks of type {type(first_chunk).__name__}, but expected {data_adapter.data_object_type.__name__}."
+            )
+        if first_chunk.attrs.get('version_timestamp') is None:
+            first_chunk.attrs['version_timestamp'] = 0
+        idkwargs = data_adapter.get_id_kwargs(first_chunk)
+        path = self.make_filepath(**idkwargs, data_adapter=data_adapter)
+        if self._path_exists(**idkwargs, data_adapter=data_adapter):
+            raise FileSystemDAOFileAlreadyExistsError(
+                f'Cannot add object with path "{path}" because it already exists in repository.'
+            )
+        first_chunk = self._serialize(first_chunk)
+        try:
+            data_adapter.write_file(path=path, data_object=first_chunk)
+            for chunk in chunks:
+                data_adapter.append_file(path, chunk, dim)
+        except BaseException:
+            if self._fs.exists(path):
+                self._fs.rm(path, recursive=True)
+            raise
+        finally:
+            self._deserialize(first_chunk)
+        return None
+
+    def append(self, schema_ref, data_name, data_object, dim='time', data_adapter=None):
+        """Appends data to an existing unversioned object along a dimension, without rewriting it.
+        Versioned objects are immutable (and may be cached), so they cannot be appended to.
+        Arguments:
+            schema_ref {str} -- The type of the object to grow.
+            data_name {str} -- The name of the object to grow.
+            data_object -- The data to append; all dimensions except dim must match the stored object.
+            dim {str} -- The dimension to append along.
+            data_adapter -- The data adapter of the file; it must support appending (e.g. the zarr adapter).
+        Raises:
+            FileSystemDAOFileNotFoundError -- If the object does not exist.
+            FileSystemDAOTypeError -- If the data adapter cannot append to files.
+        Returns:
+            None
+        """
+        self._check_args(schema_ref=schema_ref, data_name=data_name, data_adapter=data_adapter)
+        if data_adapter is None:
+            data_adapter = self._default_data_adapter
+        else:
+            data_adapter.set_filesystem(self._fs)
+        if not data_adapter.supports_append:
+            raise FileSystemDAOTypeError(
+                f'Cannot append to objects stored with {type(data_adapter).__name__}. Use a data adapter that supports appending, e.g. XarrayDataArrayZarrAdapter.'
+            )
+        path = self._get_file_path(schema_ref, data_name, 0, 1, data_adapter)
+        if path is None:
+            raise FileSystemDAOFileNotFoundError(
+                f'Cannot append to object with schema_ref: {schema_ref} and data_name: {data_name} because it does not exist in repository.'
+            )
+        data_adapter.append_file(path, data_object, dim)
+        return None
+
+    def truncate(self, schema_ref, data_name, size, dim='time', data_adapter=None):
+        """Shrinks an unversioned object back to its first size entries along a dimension, e.g. to undo an append.
+        Arguments:
+            schema_ref {str} -- The type of the object to shrink.
+            data_name {str} -- The name of the object to shrink.
+            size {int} -- The length to keep along dim.
+            dim {str} -- The dimension to shrink.
+            data_adapter -- The data adapter of the file; it must support appending (e.g. the zarr adapter).
+        Raises:
+            FileSystemDAOFileNotFoundError -- If the object does not exist.
+            FileSystemDAOTypeError -- If the data adapter cannot append to files.
+        Returns:
+            None
+        """
+        self._check_args(schema_ref=schema_ref, data_name=data_name, data_adapter=data_adapter)
+        if data_adapter is None:
+            data_adapter = self._default_data_adapter
+        else:
+            data_adapter.set_filesystem(self._fs)
+        if not data_adapter.supports_append:
+            raise FileSystemDAOTypeError(
+                f'Cannot truncate objects stored with {type(data_adapter).__name__}. Use a data adapter that supports appending, e.g. XarrayDataArrayZarrAdapter.'
+            )
+        path = self._get_file_path(schema_ref, data_name, 0, 1, data_adapter)
+        if path is None:
+            raise FileSystemDAOFileNotFoundError(
+                f'Cannot truncate object with schema_ref: {schema_ref} and data_name: {data_name} because it does not exist in repository.'
+            )
+        data_adapter.truncate_file(path, dim, size)
         return None
 
     def mark_for_deletion(self, schema_ref, data_name, time_of_removal, version_timestamp=0, data_adapter=None):
@@ -596,7 +1347,6 @@ class FileSystemDAO(AbstractDataAccessObject):
         Returns:
             None
         """
-        sleep(0.0000001) # to prevent non-unique time_of_removal values
         self._check_args(time_of_removal=time_of_removal,
                          schema_ref=schema_ref,
                          data_name=data_name,
@@ -630,6 +1380,53 @@ class FileSystemDAO(AbstractDataAccessObject):
             )
         return None
 
+    def mark_many_for_deletion(self, keys, time_of_removal, data_adapter=None):
+        """Marks many objects for deletion, renaming their files concurrently.
+        Existence is checked with filesystem metadata only; file contents are never read.
+        Arguments:
+            keys {list[dict]} -- The schema_ref, data_name and (optionally) version_timestamp of each object.
+            time_of_removal {datetime.timestamp} -- The timestamp to mark the objects for deletion with.
+            data_adapter {AbstractDataFileAdapter} -- The data adapter to use.
+        Raises:
+            FileSystemDAOFileNotFoundError -- If one of the objects does not exist; then the files that were
+                                              already renamed are restored and none are marked.
+        Returns:
+            int -- The number of objects marked for deletion.
+        """
+        self._check_args(time_of_removal=time_of_removal, data_adapter=data_adapter)
+        def mark(key):
+            return self.mark_for_deletion(time_of_removal=time_of_removal, data_adapter=data_adapter, **key)
+        with ThreadPoolExecutor() as executor:
+            futures = [executor.submit(mark, key) for key in keys]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            marked = [key for key, future in zip(keys, futures) if future.exception() is None]
+            self.restore_many(marked, data_adapter=data_adapter)
+            raise errors[0]
+        return len(keys)
+
+    def restore_many(self, keys, data_adapter=None):
+        """Restores the most recently removed version of many objects, renaming their files concurrently.
+        Arguments:
+            keys {list[dict]} -- The schema_ref, data_name and (optionally) version_timestamp of each object.
+            data_adapter {AbstractDataFileAdapter} -- The data adapter to use.
+        Raises:
+            FileSystemDAOFileAlreadyExistsError -- If one of the objects already exists.
+            FileSystemDAORangeError -- If one of the objects has no removed versions.
+        Returns:
+            int -- The number of restored objects.
+        """
+        self._check_args(data_adapter=data_adapter)
+        def restore(key):
+            return self.restore(data_adapter=data_adapter, **key)
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(restore, keys))
+        return len(keys)
+
+    def _path_exists(self, schema_ref, data_name, version_timestamp=0, data_adapter=None):
+        """Checks if a (not deleted) file exists for an object using filesystem metadata only."""
+        return self._get_file_path(schema_ref, data_name, version_timestamp, 1, data_adapter) is not None
+
     def list_marked_for_deletion(self, time_threshold=None):
         """Returns a list of all deleted objects from the repository.
         Arguments:
@@ -641,17 +1438,23 @@ class FileSystemDAO(AbstractDataAccessObject):
         self._check_args(
             time_threshold=time_threshold,
             )
-        glob_pattern = self._directory + '/*_time_of_removal_*'
-        paths = self._fs.glob(glob_pattern)
-        if time_threshold is None:
-            result = list(paths)
-        else:
-            result = []
-            for path in paths:
-                tor = self._get_time_of_removal_from_path(path)
-                if tor <= time_threshold:
-                    result.append(path)
-        return result
+        return [info['name'] for info in self._list_trash(time_threshold)]
+
+    def _list_trash(self, time_threshold=None):
+        """Lists the objects marked for deletion with a single directory listing.
+        Returns:
+            list[dict] -- The fsspec info dicts (name, size, type) of the objects, sorted by name.
+        """
+        infos = self._fs.ls(self._directory, detail=True)
+        trash = []
+        for info in infos:
+            if '__time_of_removal_' not in os.path.basename(info['name'].rstrip('/')):
+                continue
+            if time_threshold is not None and self._get_time_of_removal_from_path(info['name']) > time_threshold:
+                continue
+            trash.append(info)
+        trash.sort(key=lambda info: info['name'])
+        return trash
 
 
     def restore(self, schema_ref, data_name, version_timestamp=0, nth_most_recent=1, data_adapter=None):
@@ -685,13 +1488,18 @@ class FileSystemDAO(AbstractDataAccessObject):
         basefilename = self.make_base_filename(schema_ref, data_name, version_timestamp)
         pattern = self._directory + "/" + basefilename + '__time_of_removal_*' + data_adapter.file_extension
         glob = self._fs.glob(pattern)
+        if len(glob) == 0 and isinstance(version_timestamp, datetime):
+            # the version_timestamp may have been truncated to millisecond precision (e.g. by MongoDB)
+            ms_vts = str(datetime_to_microseconds(version_timestamp))[:-3]
+            pattern = self._directory + "/" + self.make_base_filename(schema_ref, data_name) + f'__version_{ms_vts}[0-9][0-9][0-9]__time_of_removal_*' + data_adapter.file_extension
+            glob = self._fs.glob(pattern)
         paths = list(sorted(glob))
         if len(paths) == 0:
             raise FileSystemDAORangeError(
                 f'Cannot restore object with schema_ref: {schema_ref}, data_name: {data_name}, and version_timestamp: {version_timestamp}: no deleted instances of {schema_ref}, {data_name}, and {version_timestamp} were found in repository.'
             )
         # check for an existing object with the same data_name and no time_of_removal value
-        object_exists = self.exists(schema_ref, data_name, version_timestamp, data_adapter)
+        object_exists = self._path_exists(schema_ref, data_name, version_timestamp, data_adapter)
         if object_exists:
             raise FileSystemDAOFileAlreadyExistsError(
                 f'Cannot restore object with schema_ref: {schema_ref}, data_name: {data_name}, and version_timestamp: {version_timestamp} because it already exists in repository.'
@@ -703,8 +1511,8 @@ class FileSystemDAO(AbstractDataAccessObject):
             raise FileSystemDAORangeError(
                 f'Arg nth_most_recent={nth_most_recent} out of range. The record of deleted objects only contains {len(paths)} entries.'
             )
-        # set path to the new path
-        new_path = self.make_filepath(schema_ref, data_name, version_timestamp, data_adapter)
+        # set path to the new path (the trash path without its time_of_removal)
+        new_path = os.path.join(os.path.dirname(str(nth_path)), re.sub(r'__time_of_removal_\d+', '', os.path.basename(str(nth_path))))
         try:
             self._fs.mv(str(nth_path), str(new_path), recursive=True)
         except Exception as e:
@@ -713,23 +1521,179 @@ class FileSystemDAO(AbstractDataAccessObject):
             )
         return None
 
-    def purge(self, time_threshold=None):
+    def purge(self, time_threshold=None, batch_size=1000, progress_callback=None, collect_blobs=True):
         """Purges deleted objects from the repository older than the time threshold.
+        The objects are listed with a single directory listing and deleted in batches
+        with fsspec's bulk rm, several batches at a time. Purging is idempotent, so an
+        interrupted purge is resumed by simply calling purge again.
         Arguments:
-            schema_ref {str} -- The type of object to purge.
-            data_name {str} -- The name of the object to purge.
-            version_timestamp {str} -- The version of the object to purge.
             time_threshold {datetime.timestamp} -- The time threshold.
+            batch_size {int} -- The number of paths per bulk rm call.
+            progress_callback {callable} -- Called as progress_callback(n_purged, n_total) after each batch.
+            collect_blobs {bool} -- Delete the blobs no reference file refers to any more. Callers that keep
+                                    blob references in records pass False and call collect_blobs with them.
         Returns:
-            None
+            int -- The number of purged objects.
         """
         self._check_args(time_threshold=time_threshold)
         paths = self.list_marked_for_deletion(time_threshold)
         count = len(paths)
-        for path in paths:
-            self._fs.rm(path, recursive=True)
+        n_purged = 0
+        batches = list(batch_list(paths, batch_size))
+        with ThreadPoolExecutor() as executor:
+            futures = [executor.submit(self._fs.rm, batch, recursive=True) for batch in batches]
+            for future, batch in zip(futures, batches):
+                future.result()
+                n_purged += len(batch)
+                if progress_callback is not None:
+                    progress_callback(n_purged, count)
+        if collect_blobs and self._has_blobs:
+            self.collect_blobs()
         return count
 
+    def collect_blobs(self, referenced=None):
+        """Deletes the blobs that no object references any more (mark and sweep).
+        Must not run concurrently with adds, which may write a blob just before its reference.
+        Arguments:
+            referenced {iterable[str]} -- The blobs still referred to, including by objects marked for deletion
+                                          (e.g. from the blob references kept in records). If None, every
+                                          reference file in the project directory is read to find them.
+        Returns:
+            int -- The number of deleted blobs.
+        """
+        if not self._fs.exists(self._blob_dir):
+            return 0
+        if referenced is not None:
+            referenced = set(referenced)
+        else:
+            referenced = set()
+            for info in self._fs.ls(self._directory, detail=True):
+                if info.get('type') != 'file':
+                    continue
+                blob_ref = self._read_blob_ref(info['name'], size=info.get('size'))
+                if blob_ref is not None:
+                    referenced.add(blob_ref['blob'])
+        unreferenced = [
+            info['name'] for info in self._fs.ls(self._blob_dir, detail=True)
+            if os.path.basename(info['name'].rstrip('/')) not in referenced
+        ]
+        if unreferenced:
+            self._fs.rm(unreferenced, recursive=True)
+        return len(unreferenced)
+
+    def write_pack(self, data_objects, data_adapter=None):
+        """Writes many small data objects into a single pack file, so they cost one file write instead of one each.
+        The caller records where each object is (e.g. in MongoDB) and reads it back with one ranged read (see read_packed).
+        Packs are never changed once written; collect_packs deletes them when nothing refers to them any more.
+        Arguments:
+            data_objects {list} -- The data objects to pack.
+            data_adapter {AbstractDataFileAdapter} -- The adapter encoding the objects; it must support packing.
+        Raises:
+            FileSystemDAOTypeError -- If the adapter cannot pack objects or an object is not of its type.
+        Returns:
+            tuple[str, list[tuple[int, int]]] -- The name of the pack and the (offset, length) of each object in it.
+        """
+        self._check_args(data_adapter=data_adapter)
+        data_adapter = self._packing_adapter(data_adapter)
+        encoded = []
+        for data_object in data_objects:
+            if not isinstance(data_object, data_adapter.data_object_type):
+                raise FileSystemDAOTypeError(
+                    f'Cannot pack a {type(data_object)} with the {data_adapter.file_format} adapter, which stores {data_adapter.data_object_type}.'
+                )
+            data_object = self._serialize(data_object)
+            try:
+                encoded.append(data_adapter.to_bytes(data_object))
+            finally:
+                self._deserialize(data_object) # undo the serialization in case the object is mutated
+        pack = f'{time_ns()}_{uuid.uuid4().hex}{self._pack_extension}'
+        extents = []
+        offset = 0
+        for data in encoded:
+            extents.append((offset, len(data)))
+            offset += len(data)
+        if not self._fs.exists(self._pack_dir):
+            self._fs.mkdir(self._pack_dir)
+        with self._fs.open(self._pack_path(pack), mode='wb') as f:
+            f.write(b''.join(encoded))
+        return pack, extents
+
+    def read_packed(self, pack, offset, length, data_adapter=None):
+        """Reads one data object from a pack file with a single ranged read.
+        Arguments:
+            pack {str} -- The name of the pack (see write_pack).
+            offset {int} -- The offset of the object in the pack.
+            length {int} -- The number of bytes of the object.
+            data_adapter {AbstractDataFileAdapter} -- The adapter the object was packed with.
+        Raises:
+            FileSystemDAOFileNotFoundError -- If the pack does not exist.
+        Returns:
+            The data object.
+        """
+        self._check_args(pack=pack, offset=offset, length=length, data_adapter=data_adapter)
+        data_adapter = self._packing_adapter(data_adapter)
+        try:
+            data = self._fs.cat_file(self._pack_path(pack), start=offset, end=offset + length)
+        except FileNotFoundError:
+            raise FileSystemDAOFileNotFoundError(f'The pack {pack} does not exist.')
+        return self._deserialize(data_adapter.from_bytes(data))
+
+    def collect_packs(self, referenced):
+        """Deletes the packs that are not referenced any more (mark and sweep).
+        Must not run concurrently with adds, which write a pack just before the records that refer to it.
+        Arguments:
+            referenced {iterable[str]} -- The packs still referred to, including by objects marked for deletion.
+        Returns:
+            int -- The number of deleted packs.
+        """
+        if not self.has_packs:
+            return 0
+        referenced = set(referenced)
+        unreferenced = [
+            info['name'] for info in self._fs.ls(self._pack_dir, detail=True)
+            if os.path.basename(info['name']) not in referenced
+        ]
+        if unreferenced:
+            self._fs.rm(unreferenced)
+        return len(unreferenced)
+
+    @property
+    def has_blobs(self):
+        return self._has_blobs
+
+    @property
+    def has_packs(self):
+        return self._fs.exists(self._pack_dir)
+
+    def _pack_path(self, pack):
+        return self._pack_dir + '/' + pack
+
+    def _packing_adapter(self, data_adapter):
+        if data_adapter is None:
+            data_adapter = self._default_data_adapter
+        if not data_adapter.supports_packing:
+            raise FileSystemDAOTypeError(f'The {data_adapter.file_format} adapter does not support packing data objects.')
+        data_adapter.set_filesystem(self._fs)
+        return data_adapter
+
+    def estimate_purge(self, time_threshold=None):
+        """Estimates what purge would reclaim without deleting anything (dry run).
+        Arguments:
+            time_threshold {datetime.timestamp} -- The time threshold.
+        Returns:
+            tuple[int, int] -- The number of objects and the number of bytes that would be reclaimed.
+        """
+        self._check_args(time_threshold=time_threshold)
+        trash = self._list_trash(time_threshold)
+        nbytes = 0
+        for info in trash:
+            if info.get('type') == 'directory':
+                # directory stores (e.g. zarr) need a recursive size lookup
+                nbytes += self._fs.du(info['name'])
+            else:
+                nbytes += info.get('size') or 0
+        return len(trash), nbytes
+
 
     def make_filepath(self, schema_ref, data_name, version_timestamp=0, data_adapter = None, time_of_removal=None):
         """Returns the filepath for a data array."""
@@ -757,7 +1721,12 @@ class FileSystemDAO(AbstractDataAccessObject):
         Returns:
             dict -- The serialized data object.
         """
-        attrs = data_object.attrs.copy()
+        data_object.attrs = self._serialize_attrs(data_object.attrs)
+        return data_object
+
+    def _serialize_attrs(self, attrs):
+        """Returns a copy of attrs with values the data adapters can store (see _serialize)."""
+        attrs = dict(attrs)
         for key, value in attrs.items():
             if isinstance(value, bool):
                 attrs[key] = str(value)
@@ -769,8 +1738,7 @@ class FileSystemDAO(AbstractDataAccessObject):
                 attrs[key] = json.dumps(value)
             if key == 'version_timestamp' and isinstance(value, type(None)):
                 attrs[key] = 0
-        data_object.attrs = attrs
-        return data_object
+        return attrs
 
     def _deserialize(self, data_object):
         """Deserializes a data object.
@@ -838,8 +1806,17 @@ class FileSystemDAO(AbstractDataAccessObject):
             'nth_most_recent': (int),
             'time_threshold': (nowtype, nonetype),
             'data_adapter': (AbstractDataFileAdapter, nonetype),
+            'dim': (str),
+            'staging_id': (str, nonetype),
+            'pack': (str),
+            'offset': (int),
+            'length': (int),
         }
 
+    @property
+    def file_cache(self):
+        return self._file_cache
+
 
 
 # ===================
@@ -972,7 +1949,6 @@ class InMemoryObjectDAO(AbstractQueriableDataAccessObject):
         Returns:
             None
         """
-        sleep(0.0000001) # to prevent non-unique timestamps
         self._check_args(tag=tag, time_of_removal=time_of_removal)
         if not self.exists(tag):
             raise InMemoryObjectDAOObjectNotFoundError(
@@ -1087,6 +2063,42 @@ class InMemoryObjectDAO(AbstractQueriableDataAccessObject):
 # Helper Functions
 # ===================
 
+# Batching
+
+def batch_list(items, batch_size):
+    """Yields consecutive slices of a list with at most batch_size items."""
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+# Timestamps
+
+_clock_lock = threading.Lock()
+_clock_last_microseconds = 0
+_clock_last_version_milliseconds = 0
+
+def unique_utc_now(version=False) -> datetime:
+    """Returns the current UTC time, strictly increasing across calls in this process.
+    A hybrid logical clock: the wall clock is used while it moves forward, and the
+    previous value plus one microsecond is used when it stalls or steps back, so
+    every returned timestamp is unique at microsecond precision without sleeping.
+    MongoDB stores datetimes (e.g. version_timestamp) with millisecond precision only, so
+    timestamps that become versions are taken from the next millisecond that no earlier
+    version was given.
+    Arguments:
+        version {bool} -- Whether the timestamp is used as a version_timestamp.
+    Returns:
+        datetime -- A timezone aware UTC datetime.
+    """
+    global _clock_last_microseconds, _clock_last_version_milliseconds
+    now = time_ns() // 1000
+    with _clock_lock:
+        now = max(now, _clock_last_microseconds + 1)
+        if version:
+            now = max(now, (_clock_last_version_milliseconds + 1) * 1000)
+            _clock_last_version_milliseconds = now // 1000
+        _clock_last_microseconds = now
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=now)
+
 # Microseconds
 
 def datetime_to_microseconds(timestamp: datetime) -> int:
@@ -1,6 +1,25 @@
+import io
+import json
 from abc import ABC, abstractmethod
 
+import numpy as np
+import pandas as pd
 import xarray as xr
+import zarr
+from fsspec.implementations.dirfs import DirFileSystem
+from fsspec.implementations.local import LocalFileSystem
+
+from signalstore.store.store_errors import *
+from signalstore.utilities.tools.dataarrays import dataarray_digest
+
+
+class DataAdapterNotFoundError(NotFoundError):
+    pass
+
+
+class DataAdapterConfigError(ConfigError):
+    pass
+
 
 class AbstractDataFileAdapter(ABC):
 
@@ -18,6 +37,11 @@ class AbstractDataFileAdapter(ABC):
     def write_file(self, path, data_object):
         pass
 
+    def open_file(self, path):
+        """Opens the file at path lazily, so that only the parts of the data that are accessed are read.
+        Defaults to read_file, for formats whose reads are already lazy (e.g. zarr) or cannot be."""
+        return self.read_file(path)
+
     @abstractmethod
     def get_id_kwargs(self, data_object):
         pass
@@ -37,6 +61,54 @@ class AbstractDataFileAdapter(ABC):
     def data_object_type(self):
         pass
 
+    @property
+    def supports_append(self):
+        """Whether append_file can grow an existing file in place."""
+        return False
+
+    def append_file(self, path, data_object, dim):
+        """Appends data_object to the file at path along dimension dim."""
+        raise NotImplementedError(f"{type(self).__name__} does not support appending to files.")
+
+    def truncate_file(self, path, dim, size):
+        """Shrinks the file at path to its first size entries along dim (undoes append_file)."""
+        raise NotImplementedError(f"{type(self).__name__} does not support appending to files.")
+
+    def content_hash(self, data_object):
+        """Returns a hash of the payload of data_object (not its attrs), or None if it cannot be deduplicated."""
+        return None
+
+    @property
+    def supports_attrs_update(self):
+        """Whether update_attrs can change the attrs of a file without rewriting its data."""
+        return False
+
+    def update_attrs(self, path, set_attrs, unset_attrs=()):
+        """Sets and removes attrs of the data object stored at path in place."""
+        raise NotImplementedError(f"{type(self).__name__} does not support updating attrs in place.")
+
+    @property
+    def supports_scan(self):
+        """Whether scan can read many files as a single dataset."""
+        return False
+
+    def scan(self, paths, columns=None, filter=None, labels=None):
+        """Reads the files at paths as one dataset, keeping only the columns and rows that are asked for."""
+        raise NotImplementedError(f"{type(self).__name__} does not support scanning files.")
+
+    @property
+    def supports_packing(self):
+        """Whether to_bytes and from_bytes can store data objects inside pack files shared by many objects."""
+        return False
+
+    def to_bytes(self, data_object):
+        """Returns a self-contained encoding of data_object that from_bytes reads back."""
+        raise NotImplementedError(f"{type(self).__name__} does not support packing data objects.")
+
+    def from_bytes(self, data):
+        """Reads a data object back from the bytes made by to_bytes."""
+        raise NotImplementedError(f"{type(self).__name__} does not support packing data objects.")
+
 class XarrayDataArrayNetCDFAdapter(AbstractDataFileAdapter):
     """Adapter for reading and writing xarray DataArrays to netcdf files."""
 
@@ -48,6 +120,10 @@ class XarrayDataArrayNetCDFAdapter(AbstractDataFileAdapter):
     def file_format(self):
         return "NetCDF"
 
+    def content_hash(self, data_object):
+        digest = dataarray_digest(data_object)
+        return None if digest is None else f"{self.file_format.lower()}-{digest}"
+
     @property
     def data_object_type(self):
         return type(xr.DataArray())
@@ -63,12 +139,31 @@ class XarrayDataArrayNetCDFAdapter(AbstractDataFileAdapter):
             data_object = xr.open_dataarray(f, engine="scipy")
         return data_object
 
+    def open_file(self, path):
+        # scipy reads the whole file when it is opened from a file object, but memory maps local files,
+        # so local files are opened by name and chunked with dask; remote files are read whole
+        local_path = _local_path(self.filesystem, path)
+        if local_path is None:
+            return self.read_file(path)
+        return xr.open_dataarray(local_path, engine="scipy", chunks={})
+
     def write_file(self, path, data_object):
         # make file if it doesn't exist
         data_object = self._clean_attributes(data_object)
         with self.filesystem.open(path, mode='wb') as f:
             data_object.to_netcdf(f, engine="scipy")
 
+    @property
+    def supports_packing(self):
+        return True
+
+    def to_bytes(self, data_object):
+        return bytes(self._clean_attributes(data_object).to_netcdf(engine="scipy"))
+
+    def from_bytes(self, data):
+        with xr.open_dataarray(io.BytesIO(data), engine="scipy") as data_object:
+            return data_object.load()
+
     def _clean_attributes(self, data_object):
         """Clean up attributes to ensure they are serializable to netcdf."""
         # clean name
@@ -95,6 +190,10 @@ class XarrayDataArrayZarrAdapter(AbstractDataFileAdapter):
     def file_format(self):
         return "Zarr"
 
+    def content_hash(self, data_object):
+        digest = dataarray_digest(data_object)
+        return None if digest is None else f"{self.file_format.lower()}-{digest}"
+
     @property
     def data_object_type(self):
         return type(xr.DataArray())
@@ -117,6 +216,49 @@ class XarrayDataArrayZarrAdapter(AbstractDataFileAdapter):
         data_object.to_zarr(store, consolidated=True)
         return data_object
 
+    @property
+    def supports_append(self):
+        return True
+
+    def append_file(self, path, data_object, dim):
+        """Appends data_object along dim with to_zarr(append_dim=...); only the new chunks are written."""
+        store = self.filesystem.get_mapper(path)
+        existing = xr.open_dataarray(store, engine="zarr")
+        data_object = data_object.rename(existing.name)
+        data_object = data_object.rename({k: str(k) for k in data_object.dims})
+        # the stored attrs describe the whole array, so they are kept as they are
+        data_object.attrs = dict(existing.attrs)
+        data_object.to_zarr(store, append_dim=dim, consolidated=True)
+        return data_object
+
+    def truncate_file(self, path, dim, size):
+        """Resizes the arrays (data and coordinates) along dim; the chunks past size are left to be overwritten."""
+        store = self.filesystem.get_mapper(path)
+        group = zarr.open_group(store, mode="r+")
+        for name, variable in xr.open_zarr(store).variables.items():
+            if dim in variable.dims:
+                array = group[name]
+                shape = list(array.shape)
+                shape[variable.dims.index(dim)] = size
+                array.resize(tuple(shape))
+        zarr.consolidate_metadata(store)
+
+    @property
+    def supports_attrs_update(self):
+        return True
+
+    def update_attrs(self, path, set_attrs, unset_attrs=()):
+        """Rewrites only the attributes metadata of the array (and the consolidated metadata), not its chunks."""
+        store = self.filesystem.get_mapper(path)
+        name = xr.open_dataarray(store, engine="zarr").name
+        array = zarr.open_group(store, mode="r+")[name]
+        attrs = dict(array.attrs)
+        attrs.update({str(k): str(v) for k, v in set_attrs.items()})
+        for key in unset_attrs:
+            attrs.pop(key, None)
+        array.attrs.put(attrs)
+        zarr.consolidate_metadata(store)
+
     def _clean_attributes(self, data_object):
         """Clean up attributes to ensure they are serializable to netcdf."""
         # clean name
@@ -128,4 +270,269 @@ class XarrayDataArrayZarrAdapter(AbstractDataFileAdapter):
         data_object = data_object.rename({k: str(k) for k in data_object.dims})
         # make sure attrs are strings
         data_object.attrs = {str(k): str(v) for k, v in data_object.attrs.items()}
-        return data_object
\ No newline at end of file
+        return data_object
+
+class XarrayDataArrayRawNumpyAdapter(AbstractDataFileAdapter):
+    """Adapter for reading and writing xarray DataArrays as raw .npy arrays with a JSON sidecar.
+
+    Each data object is a directory holding the data and its coordinates as .npy files and
+    a metadata.json sidecar with the name, dims, coordinate layout and attrs. There is no
+    encoding or compression, and on local filesystems the arrays are memory mapped (copy on
+    write), so reading only touches the pages that are used. Best suited for large dense
+    arrays such as raw traces.
+    """
+    # the sidecar is written last, so a directory without it holds an incomplete write
+    _metadata_filename = "metadata.json"
+    _data_filename = "data.npy"
+
+    @property
+    def file_extension(self):
+        return ".npyd"
+
+    @property
+    def file_format(self):
+        return "RawNumpy"
+
+    def content_hash(self, data_object):
+        digest = dataarray_digest(data_object)
+        return None if digest is None else f"{self.file_format.lower()}-{digest}"
+
+    @property
+    def data_object_type(self):
+        return type(xr.DataArray())
+
+    def get_id_kwargs(self, data_object):
+        return {"schema_ref": data_object.attrs.get("schema_ref"),
+                "data_name": data_object.attrs.get("data_name"),
+                "version_timestamp": data_object.attrs.get("version_timestamp") or 0
+                }
+
+    def read_file(self, path):
+        metadata = self._read_metadata(path)
+        coords = {
+            coord["name"]: (coord["dims"], self._load_array(f"{path}/{coord['file']}"))
+            for coord in metadata["coords"]
+        }
+        return xr.DataArray(
+            self._load_array(f"{path}/{self._data_filename}"),
+            dims=metadata["dims"],
+            coords=coords,
+            name=metadata["name"],
+            attrs=metadata["attrs"]
+            )
+
+    def write_file(self, path, data_object):
+        if data_object.name is None:
+            data_object = data_object.rename(f"{data_object.attrs.get('schema_ref')}__{data_object.attrs.get('data_name')}")
+        self.filesystem.makedirs(path, exist_ok=True)
+        self._save_array(f"{path}/{self._data_filename}", data_object.values)
+        coords = []
+        for n, (name, coord) in enumerate(data_object.coords.items()):
+            filename = f"coord_{n}.npy"
+            values = coord.values
+            if values.dtype.hasobject:
+                # e.g. channel labels; .npy files are written without pickling
+                values = values.astype(str)
+            self._save_array(f"{path}/{filename}", values)
+            coords.append({"name": str(name), "dims": [str(dim) for dim in coord.dims], "file": filename})
+        metadata = {
+            "name": str(data_object.name),
+            "dims": [str(dim) for dim in data_object.dims],
+            "coords": coords,
+            "attrs": {str(k): v for k, v in data_object.attrs.items()},
+        }
+        self._write_metadata(path, metadata)
+        return data_object
+
+    @property
+    def supports_attrs_update(self):
+        return True
+
+    def update_attrs(self, path, set_attrs, unset_attrs=()):
+        """Rewrites only the sidecar, not the arrays."""
+        metadata = self._read_metadata(path)
+        metadata["attrs"].update({str(k): v for k, v in set_attrs.items()})
+        for key in unset_attrs:
+            metadata["attrs"].pop(key, None)
+        self._write_metadata(path, metadata)
+
+    def _read_metadata(self, path):
+        with self.filesystem.open(f"{path}/{self._metadata_filename}", mode='r') as f:
+            return json.load(f)
+
+    def _write_metadata(self, path, metadata):
+        # attrs that are not JSON types (e.g. datetimes) are stored as strings, like in netcdf files
+        with self.filesystem.open(f"{path}/{self._metadata_filename}", mode='w') as f:
+            json.dump(metadata, f, default=str)
+
+    def _save_array(self, path, values):
+        with self.filesystem.open(path, mode='wb') as f:
+            np.save(f, np.ascontiguousarray(values), allow_pickle=False)
+
+    def _load_array(self, path):
+        local_path = _local_path(self.filesystem, path)
+        if local_path is not None:
+            return np.load(local_path, mmap_mode='c', allow_pickle=False)
+        with self.filesystem.open(path, mode='rb') as f:
+            return np.load(f, allow_pickle=False)
+
+
+class PandasDataFrameParquetAdapter(AbstractDataFileAdapter):
+    """Adapter for reading and writing tabular data (e.g. spike times, event labels or position samples)
+    as pandas DataFrames in compressed Parquet files. Requires pyarrow.
+
+    Unlike the array adapters, 1D tables need no padding, and the files of many objects can be
+    read as a single Arrow dataset with scan, which only reads the columns that are asked for and
+    skips the row groups whose statistics rule out the row filter.
+    """
+    # attrs are kept in the Parquet schema metadata under this key
+    _attrs_metadata_key = b"signalstore.attrs"
+    _compression = "zstd"
+    _row_group_size = 2**20
+
+    @property
+    def file_extension(self):
+        return ".parquet"
+
+    @property
+    def file_format(self):
+        return "Parquet"
+
+    @property
+    def data_object_type(self):
+        return pd.DataFrame
+
+    def get_id_kwargs(self, data_object):
+        return {"schema_ref": data_object.attrs.get("schema_ref"),
+                "data_name": data_object.attrs.get("data_name"),
+                "version_timestamp": data_object.attrs.get("version_timestamp") or 0
+                }
+
+    def read_file(self, path):
+        pa, pq, ds = _import_pyarrow()
+        with self.filesystem.open(path, mode='rb') as f:
+            table = pq.read_table(f)
+        data_object = table.to_pandas()
+        data_object.attrs = self._read_attrs(table.schema)
+        return data_object
+
+    def write_file(self, path, data_object):
+        pa, pq, ds = _import_pyarrow()
+        table = pa.Table.from_pandas(data_object, preserve_index=False)
+        # attrs that are not JSON types (e.g. datetimes) are stored as strings, like in netcdf files
+        metadata = dict(table.schema.metadata or {})
+        metadata[self._attrs_metadata_key] = json.dumps({str(k): v for k, v in data_object.attrs.items()}, default=str).encode()
+        table = table.replace_schema_metadata(metadata)
+        with self.filesystem.open(path, mode='wb') as f:
+            pq.write_table(table, f, compression=self._compression, row_group_size=self._row_group_size)
+        return data_object
+
+    @property
+    def supports_scan(self):
+        return True
+
+    def scan(self, paths, columns=None, filter=None, labels=None):
+        """Reads Parquet files as one Arrow dataset.
+        Arguments:
+            paths {list[str]} -- The files to read.
+            columns {list[str]} -- The columns to read (all if None).
+            filter -- A row filter, either a pyarrow.dataset.Expression or a list of (column, op, value)
+                      tuples (see pyarrow.parquet.filters_to_expression). It is pushed down to the
+                      row group statistics, so row groups that cannot match are never read.
+            labels {dict} -- Columns to add to the rows of each file, as {column: [value per path]}.
+        Returns:
+            pyarrow.Table -- The matching rows of all files.
+        """
+        pa, pq, ds = _import_pyarrow()
+        dataset = ds.dataset(list(paths), format="parquet", filesystem=self.filesystem)
+        if filter is not None and not isinstance(filter, ds.Expression):
+            filter = pq.filters_to_expression(filter)
+        if not labels:
+            return dataset.to_table(columns=columns, filter=filter)
+        tables = []
+        # the fragments of a dataset made from a list of paths keep the order of the paths
+        for n, fragment in enumerate(dataset.get_fragments()):
+            table = fragment.to_table(schema=dataset.schema, columns=columns, filter=filter)
+            for column, values in labels.items():
+                value = pa.scalar(values[n])
+                table = table.append_column(column, pa.array([values[n]] * table.num_rows, type=value.type))
+            tables.append(table)
+        return pa.concat_tables(tables)
+
+    def _read_attrs(self, schema):
+        metadata = schema.metadata or {}
+        if self._attrs_metadata_key not in metadata:
+            return {}
+        return json.loads(metadata[self._attrs_metadata_key])
+
+
+def _local_path(filesystem, path):
+    """Returns the path of a file on the local disk, or None if the file system is not local.
+    DirFileSystems (e.g. the one the UnitOfWorkProvider gives each project) are unwrapped."""
+    path = str(path)
+    while isinstance(filesystem, DirFileSystem):
+        path = filesystem._join(path)
+        filesystem = filesystem.fs
+    if not isinstance(filesystem, LocalFileSystem):
+        return None
+    return filesystem._strip_protocol(path)
+
+
+def _import_pyarrow():
+    """pyarrow is only needed by the Parquet adapter, so it is imported when that adapter is used."""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("PandasDataFrameParquetAdapter requires pyarrow (pip install pyarrow).") from e
+    return pyarrow, pyarrow.parquet, pyarrow.dataset
+
+
+# Names under which data adapters are referred to in operation history entries, journals and records.
+# Only registered adapters are ever created from a name read back from the database; other adapters
+# are referred to by their import path ('module:qualname'), which works within the process that used them.
+registered_data_adapters = {
+    'netcdf': XarrayDataArrayNetCDFAdapter,
+    'zarr': XarrayDataArrayZarrAdapter,
+    'numpy': XarrayDataArrayRawNumpyAdapter,
+    'parquet': PandasDataFrameParquetAdapter,
+}
+
+def register_data_adapter(name, adapter_class):
+    """Registers a data adapter class under a name, so that its objects can be read and their
+    operations rolled back (e.g. by UnitOfWorkProvider.recover) in other processes.
+    Arguments:
+        name {str} -- The name to refer to the adapter by.
+        adapter_class {type} -- A subclass of AbstractDataFileAdapter that can be created without arguments.
+    Raises:
+        DataAdapterConfigError -- If the class is not a data adapter or the name is taken by another class.
+    Returns:
+        None
+    """
+    if not isinstance(name, str) or ':' in name:
+        raise DataAdapterConfigError(f"name must be a string without ':', not {name}.")
+    if not (isinstance(adapter_class, type) and issubclass(adapter_class, AbstractDataFileAdapter)):
+        raise DataAdapterConfigError(f"adapter_class must be a subclass of AbstractDataFileAdapter, not {adapter_class}.")
+    if registered_data_adapters.get(name, adapter_class) is not adapter_class:
+        raise DataAdapterConfigError(f"The name '{name}' is already registered for {registered_data_adapters[name].__name__}.")
+    registered_data_adapters[name] = adapter_class
+
+def data_adapter_name(data_adapter):
+    """The registered name of a data adapter's class, or its import path."""
+    for name, adapter_class in registered_data_adapters.items():
+        if type(data_adapter) is adapter_class:
+            return name
+    return f'{type(data_adapter).__module__}:{type(data_adapter).__qualname__}'
+
+def data_adapter_from_name(name):
+    """Creates a data adapter from a name returned by data_adapter_name.
+    Names are read back from the database, so only registered adapters are created (see register_data_adapter).
+    Raises:
+        DataAdapterNotFoundError -- If no adapter is registered under the name.
+    """
+    if name not in registered_data_adapters:
+        raise DataAdapterNotFoundError(
+            f"No data adapter is registered under the name '{name}'. Register the adapter with register_data_adapter."
+        )
+    return registered_data_adapters[name]()
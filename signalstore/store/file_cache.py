@@ -0,0 +1,159 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+from signalstore.store.store_errors import *
+
+
+class LocalFileCacheConfigError(ConfigError):
+    pass
+
+
+class LocalFileCache:
+    """A content-addressed on-disk cache for immutable data files.
+
+    Entries are keyed by a hash of the remote path (which encodes the
+    version_timestamp for versioned objects) and stored under
+    cache_dir/entries/{key}/{basename}. New entries are fetched into a private
+    temporary directory and published with an atomic rename, so several
+    processes on one node can share the same cache directory without ever
+    seeing a partially written entry. The modification time of an entry is
+    refreshed on every hit and the least recently used entries are evicted
+    once the total size of the cache exceeds max_bytes.
+    """
+    def __init__(self, cache_dir, max_bytes=10 * 2**30):
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise LocalFileCacheConfigError(
+                f'max_bytes must be a positive integer, not {max_bytes}.'
+            )
+        self._cache_dir = os.path.abspath(str(cache_dir))
+        self._entries_dir = os.path.join(self._cache_dir, 'entries')
+        self._tmp_dir = os.path.join(self._cache_dir, 'tmp')
+        os.makedirs(self._entries_dir, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._max_bytes = max_bytes
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def make_key(self, *parts):
+        """Returns the content address for the given key parts (e.g. path and version_timestamp)."""
+        return hashlib.sha256('::'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the local path of a cached entry or None if the key is not cached.
+        A hit refreshes the entry's position in the LRU order.
+        """
+        entry_dir = os.path.join(self._entries_dir, key)
+        try:
+            names = os.listdir(entry_dir)
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            return None
+        if len(names) != 1:
+            return None
+        return os.path.join(entry_dir, names[0])
+
+    def put(self, key, filesystem, path):
+        """Copies a (remote) file or directory into the cache.
+        Arguments:
+            key {str} -- The content address of the entry (see make_key).
+            filesystem {fsspec.AbstractFileSystem} -- The filesystem the path belongs to.
+            path {str} -- The path of the file or directory to cache.
+        Returns:
+            str -- The local path of the cached entry, or None if the object is larger than the cache.
+        """
+        if filesystem.du(path) > self._max_bytes:
+            return None
+        tmp_entry_dir = os.path.join(self._tmp_dir, uuid.uuid4().hex)
+        os.makedirs(tmp_entry_dir)
+        basename = os.path.basename(str(path).rstrip('/'))
+        try:
+            filesystem.get(str(path), os.path.join(tmp_entry_dir, basename), recursive=True)
+            entry_dir = os.path.join(self._entries_dir, key)
+            try:
+                os.rename(tmp_entry_dir, entry_dir)
+            except OSError:
+                # another process published the same entry first; its copy is identical
+                shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+        return self.get(key)
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache fits into max_bytes.
+        Arguments:
+            keep {str} -- A key that must not be evicted (e.g. the entry that was just added).
+        Returns:
+            int -- The number of evicted entries.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self._entries_dir):
+            try:
+                size = _tree_size(entry.path)
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue # evicted by another process
+            entries.append((mtime, entry.name, size))
+            total += size
+        count = 0
+        for mtime, name, size in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            if name == keep:
+                continue
+            self._remove_entry(name)
+            total -= size
+            count += 1
+        return count
+
+    def invalidate(self, key):
+        """Removes an entry from the cache, e.g. after the file it was copied from was changed.
+        Arguments:
+            key {str} -- The content address of the entry (see make_key).
+        Returns:
+            None
+        """
+        self._remove_entry(key)
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for entry in os.scandir(self._entries_dir):
+            self._remove_entry(entry.name)
+
+    @property
+    def size(self):
+        """The total size of all cached entries in bytes."""
+        return sum(_tree_size(entry.path) for entry in os.scandir(self._entries_dir))
+
+    def _remove_entry(self, name):
+        # rename before deleting so that readers never see a half deleted entry
+        doomed = os.path.join(self._tmp_dir, uuid.uuid4().hex)
+        try:
+            os.rename(os.path.join(self._entries_dir, name), doomed)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(doomed, ignore_errors=True)
+
+
+def _tree_size(path):
+    """Returns the size of a file or of all files below a directory in bytes."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
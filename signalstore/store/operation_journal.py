@@ -0,0 +1,216 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timezone
+
+from signalstore.store.store_errors import *
+from signalstore.store.repositories import OperationHistoryEntry
+
+
+class OperationJournalConfigError(ConfigError):
+    pass
+
+
+class OperationJournalRangeError(RangeError):
+    pass
+
+
+class OperationJournal:
+    """A durable, write-ahead journal of the operations of open UnitOfWork transactions.
+
+    The journal lives in a MongoDB collection of the project database. A transaction
+    document ({'kind': 'transaction', 'state': 'open'}) is written when a unit of work
+    is entered and deleted together with its entries when the unit of work commits or
+    rolls back, so whatever is left in the collection belongs to a process that died
+    mid-transaction and can be rolled back with UnitOfWorkProvider.recover.
+
+    Repositories write the entries of every operation to the journal before carrying
+    it out, with one insert per operation (one per bulk operation, e.g. remove_many),
+    and drop them again if the operation fails (see AbstractRepository._write_ahead),
+    so no operation is lost to a crash. A repository carries out one operation at a
+    time, so only the entries of its most recent write can belong to an operation that
+    was interrupted: when a transaction is resumed, those are marked pending, and
+    rollback undoes them only as far as they were carried out. Repositories keep at
+    most batch_size of their most recent entries in memory as well, so undo rarely
+    reads the journal, and rollback streams the other entries back, newest first.
+    """
+    def __init__(self, client, database_name, collection_name='operation_journal', batch_size=1000):
+        """
+        Arguments:
+            client -- The MongoDB client.
+            database_name {str} -- The project database.
+            collection_name {str} -- The journal collection.
+            batch_size {int} -- The number of entries per repository kept in memory and read back at once.
+        """
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise OperationJournalConfigError(
+                f'batch_size must be a positive integer, not {batch_size}.'
+            )
+        self._collection = client[database_name][collection_name]
+        self._collection.create_index([('transaction_id', 1), ('repository', 1), ('seq', 1)])
+        self.batch_size = batch_size
+        self._transaction_id = None
+        self._seq = 0
+
+    @property
+    def transaction_id(self):
+        return self._transaction_id
+
+    def begin(self):
+        """Opens a new transaction and returns its id."""
+        self._transaction_id = uuid.uuid4().hex
+        self._seq = 0
+        self._collection.insert_one({
+            'transaction_id': self._transaction_id,
+            'kind': 'transaction',
+            'state': 'open',
+            'time_started': datetime.now(timezone.utc),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+        })
+        return self._transaction_id
+
+    def resume(self, transaction_id):
+        """Attaches the journal to an open transaction (e.g. one left behind by a crashed process).
+        The entries of the most recent write of each repository are marked pending, since the
+        process may have died while carrying out their operations.
+        """
+        last = self._collection.find_one({'transaction_id': transaction_id, 'kind': 'entry'}, sort=[('seq', -1)])
+        self._transaction_id = transaction_id
+        self._seq = 0 if last is None else last['seq']
+        for repository in self._collection.distinct('repository', {'transaction_id': transaction_id, 'kind': 'entry'}):
+            newest = self._collection.find_one(self._entry_filter(repository), sort=[('seq', -1)])
+            if newest is not None:
+                self._collection.update_many({**self._entry_filter(repository), 'write': newest['write']}, {'$set': {'pending': True}})
+
+    def end(self):
+        """Closes the transaction and deletes its entries (after a commit or a completed rollback)."""
+        if self._transaction_id is not None:
+            self._collection.delete_many({'transaction_id': self._transaction_id})
+        self._transaction_id = None
+
+    def open_transactions(self):
+        """Lists the ids of the transactions that were never ended, oldest first."""
+        cursor = self._collection.find({'kind': 'transaction', 'state': 'open'}, sort=[('time_started', 1)])
+        return [document['transaction_id'] for document in cursor]
+
+    def add_staging_id(self, staging_id):
+        """Notes a staging area of the current transaction, so that recover can delete it."""
+        self._check_open()
+        self._collection.update_one({'transaction_id': self._transaction_id, 'kind': 'transaction'}, {'$addToSet': {'staging_ids': staging_id}})
+
+    def staging_ids(self):
+        """Lists the staging areas of the current transaction."""
+        self._check_open()
+        document = self._collection.find_one({'transaction_id': self._transaction_id, 'kind': 'transaction'})
+        return [] if document is None else document.get('staging_ids', [])
+
+    def write(self, repository, ohes):
+        """Writes the entries of operations of a repository that are about to be carried out (write-ahead),
+        with a single insert. The entries can be dropped again with discard if the operations fail.
+        Returns:
+            list[int] -- The sequence numbers of the entries.
+        """
+        self._check_open()
+        documents = []
+        write = self._seq + 1
+        for ohe in ohes:
+            self._seq += 1
+            documents.append({
+                'transaction_id': self._transaction_id,
+                'kind': 'entry',
+                'repository': repository,
+                'seq': self._seq,
+                'write': write,
+                'entry': self._serialize(ohe),
+            })
+        if documents:
+            self._collection.insert_many(documents, ordered=True)
+        return [document['seq'] for document in documents]
+
+    def discard(self, repository, seqs):
+        """Drops the entries of operations that failed before changing anything."""
+        self._check_open()
+        if seqs:
+            self._delete_seqs(repository, seqs)
+
+    def count(self, repository):
+        """Counts the entries of a repository in the current transaction."""
+        self._check_open()
+        return self._collection.count_documents(self._entry_filter(repository))
+
+    def last(self, repository):
+        """Returns the most recent entry of a repository (None if there is none)."""
+        self._check_open()
+        document = self._collection.find_one(self._entry_filter(repository), sort=[('seq', -1)])
+        if document is None:
+            return None
+        return self._deserialize(document['entry'])
+
+    def truncate(self, repository, n):
+        """Removes the n most recent entries of a repository (after they were undone)."""
+        self._check_open()
+        cursor = self._collection.find(self._entry_filter(repository), projection={'seq': 1}, sort=[('seq', -1)]).limit(n)
+        self._delete_seqs(repository, [document['seq'] for document in cursor])
+
+    def entries(self, repository):
+        """Yields the entries of a repository, oldest first (pending ones excluded)."""
+        self._check_open()
+        cursor = self._collection.find(self._entry_filter(repository), sort=[('seq', 1)]).batch_size(self.batch_size)
+        for document in cursor:
+            yield self._deserialize(document['entry'])
+
+    def pending(self, repository):
+        """Yields the pending entries of a repository, newest first. Each entry is deleted from the
+        journal once the consumer asks for the next one, i.e. after it was undone.
+        """
+        self._check_open()
+        cursor = self._collection.find(self._entry_filter(repository, pending=True), sort=[('seq', -1)])
+        for document in cursor:
+            yield self._deserialize(document['entry'])
+            self._delete_seqs(repository, [document['seq']], pending=True)
+
+    def runs(self, repository):
+        """Yields (operation, entries) runs of consecutive operations of the same kind, newest first.
+        A run holds at most batch_size entries and is deleted from the journal once the consumer
+        asks for the next one, i.e. after it was undone, so an interrupted rollback can be resumed.
+        """
+        self._check_open()
+        cursor = self._collection.find(self._entry_filter(repository), sort=[('seq', -1)]).batch_size(self.batch_size)
+        run, run_seqs = [], []
+        for document in cursor:
+            ohe = self._deserialize(document['entry'])
+            if run and (ohe.operation != run[-1].operation or len(run) == self.batch_size):
+                yield run[-1].operation, run
+                self._delete_seqs(repository, run_seqs)
+                run, run_seqs = [], []
+            run.append(ohe)
+            run_seqs.append(document['seq'])
+        if run:
+            yield run[-1].operation, run
+            self._delete_seqs(repository, run_seqs)
+
+    def _delete_seqs(self, repository, seqs, pending=False):
+        self._collection.delete_many({**self._entry_filter(repository, pending), 'seq': {'$in': seqs}})
+
+    def _entry_filter(self, repository, pending=False):
+        return {'transaction_id': self._transaction_id, 'kind': 'entry', 'repository': repository,
+                'pending': True if pending else {'$ne': True}}
+
+    def _check_open(self):
+        if self._transaction_id is None:
+            raise OperationJournalRangeError(
+                'The journal has no open transaction. Call begin() or resume() first.'
+            )
+
+    def _serialize(self, ohe):
+        # entries refer to data adapters by name, so they serialize as they are
+        return ohe.dict()
+
+    def _deserialize(self, entry):
+        entry = {key: value for key, value in entry.items() if key in OperationHistoryEntry.__slots__}
+        # MongoDB returns naive UTC datetimes
+        for key, value in entry.items():
+            if isinstance(value, datetime) and value.tzinfo is None:
+                entry[key] = value.replace(tzinfo=timezone.utc)
+        return OperationHistoryEntry(**entry)
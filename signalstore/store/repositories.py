@@ -1,12 +1,18 @@
 from signalstore.store.data_access_objects import *
+from signalstore.store.datafile_adapters import data_adapter_name, data_adapter_from_name
 from signalstore.store.store_errors import *
 from signalstore.utilities.tools.strings import contains_regex_characters
+from signalstore.utilities.tools.dataarrays import summarize_dataarray
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 import jsonschema
+import numpy as np
 import json
+import itertools
+import uuid
+from collections.abc import Iterator
 from datetime import datetime
-from time import sleep
 from concurrent.futures import ThreadPoolExecutor
 
 
@@ -41,12 +47,103 @@ class AbstractRepository(ABC):
         pass
 
     # Tracking Operations That Modify the Repository
-    def timestamp(self):
+    def timestamp(self, version=False):
         """Get a timestamp to use for tracking and sorting CRUD operations.
+        Timestamps are unique and strictly increasing within the process (see unique_utc_now);
+        timestamps that become version_timestamps are also unique at the millisecond precision they are stored with.
         """
-        return datetime.now().astimezone(timezone.utc)
+        return unique_utc_now(version=version)
 
 
+    # Durable Operation Journal (optional)
+    _journal = None
+    _journal_name = None
+
+    def attach_journal(self, journal, name):
+        """Write the operation history to a durable OperationJournal under the given repository name.
+        Every operation is journaled before it is carried out (see _write_ahead); at most journal.batch_size
+        of the most recent entries are also kept in memory.
+        """
+        self._journal = journal
+        self._journal_name = name
+
+    def _journal_open(self):
+        return self._journal is not None and self._journal.transaction_id is not None
+
+    @contextmanager
+    def _write_ahead(self, ohes):
+        """Journal the entries of operations before the block carries them out, and record them once it succeeded.
+        This costs one journal insert per call, so bulk operations pass all their entries at once.
+        If the block raises, nothing was recorded and the entries are dropped again. If the process dies
+        inside the block, recovery finds the entries pending and undoes them (see _undo_pending).
+        """
+        seqs = self._journal.write(self._journal_name, ohes) if self._journal_open() else []
+        try:
+            yield
+        except Exception:
+            if seqs:
+                self._journal.discard(self._journal_name, seqs)
+            raise
+        for ohe in ohes:
+            self._record_operation(ohe)
+
+    def _record_operation(self, ohe):
+        """Append an entry to the operation history, dropping full batches that are already journaled."""
+        self._operation_history.append(ohe)
+        if self._journal_open() and len(self._operation_history) >= self._journal.batch_size:
+            self._operation_history = []
+
+    def _last_operation(self):
+        """The most recent operation history entry in memory or in the journal, or None."""
+        if len(self._operation_history) > 0:
+            return self._operation_history[-1]
+        if self._journal_open():
+            ohe = self._journal.last(self._journal_name)
+            if ohe is not None:
+                # keep it in memory until it is undone
+                self._operation_history.append(ohe)
+            return ohe
+        return None
+
+    def _forget_last_operation(self):
+        """Drop the most recent operation history entry after it was undone."""
+        self._operation_history.pop()
+        if self._journal_open():
+            self._journal.truncate(self._journal_name, 1)
+
+    def _undo_pending_operations(self):
+        """Undo the operations that the process may have died while carrying out (see OperationJournal.resume).
+        Returns the undone entries.
+        """
+        undone_operations = []
+        if self._journal_open():
+            for ohe in self._journal.pending(self._journal_name):
+                self._undo_pending(ohe)
+                undone_operations.append(ohe)
+        return undone_operations
+
+    @abstractmethod
+    def _undo_pending(self, ohe):
+        """Undo an operation that may or may not have been carried out, as far as it was."""
+        pass
+
+    def operation_history(self):
+        """All operation history entries of the current transaction, oldest first (journaled ones included)."""
+        return list(self._iter_operation_history())
+
+    def operation_summary(self):
+        """Counts the operations of the current transaction per operation and schema (see OperationHistoryEntry.summarize).
+        Journaled entries are streamed, so this stays cheap for transactions of any size.
+        """
+        return OperationHistoryEntry.summarize(self._iter_operation_history())
+
+    def _iter_operation_history(self):
+        if self._journal_open():
+            # the journal holds every completed entry, including those also kept in memory
+            yield from self._journal.entries(self._journal_name)
+        else:
+            yield from self._operation_history
+
     @abstractmethod
     def undo(self):
         """Undo most recent CRUD operation."""
@@ -90,27 +187,52 @@ class AbstractQueriableRepository(AbstractRepository):
 # Operation History Entry
 
 class OperationHistoryEntry:
-    def __init__(self, timestamp: datetime, collection_name: str, operation: str, **kwargs):
+    """One tracked CRUD operation.
+    Entries are slotted and refer to data adapters by name (see data_adapter_name), since
+    bulk transactions keep hundreds of thousands of them in memory.
+    """
+    __slots__ = (
+        "timestamp",
+        "collection_name",
+        "operation",
+        "schema_name",
+        "schema_ref",
+        "data_name",
+        "object_name",
+        "version_timestamp",
+        "has_file",
+        "data_adapter_name",
+        "patch",
+        "previous_attrs",
+    )
+    _operations = ("added", "removed", "updated", "appended")
+
+    def __init__(self, timestamp: datetime, collection_name: str, operation: str, schema_name=None, schema_ref=None, data_name=None,
+                 object_name=None, version_timestamp=None, has_file=False, data_adapter_name=None, patch=None, previous_attrs=None):
         assert isinstance(timestamp, datetime)
+        if not operation in self._operations:
+            raise OperationHistoryEntryValueError(f"operation must be one of 'added', 'removed', 'updated' or 'appended', not '{operation}'")
         self.timestamp = timestamp
         self.collection_name = collection_name
-        if not operation in ["added", "removed"]:
-            raise OperationHistoryEntryValueError(f"operation must be one of 'added' or 'removed', not '{operation}'")
         self.operation = operation
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+        self.schema_name = schema_name
+        self.schema_ref = schema_ref
+        self.data_name = data_name
+        self.object_name = object_name
+        self.version_timestamp = version_timestamp
+        self.has_file = has_file
+        self.data_adapter_name = data_adapter_name
+        self.patch = patch
+        self.previous_attrs = previous_attrs
 
     def __repr__(self):
-        repstr = f"OperationHistoryEntry(timestamp={self.timestamp}, repository={self.collection_name}, operation={self.operation}"
-        for attr in self.__dict__:
-            if attr not in ["timestamp", "collection_name", "operation"]:
-                repstr += f", {attr}={getattr(self, attr)}"
+        fields = ", ".join(f"{key}={value!r}" for key, value in self.dict().items())
+        return f"OperationHistoryEntry({fields})"
 
     def __eq__(self, other):
-        for attr in self.__dict__:
-            if getattr(self, attr) != getattr(other, attr):
-                return False
-        return True
+        if not isinstance(other, OperationHistoryEntry):
+            return NotImplemented
+        return all(getattr(self, attr) == getattr(other, attr) for attr in self.__slots__)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -118,21 +240,56 @@ class OperationHistoryEntry:
     def __gt__(self, other):
         return self.timestamp > other.timestamp
 
-    def __geq__(self, other):
+    def __ge__(self, other):
         return self.timestamp >= other.timestamp
 
     def __lt__(self, other):
         return self.timestamp < other.timestamp
 
-    def __leq__(self, other):
+    def __le__(self, other):
         return self.timestamp <= other.timestamp
 
     def dict(self):
-        return self.__dict__
+        """The fields that are set (not None), e.g. for JSON or BSON serialization."""
+        return {attr: getattr(self, attr) for attr in self.__slots__ if getattr(self, attr) is not None}
+
+    @staticmethod
+    def summarize(ohes):
+        """Counts operation history entries per operation and schema.
+        Arguments:
+            ohes -- An iterable of operation history entries.
+        Returns:
+            dict -- {operation: {schema_ref or schema_name: count}}
+        """
+        summary = {}
+        for ohe in ohes:
+            schema = ohe.schema_ref if ohe.schema_ref is not None else ohe.schema_name
+            counts = summary.setdefault(ohe.operation, {})
+            counts[schema] = counts.get(schema, 0) + 1
+        return summary
 
 class OperationHistoryEntryValueError(ValueError):
     pass
 
+# Purge Report
+
+class PurgeReport:
+    """Summarizes what a purge removed (or, for a dry run, would remove)."""
+    def __init__(self, n_records: int, n_files: int, nbytes: int=None, dry_run: bool=False):
+        self.n_records = n_records
+        self.n_files = n_files
+        self.nbytes = nbytes
+        self.dry_run = dry_run
+
+    def __repr__(self):
+        return f"PurgeReport(n_records={self.n_records}, n_files={self.n_files}, nbytes={self.nbytes}, dry_run={self.dry_run})"
+
+    def __eq__(self, other):
+        return isinstance(other, PurgeReport) and self.dict() == other.dict()
+
+    def dict(self):
+        return dict(self.__dict__)
+
 
 # ================================
 # Domain Model Repository
@@ -209,6 +366,15 @@ domain_model_json_schema = {
       "type": ["string", "null"],
       "pattern": model_identifier_regex
     },
+    # properties that records of a data model are commonly queried by; the records collection keeps an index on each
+    "indexed_properties": {
+      "type": "array",
+      "items": {
+        "type": "string",
+        "pattern": data_identifier_regex
+      },
+      "uniqueItems": True
+    },
     "version_timestamp": {
         "type": ["datetime", "integer"],
         "if": { "type": "integer" },
@@ -233,6 +399,10 @@ domain_model_json_schema = {
                         },
                     "then": {
                         "required": ["metamodel_ref"],
+                        },
+                    # only data models describe records, so only they can declare indexed properties
+                    "else": {
+                        "not": {"required": ["indexed_properties"]}
                         }
                     },
                 # if the schema_type is metamodel or data_model, then the json schema must have type property equal to 'object'
@@ -274,6 +444,7 @@ class DomainModelRepository(AbstractQueriableRepository):
         self._dao = model_dao
         self._operation_history = []
         self._model_metaschema = model_metaschema
+        self._indexed_properties_changed = False # set when a model declaring indexed_properties is added or removed
         self._arg_options = {
             "schema_name": (str),
             "model": (dict),
@@ -317,33 +488,35 @@ class DomainModelRepository(AbstractQueriableRepository):
         self._validate(model)
         if self._dao.exists(schema_name=model["schema_name"]):
             raise DomainRepositoryModelAlreadyExistsError(f"A model with schema_name '{model['schema_name']}' already exists in the repository.")
-        try:
-            self._dao.add(document=model, timestamp=ohe.timestamp)
-        except Exception as e:
-            raise DomainRepositoryUncaughtError(f"An uncaught error occurred while adding the model to the repository.\n\nTraceback: {e}")
-        self._operation_history.append(ohe)
+        with self._write_ahead([ohe]):
+            try:
+                self._dao.add(document=model, timestamp=ohe.timestamp)
+            except Exception as e:
+                raise DomainRepositoryUncaughtError(f"An uncaught error occurred while adding the model to the repository.\n\nTraceback: {e}")
+        if model.get("indexed_properties"):
+            self._indexed_properties_changed = True
         return ohe
 
     def remove(self, schema_name):
         """Mark a single domain model object for deletion; remove it from the scope of get and list searches."""
         self._check_args(schema_name=schema_name)
         ohe = OperationHistoryEntry(self.timestamp(), self._dao.collection_name, "removed", schema_name=schema_name, has_file=False)
-        if not self._dao.exists(schema_name=schema_name):
+        model = self._dao.get(schema_name=schema_name)
+        if model is None:
             raise DomainRepositoryModelNotFoundError(f"A model with schema_name '{schema_name}' does not exist in the repository.")
-        try:
-            self._dao.mark_for_deletion(schema_name=schema_name, timestamp=ohe.timestamp)
-        except Exception as e:
-            raise DomainRepositoryUncaughtError(f"An uncaught error occurred while marking the model for deletion.\n\nTraceback: {e}")
-        self._operation_history.append(ohe)
+        with self._write_ahead([ohe]):
+            try:
+                self._dao.mark_for_deletion(schema_name=schema_name, timestamp=ohe.timestamp)
+            except Exception as e:
+                raise DomainRepositoryUncaughtError(f"An uncaught error occurred while marking the model for deletion.\n\nTraceback: {e}")
+        if model.get("indexed_properties"):
+            self._indexed_properties_changed = True
         return ohe
 
     def undo(self):
         """Undo most recent CRUD operation."""
-        try:
-            ohe = self._operation_history[-1]
-            if ohe is None:
-                return None
-        except IndexError:
+        ohe = self._last_operation()
+        if ohe is None:
             return None
         now = self.timestamp()
         if ohe.operation=="removed":
@@ -355,20 +528,47 @@ class DomainModelRepository(AbstractQueriableRepository):
             self._dao.mark_for_deletion(schema_name = ohe.schema_name,
                                         timestamp = ohe.timestamp)
         # remove the operation history entry after successfully undoing the operation
-        self._operation_history.pop()
+        self._forget_last_operation()
         return ohe
 
+    def _undo_pending(self, ohe):
+        # the model is only changed back if the interrupted operation got to change it
+        exists = self._dao.exists(schema_name=ohe.schema_name)
+        if ohe.operation == "added" and exists:
+            self._dao.mark_for_deletion(schema_name=ohe.schema_name, timestamp=ohe.timestamp)
+        elif ohe.operation == "removed" and not exists:
+            self._dao.restore(schema_name=ohe.schema_name, nth_most_recent=1)
+
     def undo_all(self):
         """Undo all CRUD operations in self._operation_history."""
-        undone_operations = []
-        while len(self._operation_history) > 0:
+        undone_operations = self._undo_pending_operations()
+        while self._last_operation() is not None:
             operation = self.undo()
             undone_operations.append(operation)
+        # the undone changes never reached the indexes
+        self._indexed_properties_changed = False
         return undone_operations
 
     def clear_operation_history(self):
         """Clear the history of CRUD operations."""
         self._operation_history = []
+        self._indexed_properties_changed = False
+
+    @property
+    def indexed_properties_changed(self):
+        """Whether a model declaring indexed_properties was added or removed since the operation history was last cleared."""
+        return self._indexed_properties_changed
+
+    def indexed_properties(self):
+        """List the properties that the data models declare as indexed.
+        Returns:
+            list[str] -- The sorted, de-duplicated property names.
+        """
+        try:
+            models = self._dao.find(filter={"schema_type": "data_model", "indexed_properties": {"$exists": True}}, projection={"indexed_properties": 1})
+        except Exception as e:
+            raise DomainRepositoryUncaughtError(f"An uncaught error occurred while listing the indexed properties.\n\nTraceback: {e}")
+        return sorted({prop for model in models for prop in model.get("indexed_properties", [])})
 
     def list_marked_for_deletion(self):
         """List domain model objects marked for deletion."""
@@ -407,6 +607,10 @@ class DomainModelRepository(AbstractQueriableRepository):
             except jsonschema.exceptions.ValidationError as e:
                 message = self._validation_error_message(e, model, metaschema)
                 raise DomainRepositoryValidationError(message)
+        # indexed properties must be properties of the records the data model describes
+        for property_name in model.get("indexed_properties", []):
+            if property_name not in model["json_schema"].get("properties", {}):
+                raise DomainRepositoryValidationError(f"The indexed property '{property_name}' of model '{model['schema_name']}' is not one of its json_schema properties.")
 
 
     def _get_validator(self, schema):
@@ -469,12 +673,49 @@ class DataRepositoryUncaughtError(UncaughtError):
 class DataRepository(AbstractQueriableRepository):
     # only indexes on schema_ref,  data_name, and version_timestamp
     """A repository for records such as session metadata, data array metadata and object state metadata."""
-    def __init__(self, record_dao, file_dao, domain_repo):
+    # the fields needed to locate a record's file; used for internal lookups that do not need the full record
+    _index_projection = {"schema_ref": 1, "data_name": 1, "version_timestamp": 1, "has_file": 1, "data_adapter": 1, "data_pack": 1, "data_blob": 1}
+    # record fields managed by the repository itself; they are not part of the controlled vocabulary
+    # (data_adapter names the adapter an object's file was written with, see data_adapter_name;
+    # data_pack locates an object stored in a pack file shared with other objects, see add_packed;
+    # data_blob is the blob reference of an object whose payload is deduplicated, see FileSystemDAO.make_blob_ref)
+    _system_fields = ("data_summary", "time_start", "time_stop", "data_adapter", "data_pack", "data_blob")
+    # the dimension whose coordinate gives a data object's time extent (time_start, time_stop)
+    _time_dimension = "time"
+    # the record fields that append changes
+    _appended_fields = ("shape", "data_summary", "time_start", "time_stop")
+    # compound indexes serving find_overlapping, which matches session_data_ref stored either as a data_name or as a reference
+    _time_range_indexes = [("session_data_ref", "time_start", "time_stop"), ("session_data_ref.data_name", "time_start", "time_stop")]
+    # record fields that identify a record or are set when it is saved; update_attrs cannot change them
+    _identity_fields = ("schema_ref", "data_name", "version_timestamp", "has_file", "time_of_save", "time_of_removal")
+    # aggregate metric operators and their MongoDB accumulators
+    _aggregation_operators = {"sum": "$sum", "avg": "$avg", "min": "$min", "max": "$max", "distinct": "$addToSet"}
+
+    def __init__(self, record_dao, file_dao, domain_repo, staged_writes=False, adapter_policy=None):
+        """
+        Arguments:
+            record_dao {MongoDAO} -- The records data access object.
+            file_dao {FileSystemDAO} -- The data file access object.
+            domain_repo {DomainModelRepository} -- The domain models used for validation.
+            staged_writes {bool} -- If True, objects with files are written concurrently into a staging area
+                and only become visible (file and record) when commit_staged publishes them.
+            adapter_policy {DataAdapterPolicy} -- Chooses the data adapter of objects added without one.
+                Otherwise they get the file DAO's default adapter.
+        """
         self._records = record_dao
         self._data = file_dao
         self._domain_models = domain_repo
         self._operation_history = []
         self._validator = CustomValidator
+        self._staged_writes = staged_writes
+        self._staged = [] # (ohe, record, future of the staged write)
+        self._staging_id = None
+        self._staging_executor = None
+        self._data_adapters = {} # operation history entries and records refer to data adapters by name
+        self._adapter_policy = adapter_policy
+        if adapter_policy is not None:
+            for data_adapter in adapter_policy.data_adapters.values():
+                self._adapter_name(data_adapter)
 
 
     def get(self, schema_ref, data_name, nth_most_recent=None, version_timestamp=0, data_adapter=None, validate=True):
@@ -488,8 +729,10 @@ class DataRepository(AbstractQueriableRepository):
             version_timestamp=version_timestamp
             )
         if nth_most_recent is not None and version_timestamp==0:
-            record = self._records.find(filter={"schema_ref": schema_ref, "data_name": data_name}, sort=[("version_timestamp", 1)], limit=nth_most_recent)[-1]
-            version_timestamp = record.get("version_timestamp")
+            # the database picks the version, so only that record is fetched
+            records = self._records.find(filter={"schema_ref": schema_ref, "data_name": data_name}, sort=[("version_timestamp", 1)], skip=nth_most_recent - 1, limit=1)
+            record = records[0] if records else None
+            version_timestamp = None if record is None else record.get("version_timestamp")
         else:
             record = self._records.get(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp)
         if record is None:
@@ -498,12 +741,7 @@ class DataRepository(AbstractQueriableRepository):
             self._validate(record)
         has_file = record.get("has_file")
         if has_file:
-            data = self._data.get(
-                schema_ref=schema_ref,
-                data_name=data_name,
-                version_timestamp=version_timestamp,
-                data_adapter=data_adapter
-                )
+            data = self._read_data(record, data_adapter)
             if data is None:
                 raise DataRepositoryNotFoundError(f"Data for record with schema_ref '{schema_ref}', data_name '{data_name}', and version_timestamp '{version_timestamp}' is missing its file. The record exists and has the 'has_file' attribute set to True, but the file data access object returned None.")
             # check that data.attrs is a subset of the record's attrs
@@ -516,37 +754,61 @@ class DataRepository(AbstractQueriableRepository):
         else:
             return record
 
-    def find(self, filter=None, projection=None, sort=None, limit=None, get_data=False, validate=True):
-        """Apply filtering to get multiple records fitting a description."""
+    def find(self, filter=None, projection=None, sort=None, limit=None, get_data=False, validate=True, fields=None):
+        """Apply filtering to get multiple records fitting a description.
+        Arguments:
+            filter {dict} -- The query filter.
+            projection {dict} -- A MongoDB projection applied to the returned records.
+            sort {list[tuple]} -- A list of (key, direction) pairs to sort by.
+            limit {int} -- The maximum number of records to return.
+            get_data {bool} -- If True, return the data objects of records with files instead of their records.
+                Only the index fields are fetched for records with files.
+            validate {bool} -- If True, validate the returned records. Projected records are only validated
+                property by property, since the record schema may require fields that were not fetched.
+            fields {list[str]} -- Shorthand for an inclusion projection on these fields.
+        Returns:
+            list -- The records (or data objects).
+        """
         self._check_args(
             filter=filter,
-            projection=projection)
-        if sort is not None and limit is not None:
-            records = self._records.find(filter=filter, projection=projection).sort(sort).limit(limit)
-        elif sort is not None:
-            records = self._records.find(filter=filter, projection=projection).sort(sort)
-        elif limit is not None:
-            records = self._records.find(filter=filter, projection=projection).limit(limit)
-        else:
-            records = self._records.find(filter=filter, projection=projection)
-        # validate the records
-        if validate:
-            for record in records:
-                self._validate(record)
-        if get_data:
-            data = []
-            for record in records:
-                if record.get("has_file"):
-                    schema_ref = record.get("schema_ref")
-                    data_name = record.get("data_name")
-                    version_timestamp = record.get("version_timestamp")
-                    data_object = self._data.get(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp)
-                    data.append(data_object)
-                else:
-                    data.append(record)
-            return data
-        else:
+            projection=projection,
+            fields=fields)
+        if fields is not None:
+            if projection is not None:
+                raise DataRepositoryTypeError("Pass either projection or fields to find, not both.")
+            projection = {field: 1 for field in fields}
+        query_kwargs = {}
+        if sort is not None:
+            query_kwargs["sort"] = sort
+        if limit is not None:
+            query_kwargs["limit"] = limit
+        if not get_data:
+            records = self._records.find(filter=filter, projection=projection, **query_kwargs)
+            if validate:
+                for record in records:
+                    self._validate(record, partial=projection is not None)
             return records
+        # only the index fields are needed to load files, so full records are only fetched for records without files
+        index_records = self._records.find(filter=filter, projection=self._index_projection, **query_kwargs)
+        record_keys = [self._record_key(record) for record in index_records if not record.get("has_file")]
+        # the index fields are always fetched to match records up, and stripped again if they were not asked for
+        fetch_projection, unrequested_fields = self._records.projection_with_fields(projection, ["schema_ref", "data_name", "version_timestamp"])
+        records = {}
+        for batch in batch_list(record_keys, self._records._batch_size):
+            for record in self._records.find(filter={"$or": batch}, projection=fetch_projection):
+                records[self._key_id(record)] = record
+                for field in unrequested_fields:
+                    record.pop(field, None)
+        data = []
+        for index_record in index_records:
+            if index_record.get("has_file"):
+                data.append(self._read_data(index_record))
+            else:
+                record = records[self._key_id(index_record)]
+                if validate:
+                    self._validate(record, partial=projection is not None)
+                data.append(record)
+        return data
 
     def exists(self, schema_ref, data_name, version_timestamp=0):
         """Check if a record exists.
@@ -566,20 +828,466 @@ class DataRepository(AbstractQueriableRepository):
             schema_ref=schema_ref,
             data_name=data_name,
             version_timestamp=version_timestamp)
-        has_file = self._data.exists(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp)
+        record = self._records.get(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp)
+        if record is not None and record.get("data_pack") is not None:
+            return True
+        data_adapter = None if record is None else self._record_adapter(record)
+        has_file = self._data.exists(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, data_adapter=data_adapter)
         return has_file
 
-    def add(self, object, data_adapter=None, versioning_on=False):
-        """Add a single object to the repository."""
-        add_timestamp = self.timestamp()
-        dttype = type(datetime.now().astimezone())
+    def describe(self, schema_ref, data_name, version_timestamp=0):
+        """Get the summary metadata of a data object without touching the filesystem.
+        The summary (shape, dims, dtype, nbytes, chunks, per dimension coordinate ranges and,
+        for numeric in-memory arrays, min/max/mean) is stored in the record when the object is added.
+        Returns:
+            dict -- The summary, or None if the record does not exist or has no summary (e.g. it has no file).
+        """
+        self._check_args(
+            schema_ref=schema_ref,
+            data_name=data_name,
+            version_timestamp=version_timestamp)
+        records = self._records.find(
+            filter={"schema_ref": schema_ref, "data_name": data_name, "version_timestamp": version_timestamp},
+            projection={"data_summary": 1}
+            )
+        if len(records) == 0:
+            return None
+        return records[0].get("data_summary")
+
+    def find_overlapping(self, session, t_start, t_stop, filter=None, data_adapter=None):
+        """Find the data objects of a session whose time extent overlaps [t_start, t_stop].
+        The overlap is resolved on the records' indexed time_start/time_stop fields, so objects
+        outside the window are never opened. The files are opened lazily and the returned data is
+        indexed lazily, so only the data inside the window is read on access (local NetCDF files
+        are memory mapped; remote ones are read whole unless they are in the local file cache).
+        Arguments:
+            session {str} -- The data_name of the session, matched against session_data_ref whether it is
+                             stored as the data_name itself or as a {"schema_ref", "data_name"} reference.
+            t_start {int | float} -- The start of the window, in the units of the time coordinate.
+            t_stop {int | float} -- The end of the window (inclusive).
+            filter {dict} -- An additional record filter, e.g. {"schema_ref": "spike_times"}.
+            data_adapter {AbstractDataFileAdapter} -- The data adapter of the files.
+        Returns:
+            list[dict] -- One {'record', 'time_slice', 'data'} entry per overlapping object, ordered by time_start,
+                where time_slice indexes the time dimension and data is the object restricted to it.
+        """
+        self._check_args(session=session, t_start=t_start, t_stop=t_stop, filter=filter)
+        window = {
+            "$or": [{"session_data_ref": session}, {"session_data_ref.data_name": session}],
+            "time_start": {"$lte": t_stop},
+            "time_stop": {"$gte": t_start},
+            }
+        query = window if not filter else {"$and": [filter, window]}
+        results = []
+        for record in self._records.find(filter=query, sort=[("time_start", 1)]):
+            data = self._read_data(record, data_adapter, lazy=True)
+            if data is None:
+                raise DataRepositoryNotFoundError(f"Data for record with schema_ref '{record['schema_ref']}', data_name '{record['data_name']}', and version_timestamp '{record['version_timestamp']}' is missing its file.")
+            # only the (small) time coordinate is read to locate the window; the time coordinate is sorted
+            times = data.coords[self._time_dimension].values
+            time_slice = slice(int(np.searchsorted(times, t_start, side="left")), int(np.searchsorted(times, t_stop, side="right")))
+            results.append({"record": record, "time_slice": time_slice, "data": data.isel({self._time_dimension: time_slice})})
+        return results
+
+    def scan(self, filter, columns=None, row_filter=None, t_start=None, t_stop=None, data_adapter=None):
+        """Read the tables of all records matching a filter as a single dataset,
+        e.g. all spike times of animal A10 in a time window.
+        Records are selected in MongoDB first (a time window uses their indexed time_start/time_stop),
+        so only the files of matching objects are opened, and only the requested columns and the
+        row groups that can match the row filter are read from them.
+        Arguments:
+            filter {dict} -- The record filter, e.g. {"schema_ref": "spike_times", "animal_data_ref.data_name": "A10"}.
+            columns {list[str]} -- The columns to read (all if None).
+            row_filter {list[tuple]} -- (column, op, value) conditions that rows must all meet, e.g. [("unit", "==", 3)].
+            t_start {int | float} -- The start of a window on the time column.
+            t_stop {int | float} -- The end of the window (inclusive).
+            data_adapter {AbstractDataFileAdapter} -- The data adapter of the files; it must support scanning
+                (e.g. PandasDataFrameParquetAdapter). Defaults to the adapter recorded with the objects.
+        Returns:
+            pyarrow.Table -- The matching rows with a data_name column naming the object of each row,
+                ordered by time_start (None if no record matches).
+        """
+        self._check_args(filter=filter, columns=columns, row_filter=row_filter)
+        query = dict(filter)
+        query["has_file"] = True
+        query["data_pack"] = None # packed objects are not files of their own
+        row_filter = list(row_filter or [])
+        if t_start is not None:
+            self._check_args(t_start=t_start)
+            query["time_stop"] = {"$gte": t_start}
+            row_filter.append((self._time_dimension, ">=", t_start))
+        if t_stop is not None:
+            self._check_args(t_stop=t_stop)
+            query["time_start"] = {"$lte": t_stop}
+            row_filter.append((self._time_dimension, "<=", t_stop))
+        records = self._records.find(filter=query, projection=self._index_projection, sort=[("time_start", 1)])
+        keys = [{**self._record_key(record), "blob_ref": record.get("data_blob") or False} for record in records]
+        if data_adapter is None:
+            recorded = {record.get("data_adapter") for record in records}
+            if len(recorded) > 1:
+                raise DataRepositoryTypeError(f"Cannot scan records written with different data adapters {sorted(map(str, recorded))}; narrow the filter.")
+            if recorded:
+                data_adapter = self._adapter(recorded.pop())
+        try:
+            return self._data.scan(keys, columns=columns, filter=row_filter or None, data_adapter=data_adapter)
+        except FileSystemDAOTypeError as e:
+            raise DataRepositoryTypeError(str(e))
+        except FileSystemDAOFileNotFoundError as e:
+            raise DataRepositoryNotFoundError(str(e))
+
+    def append(self, schema_ref, data_name, chunk, dim="time", data_adapter=None):
+        """Append a chunk to a growing (unversioned) data object, e.g. during a streaming acquisition.
+        Only the chunk is written, so recordings can be ingested in bounded memory. The record's shape,
+        data_summary and time extent are then updated in a single atomic record update; if that fails,
+        the file is truncated back. The running mean of the summary cannot be updated incrementally and
+        is dropped; min and max are kept. The append is recorded in the operation history with the previous
+        length and record fields, so undo and rollback truncate the file and restore the record.
+        Arguments:
+            schema_ref {str} -- The type of the object.
+            data_name {str} -- The name of the object.
+            chunk -- The data to append (an xarray DataArray matching the object in all other dimensions).
+            dim {str} -- The dimension to append along.
+            data_adapter {AbstractDataFileAdapter} -- The adapter of the file; it must support appending (e.g. zarr).
+        Raises:
+            DataRepositoryNotFoundError -- If the object or its file does not exist.
+            DataRepositoryTypeError -- If the chunk lacks the dimension or the adapter cannot append.
+        Returns:
+            OperationHistoryEntry -- The entry of the append.
+        """
+        self._check_args(schema_ref=schema_ref, data_name=data_name)
+        record = self._records.get(schema_ref=schema_ref, data_name=data_name, version_timestamp=0)
+        if record is None or not record.get("has_file"):
+            raise DataRepositoryNotFoundError(f"There is no unversioned data object with a file for schema_ref '{schema_ref}' and data_name '{data_name}' to append to.")
+        if record.get("data_pack") is not None:
+            raise DataRepositoryTypeError(f"Cannot append to the packed data object with schema_ref '{schema_ref}' and data_name '{data_name}'.")
+        if dim not in getattr(chunk, "dims", ()):
+            raise DataRepositoryTypeError(f"The chunk to append must have the dimension '{dim}'.")
+        data_adapter = self._record_adapter(record, data_adapter)
+        if not (data_adapter or self._data._default_data_adapter).supports_append:
+            raise DataRepositoryTypeError(f"Cannot append to the data object with schema_ref '{schema_ref}' and data_name '{data_name}' because its data adapter does not support appending.")
+        # the previous length is kept for undo; appendable formats are opened lazily, so only metadata is read
+        stored = self._data.get(schema_ref=schema_ref, data_name=data_name, data_adapter=data_adapter)
+        if stored is None:
+            raise DataRepositoryNotFoundError(f"The file of the data object with schema_ref '{schema_ref}' and data_name '{data_name}' is missing.")
+        if dim not in stored.dims:
+            raise DataRepositoryTypeError(f"The data object with schema_ref '{schema_ref}' and data_name '{data_name}' has no dimension '{dim}' to append along.")
+        size = int(stored.sizes[dim])
+        ohe = OperationHistoryEntry(
+            self.timestamp(),
+            self._records.collection_name, "appended",
+            schema_ref=schema_ref,
+            data_name=data_name,
+            version_timestamp=0,
+            has_file=True,
+            data_adapter_name=self._adapter_name(data_adapter),
+            patch={"dim": dim, "size": size},
+            previous_attrs={field: record[field] for field in self._appended_fields if field in record}
+            )
+        with self._write_ahead([ohe]):
+            try:
+                self._data.append(schema_ref=schema_ref, data_name=data_name, data_object=chunk, dim=dim, data_adapter=data_adapter)
+            except FileSystemDAOFileNotFoundError as e:
+                raise DataRepositoryNotFoundError(str(e))
+            except FileSystemDAOTypeError as e:
+                raise DataRepositoryTypeError(str(e))
+            try:
+                self._update_appended_record(record, chunk, dim)
+            except Exception:
+                self._data.truncate(schema_ref=schema_ref, data_name=data_name, size=size, dim=dim, data_adapter=data_adapter)
+                raise
+        return ohe
+
+    def _update_appended_record(self, record, chunk, dim):
+        """Grow the shape, data_summary and time extent of a record by an appended chunk in one atomic update."""
+        update = {"$inc": {}, "$min": {}, "$max": {}, "$unset": {}}
+        n_new = int(chunk.sizes[dim])
+        if isinstance(record.get("shape"), list) and dim in record.get("data_summary", {}).get("dims", []):
+            update["$inc"][f"shape.{record['data_summary']['dims'].index(dim)}"] = n_new
+        summary = record.get("data_summary")
+        if summary is not None:
+            chunk_summary = summarize_dataarray(chunk)
+            update["$inc"][f"data_summary.shape.{summary['dims'].index(dim)}"] = n_new
+            update["$inc"]["data_summary.nbytes"] = chunk_summary["nbytes"]
+            if dim in chunk_summary["coords"]:
+                update["$inc"][f"data_summary.coords.{dim}.size"] = n_new
+                update["$min"][f"data_summary.coords.{dim}.min"] = chunk_summary["coords"][dim]["min"]
+                update["$max"][f"data_summary.coords.{dim}.max"] = chunk_summary["coords"][dim]["max"]
+            for statistic, operator in (("min", "$min"), ("max", "$max")):
+                if statistic in summary and statistic in chunk_summary:
+                    update[operator][f"data_summary.{statistic}"] = chunk_summary[statistic]
+            if "mean" in summary:
+                update["$unset"]["data_summary.mean"] = ""
+        extent = self._time_extent(chunk) if dim == self._time_dimension else {}
+        if extent:
+            update["$min"]["time_start"] = extent["time_start"]
+            update["$max"]["time_stop"] = extent["time_stop"]
+        update = {operator: fields for operator, fields in update.items() if fields}
+        if update:
+            self._records.update(update, schema_ref=record["schema_ref"], data_name=record["data_name"], version_timestamp=0)
+
+    def _undo_append(self, ohe):
+        """Restore the record fields an append changed and truncate its file to the previous length."""
+        unset = {field: "" for field in self._appended_fields if field not in ohe.previous_attrs}
+        update = {"$set": ohe.previous_attrs, "$unset": unset}
+        self._records.update({operator: fields for operator, fields in update.items() if fields},
+                             schema_ref=ohe.schema_ref, data_name=ohe.data_name, version_timestamp=0)
+        self._data.truncate(schema_ref=ohe.schema_ref, data_name=ohe.data_name, size=ohe.patch["size"],
+                            dim=ohe.patch["dim"], data_adapter=self._adapter(ohe.data_adapter_name))
+
+    def update_attrs(self, schema_ref, data_name, version_timestamp, patch, data_adapter=None):
+        """Change attributes of a record (and of its data file) without rewriting the array data.
+        The record is updated in place and so are the attrs stored with the file (see FileSystemDAO.update_attrs).
+        The update is recorded in the operation history, so undo and rollback restore the previous values.
+        Arguments:
+            schema_ref {str} -- The type of the object.
+            data_name {str} -- The name of the object.
+            version_timestamp {datetime | int} -- The version of the object (0 for unversioned objects).
+            patch {dict} -- The attributes to set and their new values.
+            data_adapter {AbstractDataFileAdapter} -- The adapter of the file.
+        Raises:
+            DataRepositoryNotFoundError -- If the record does not exist.
+            DataRepositoryValidationError -- If the patch changes an identity or system field or the patched record is invalid.
+        Returns:
+            OperationHistoryEntry -- The entry of the update.
+        """
+        self._check_args(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, patch=patch)
+        protected = set(patch).intersection(self._identity_fields + self._system_fields)
+        if protected:
+            raise DataRepositoryValidationError(f"The attributes {sorted(protected)} are managed by the repository and cannot be updated.")
+        record = self._records.get(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp)
+        if record is None:
+            raise DataRepositoryNotFoundError(f"There is no record with schema_ref '{schema_ref}', data_name '{data_name}', and version_timestamp '{version_timestamp}' to update.")
+        self._validate({**record, **patch})
+        ohe = OperationHistoryEntry(
+            self.timestamp(),
+            self._records.collection_name, "updated",
+            schema_ref=schema_ref,
+            data_name=data_name,
+            version_timestamp=record["version_timestamp"],
+            has_file=bool(record.get("has_file")) and record.get("data_pack") is None,
+            data_adapter_name=self._adapter_name(self._record_adapter(record, data_adapter)),
+            patch=dict(patch),
+            previous_attrs={key: record[key] for key in patch if key in record}
+            )
+        with self._write_ahead([ohe]):
+            self._apply_attrs(ohe, set_attrs=ohe.patch, record=record)
+        return ohe
+
+    def _apply_attrs(self, ohe, set_attrs, unset_attrs=(), record=None):
+        """Set and remove attributes of the record (and file) of an operation history entry."""
+        update = {}
+        if set_attrs:
+            update["$set"] = dict(set_attrs)
+        if unset_attrs:
+            update["$unset"] = {key: "" for key in unset_attrs}
+        if ohe.has_file:
+            if record is None:
+                record = self._records.get(schema_ref=ohe.schema_ref, data_name=ohe.data_name, version_timestamp=ohe.version_timestamp) or {}
+            try:
+                blob_ref = self._data.update_attrs(
+                    schema_ref=ohe.schema_ref,
+                    data_name=ohe.data_name,
+                    set_attrs=set_attrs,
+                    unset_attrs=unset_attrs,
+                    version_timestamp=ohe.version_timestamp,
+                    data_adapter=self._adapter(ohe.data_adapter_name),
+                    blob_ref=record.get("data_blob") or False
+                    )
+            except FileSystemDAOFileNotFoundError as e:
+                raise DataRepositoryNotFoundError(str(e))
+            if blob_ref is not None:
+                update.setdefault("$set", {})["data_blob"] = blob_ref
+        if not ohe.has_file:
+            data_pack = self._repack(ohe, set_attrs, unset_attrs)
+            if data_pack is not None:
+                update.setdefault("$set", {})["data_pack"] = data_pack
+        if update:
+            self._records.update(update, schema_ref=ohe.schema_ref, data_name=ohe.data_name, version_timestamp=ohe.version_timestamp)
+
+    def _repack(self, ohe, set_attrs, unset_attrs):
+        """Write a packed object with changed attrs into a pack of its own (packs are never changed in place).
+        Returns the new data_pack of its record, or None if the record is not packed."""
+        record = self._records.get(schema_ref=ohe.schema_ref, data_name=ohe.data_name, version_timestamp=ohe.version_timestamp)
+        if record is None or record.get("data_pack") is None:
+            return None
+        data_adapter = self._adapter(ohe.data_adapter_name)
+        data = self._read_data(record, data_adapter)
+        if data is None:
+            raise DataRepositoryNotFoundError(f"The pack of the data object with schema_ref '{ohe.schema_ref}' and data_name '{ohe.data_name}' is missing.")
+        data.attrs.update(set_attrs)
+        for key in unset_attrs:
+            data.attrs.pop(key, None)
+        pack, [(offset, length)] = self._data.write_pack([data], data_adapter=data_adapter)
+        return {"pack": pack, "offset": offset, "length": length}
+
+    def _read_data(self, record, data_adapter=None, lazy=False):
+        """Read the data object of a record with a file, from its own file or from its pack (None if it is missing).
+        Packed objects are small, so they are always read whole."""
+        data_adapter = self._record_adapter(record, data_adapter)
+        data_pack = record.get("data_pack")
+        if data_pack is None:
+            # the record knows whether the file is a blob reference, so the file is never opened to find out
+            return self._data.get(
+                schema_ref=record["schema_ref"],
+                data_name=record["data_name"],
+                version_timestamp=record["version_timestamp"],
+                data_adapter=data_adapter,
+                lazy=lazy,
+                blob_ref=record.get("data_blob") or False
+                )
+        try:
+            return self._data.read_packed(data_pack["pack"], data_pack["offset"], data_pack["length"], data_adapter=data_adapter)
+        except FileSystemDAOFileNotFoundError:
+            return None
+
+    def _time_extent(self, object):
+        """Get the time_start/time_stop record fields from a numeric time coordinate,
+        or the time column of a table (empty if there is none).
+        """
+        columns = getattr(object, "columns", ())
+        if self._time_dimension in columns:
+            times = np.asarray(object[self._time_dimension])
+        else:
+            coords = getattr(object, "coords", {})
+            if self._time_dimension not in getattr(object, "dims", ()) or self._time_dimension not in coords:
+                return {}
+            times = coords[self._time_dimension].values
+        if times.size == 0 or times.dtype.kind not in "iuf":
+            return {}
+        return {"time_start": times.min().item(), "time_stop": times.max().item()}
+
+    def iterate(self, filter=None, page_size=1000, resume_token=None, fields=None, validate=True):
+        """Iterate over the records matching a filter in pages, ordered by (schema_ref, data_name, version_timestamp).
+        Pages are fetched with keyset pagination, so page N costs the same as page 1.
+        Arguments:
+            filter {dict} -- The query filter.
+            page_size {int} -- The number of records per page.
+            resume_token {str} -- A token yielded with an earlier page; iteration continues right after that page.
+            fields {list[str]} -- Only return these record fields.
+            validate {bool} -- If True, validate the records (property by property if fields is given).
+        Yields:
+            tuple[list[dict], str] -- A page of records and the token to resume after it (None for the last page).
+        """
+        self._check_args(filter=filter, fields=fields, page_size=page_size, resume_token=resume_token)
+        projection = None if fields is None else {field: 1 for field in fields}
+        pages = self._records.iterate_pages(filter=filter, projection=projection, page_size=page_size, resume_token=resume_token)
+        while True:
+            try:
+                records, next_token = next(pages)
+            except StopIteration:
+                return
+            except MongoDAOTypeError as e:
+                raise DataRepositoryTypeError(str(e))
+            except MongoDAORangeError as e:
+                raise DataRepositoryRangeError(str(e))
+            if validate:
+                for record in records:
+                    self._validate(record, partial=fields is not None)
+            yield records, next_token
+
+    def count(self, filter=None):
+        """Count the records matching a filter without fetching them."""
+        self._check_args(filter=filter)
+        return self._records.count(filter=filter)
+
+    def distinct(self, field, filter=None):
+        """Get the distinct values of a record field, e.g. distinct("data_name", {"schema_ref": "session"})."""
+        self._check_args(field=field, filter=filter)
+        return self._records.distinct(field, filter=filter)
+
+    def aggregate(self, group_by, metrics=None, filter=None):
+        """Summarize records per group on the database server.
+        Arguments:
+            group_by {str | list[str]} -- The record field(s) to group by.
+            metrics {dict} -- Maps output names to "count" or to an (operator, field) pair, where the operator
+                is one of "sum", "avg", "min", "max" or "distinct". Defaults to {"count": "count"}.
+            filter {dict} -- Only aggregate the records matching this filter.
+        Returns:
+            list[dict] -- One row per group with the group_by fields and the metrics, sorted by the group_by fields.
+        Example:
+            aggregate(group_by="session_data_ref", metrics={"n_arrays": "count"}, filter={"schema_ref": "spike_times"})
+        """
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        if metrics is None:
+            metrics = {"count": "count"}
+        self._check_args(group_by=group_by, metrics=metrics, filter=filter)
+        group = {"_id": {field: f"${field}" for field in group_by}}
+        for name, metric in metrics.items():
+            if metric == "count":
+                group[name] = {"$sum": 1}
+            elif isinstance(metric, (tuple, list)) and len(metric) == 2 and metric[0] in self._aggregation_operators:
+                group[name] = {self._aggregation_operators[metric[0]]: f"${metric[1]}"}
+            else:
+                raise DataRepositoryTypeError(f"Metric '{name}' must be 'count' or an (operator, field) pair with an operator in {list(self._aggregation_operators)}, not {metric}.")
+        pipeline = []
+        if filter is not None:
+            pipeline.append({"$match": filter})
+        pipeline.append({"$group": group})
+        pipeline.append({"$sort": {f"_id.{field}": 1 for field in group_by}})
+        rows = []
+        for result in self._records.aggregate(pipeline):
+            key = result.pop("_id")
+            rows.append(self._records._deserialize({**key, **result}))
+        return rows
+
+    def latest_versions(self, filter=None, validate=True):
+        """Get the most recent version of every (schema_ref, data_name) matching a filter in a single query.
+        The records are sorted by version_timestamp and grouped on the server ($sort + $group).
+        """
+        self._check_args(filter=filter)
+        pipeline = []
+        if filter is not None:
+            pipeline.append({"$match": filter})
+        pipeline += [
+            {"$sort": {"version_timestamp": -1}},
+            {"$group": {"_id": {"schema_ref": "$schema_ref", "data_name": "$data_name"}, "record": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$record"}},
+            {"$project": {"_id": 0}},
+            {"$sort": {"schema_ref": 1, "data_name": 1}},
+        ]
+        records = [self._records._deserialize(record) for record in self._records.aggregate(pipeline)]
+        if validate:
+            for record in records:
+                self._validate(record)
+        return records
+
+    def ensure_indexes(self):
+        """Maintain the secondary indexes of the records collection.
+        Every property declared in some data model's indexed_properties gets a partial index
+        over live (not removed) records; indexes for properties that are no longer declared are dropped.
+        Compound (session, time_start, time_stop) indexes serve find_overlapping.
+        Returns:
+            list[str] -- The names of the maintained indexes.
+        """
+        return self._records.ensure_indexes([*self._domain_models.indexed_properties(), *self._time_range_indexes])
+
+    def add(self, object, data_adapter=None, versioning_on=False, dim="time"):
+        """Add a single object to the repository.
+        Data larger than memory can be added as a dask-backed DataArray or as an iterator (e.g. a generator)
+        of DataArray chunks that are concatenated along dim; the first chunk carries the attrs of the object.
+        Chunks are streamed to the file one at a time, which requires an adapter that supports appending (zarr).
+        """
+        add_timestamp = self.timestamp(version=versioning_on)
+        if isinstance(object, Iterator):
+            try:
+                first_chunk = next(object)
+            except StopIteration:
+                raise DataRepositoryTypeError("Cannot add an empty iterator of chunks.")
+            if not hasattr(first_chunk, "attrs"):
+                raise DataRepositoryTypeError(f"The chunks must be objects with an 'attrs' attribute, not {type(first_chunk)}")
+            self._stamp_version(first_chunk.attrs, add_timestamp, versioning_on)
+            ohe = self._add_data_from_chunks(
+                first_chunk=first_chunk,
+                chunks=object,
+                add_timestamp=add_timestamp,
+                versioning_on=versioning_on,
+                dim=dim,
+                data_adapter=data_adapter
+                )
+            return ohe
         if isinstance(object, dict):
-            if versioning_on and not isinstance(object.get("version_timestamp"), dttype):
-                object["version_timestamp"] = add_timestamp
-            elif not versioning_on:
-                object["version_timestamp"] = 0
-            elif not isinstance(object.get("version_timestamp"), dttype):
-                raise DataRepositoryTypeError(f"'version_timestamp' must be a {dttype} object or the integer 0, not {type(object.get('version_timestamp'))}.")
+            self._stamp_version(object, add_timestamp, versioning_on)
             ohe = self._add_record(
                 object=object,
                 add_timestamp=add_timestamp,
@@ -587,12 +1295,7 @@ class DataRepository(AbstractQueriableRepository):
                 )
             return ohe
         elif hasattr(object, "attrs"):
-            if versioning_on and not isinstance(object.attrs.get("version_timestamp"), dttype):
-                object.attrs["version_timestamp"] = add_timestamp
-            elif not versioning_on:
-                object.attrs["version_timestamp"] = 0
-            elif not isinstance(object.attrs.get("version_timestamp"), dttype):
-                raise DataRepositoryTypeError(f"'version_timestamp' must be a {dttype} object or the integer 0, not {type(object.attrs.get('version_timestamp'))}.")
+            self._stamp_version(object.attrs, add_timestamp, versioning_on)
             ohe = self._add_data_with_file(
                 object=object,
                 add_timestamp=add_timestamp,
@@ -603,6 +1306,84 @@ class DataRepository(AbstractQueriableRepository):
         else:
             raise DataRepositoryTypeError(f"object must be a dict or an object with an 'attrs' attribute, not {type(object)}")
 
+    def add_packed(self, objects, data_adapter=None, versioning_on=False):
+        """Add many small data objects (e.g. the sampling rates, labels and per-tetrode metadata of a session)
+        packed into a single pack file instead of one file each. Their records hold the offset and length
+        of each object in the pack, so getting one of them is a single ranged read.
+        Packs are never changed in place: update_attrs moves an object into a pack of its own, removing
+        an object only marks its record, and purge deletes the packs that no record refers to any more.
+        Arguments:
+            objects {list} -- The data objects (with attrs) to add.
+            data_adapter {AbstractDataFileAdapter} -- The adapter encoding the objects; it must support packing
+                (e.g. XarrayDataArrayNetCDFAdapter). Defaults to the adapter chosen for the first object.
+            versioning_on {bool} -- If True, the objects get version timestamps.
+        Raises:
+            DataRepositoryTypeError -- If an object has no attrs or the adapter cannot pack objects.
+            DataRepositoryAlreadyExistsError -- If some of the objects already exist; then none are added.
+        Returns:
+            list[OperationHistoryEntry] -- One entry per added object.
+        """
+        objects = list(objects)
+        if len(objects) == 0:
+            return []
+        add_timestamp = self.timestamp(version=versioning_on)
+        for object in objects:
+            if not hasattr(object, "attrs"):
+                raise DataRepositoryTypeError(f"Packed objects must have an 'attrs' attribute, not {type(object)}")
+            self._stamp_version(object.attrs, add_timestamp, versioning_on)
+            if object.attrs.get("has_file") is None:
+                object.attrs["has_file"] = True
+            self._validate(object.attrs)
+        if data_adapter is None:
+            data_adapter = self._select_adapter(objects[0])
+        keys = [self._record_key(object.attrs) for object in objects]
+        for batch in batch_list(keys, self._records._batch_size):
+            existing = self._records.find(filter={"$or": batch}, projection=self._index_projection)
+            if len(existing) > 0:
+                raise DataRepositoryAlreadyExistsError(f"Cannot add packed objects that already exist in the repository: {[self._record_key(record) for record in existing]}.")
+        adapter_name = self._adapter_name(data_adapter)
+        # the pack is shared, so undoing the adds only marks the records; the pack is collected by purge
+        ohes = [
+            OperationHistoryEntry(
+                add_timestamp,
+                self._records.collection_name,
+                "added",
+                has_file=False,
+                data_adapter_name=adapter_name,
+                **key
+                )
+            for key in keys
+        ]
+        with self._write_ahead(ohes):
+            try:
+                pack, extents = self._data.write_pack(objects, data_adapter=data_adapter)
+            except FileSystemDAOTypeError as e:
+                raise DataRepositoryTypeError(str(e))
+            records = []
+            for object, (offset, length) in zip(objects, extents):
+                record = dict(object.attrs)
+                record["data_adapter"] = adapter_name
+                record["data_pack"] = {"pack": pack, "offset": offset, "length": length}
+                if all(hasattr(object, attr) for attr in ("shape", "dtype", "nbytes")):
+                    record["data_summary"] = summarize_dataarray(object)
+                record.update(self._time_extent(object))
+                records.append(record)
+            try:
+                self._records.add_many(records, timestamp=add_timestamp)
+            except MongoDAODocumentAlreadyExistsError as e:
+                raise DataRepositoryAlreadyExistsError(str(e))
+        return ohes
+
+    def _stamp_version(self, attrs, add_timestamp, versioning_on):
+        """Set the version_timestamp of an object about to be added (the add time, or 0 if versioning is off)."""
+        dttype = type(datetime.now().astimezone())
+        if versioning_on and not isinstance(attrs.get("version_timestamp"), dttype):
+            attrs["version_timestamp"] = add_timestamp
+        elif not versioning_on:
+            attrs["version_timestamp"] = 0
+        elif not isinstance(attrs.get("version_timestamp"), dttype):
+            raise DataRepositoryTypeError(f"'version_timestamp' must be a {dttype} object or the integer 0, not {type(attrs.get('version_timestamp'))}.")
+
     def _add_record(self, object, add_timestamp, versioning_on):
         ohe = OperationHistoryEntry(
                 add_timestamp,
@@ -611,44 +1392,188 @@ class DataRepository(AbstractQueriableRepository):
                 schema_ref=object["schema_ref"],
                 data_name=object["data_name"],
                 version_timestamp=object["version_timestamp"],
-                data_adapter = None,
                 has_file = False)
         if object.get("has_file") is None:
             object['has_file'] = False
         self._validate(object)
-        self._records.add(
-                    document=object,
-                    timestamp=add_timestamp,
-                    versioning_on=versioning_on
-                    )
-        self._operation_history.append(ohe)
+        with self._write_ahead([ohe]):
+            self._records.add(
+                        document=object,
+                        timestamp=add_timestamp,
+                        versioning_on=versioning_on
+                        )
         return ohe
 
     def _add_data_with_file(self, object, add_timestamp, versioning_on, data_adapter=None):
         if data_adapter is None:
-            data_adapter = self._data._default_data_adapter
+            data_adapter = self._select_adapter(object)
         ohe = OperationHistoryEntry(
             add_timestamp,
             self._records.collection_name, "added",
             schema_ref=object.attrs["schema_ref"],
             data_name=object.attrs["data_name"],
             has_file = True,
-            data_adapter = data_adapter,
+            data_adapter_name=self._adapter_name(data_adapter),
             version_timestamp=object.attrs["version_timestamp"]
             )
         if object.attrs.get("has_file") is None:
             object.attrs["has_file"] = True
         self._validate(object.attrs)
-        self._records.add(
-            document=object.attrs,
-            timestamp=ohe.timestamp,
-            versioning_on=versioning_on
-            )
-        self._data.add(
-            data_object=object,
-            data_adapter=data_adapter
+        record = dict(object.attrs)
+        record["data_adapter"] = ohe.data_adapter_name
+        # store summary metadata in the record so that describe never needs to read the file
+        if all(hasattr(object, attr) for attr in ("shape", "dtype", "nbytes")):
+            record["data_summary"] = summarize_dataarray(object)
+        record.update(self._time_extent(object))
+        # the blob reference of a deduplicated payload is kept in the record, see _read_data
+        blob_ref = self._data.make_blob_ref(object, data_adapter)
+        if blob_ref is not None:
+            record["data_blob"] = blob_ref
+        if self._staged_writes:
+            return self._stage_data_with_file(ohe, object, record, data_adapter)
+        with self._write_ahead([ohe]):
+            self._records.add(
+                document=record,
+                timestamp=ohe.timestamp,
+                versioning_on=versioning_on
+                )
+            self._data.add(
+                data_object=object,
+                data_adapter=data_adapter,
+                blob_ref=blob_ref or False
+                )
+        return ohe
+
+    def _stage_data_with_file(self, ohe, object, record, data_adapter):
+        key = self._record_key(record)
+        if self._records.exists(**key) or any(self._key_id(key) == self._key_id(self._record_key(staged_record)) for _, staged_record, _ in self._staged):
+            raise DataRepositoryAlreadyExistsError(f"A record with schema_ref '{ohe.schema_ref}', data_name '{ohe.data_name}', and version_timestamp '{ohe.version_timestamp}' already exists.")
+        if self._staging_id is None:
+            self._staging_id = uuid.uuid4().hex
+            if self._journal_open():
+                # recover deletes the staging area if the process dies before the transaction ends
+                self._journal.add_staging_id(self._staging_id)
+            self._staging_executor = ThreadPoolExecutor()
+        # write a shallow copy so that the caller can keep using the object while it is written
+        future = self._staging_executor.submit(self._data.stage, object.copy(deep=False), self._staging_id, data_adapter, record.get("data_blob") or False)
+        self._staged.append((ohe, record, future))
+        return ohe
+
+    def commit_staged(self):
+        """Publish the staged objects: wait for their files, promote the files into place with concurrent renames
+        and then insert all their records with one bulk write, so readers never see a record without its file.
+        If the records cannot be inserted, the promoted files are moved back and discarded with the staging area.
+        The published operations join the operation history.
+        Raises:
+            DataRepositoryAlreadyExistsError -- If a staged object was added by someone else in the meantime.
+            DataRepositoryUncaughtError -- If a staged write failed.
+        Returns:
+            list[OperationHistoryEntry] -- The published operations.
+        """
+        if not self._staged:
+            return []
+        staged, staging_id = self._staged, self._staging_id
+        self._staged, self._staging_id = [], None
+        # wait for every staged write
+        self._shutdown_staging_executor()
+        try:
+            paths = [future.result() for _, _, future in staged]
+        except Exception as e:
+            self._data.discard_staging(staging_id)
+            raise DataRepositoryUncaughtError(f"A staged write failed, so none of the {len(staged)} staged objects were published. The error was: {e}")
+        ohes = [ohe for ohe, _, _ in staged]
+        records = [record for _, record, _ in staged]
+        with self._write_ahead(ohes):
+            try:
+                # promote moves all files or none
+                try:
+                    self._data.promote(paths)
+                except FileSystemDAOFileAlreadyExistsError as e:
+                    raise DataRepositoryAlreadyExistsError(str(e))
+                timestamp = self.timestamp()
+                try:
+                    self._records.add_many(records, timestamp=timestamp)
+                except MongoDAODocumentAlreadyExistsError as e:
+                    # no record was added; take the promoted files back out of view
+                    self._data.demote(paths)
+                    raise DataRepositoryAlreadyExistsError(str(e))
+                except Exception:
+                    # a failed batch may have left some of the records behind
+                    self._data.demote(paths)
+                    try:
+                        self._records.mark_many_for_deletion([self._record_key(record) for record in records], timestamp=timestamp)
+                    except MongoDAODocumentNotFoundError:
+                        pass
+                    raise
+            finally:
+                self._data.discard_staging(staging_id)
+        return ohes
+
+    def discard_staged(self):
+        """Drop the staged objects without publishing them (rollback); only the staging area is deleted."""
+        if not self._staged:
+            return []
+        staged, staging_id = self._staged, self._staging_id
+        self._staged, self._staging_id = [], None
+        for _, _, future in staged:
+            future.cancel()
+        # let running writes finish before their staging area is deleted
+        self._shutdown_staging_executor()
+        self._data.discard_staging(staging_id)
+        return [ohe for ohe, _, _ in staged]
+
+    def _shutdown_staging_executor(self):
+        """Stops the threads that wrote the staged files once they are done; the next staged add starts new ones."""
+        if self._staging_executor is not None:
+            self._staging_executor.shutdown(wait=True)
+            self._staging_executor = None
+
+    def _add_data_from_chunks(self, first_chunk, chunks, add_timestamp, versioning_on, dim, data_adapter=None):
+        if data_adapter is None:
+            data_adapter = self._select_adapter(first_chunk, streamed=True)
+        ohe = OperationHistoryEntry(
+            add_timestamp,
+            self._records.collection_name, "added",
+            schema_ref=first_chunk.attrs["schema_ref"],
+            data_name=first_chunk.attrs["data_name"],
+            has_file = True,
+            data_adapter_name=self._adapter_name(data_adapter),
+            version_timestamp=first_chunk.attrs["version_timestamp"]
             )
-        self._operation_history.append(ohe)
+        if first_chunk.attrs.get("has_file") is None:
+            first_chunk.attrs["has_file"] = True
+        self._validate(first_chunk.attrs)
+        if self._records.exists(schema_ref=ohe.schema_ref, data_name=ohe.data_name, version_timestamp=ohe.version_timestamp):
+            raise DataRepositoryAlreadyExistsError(f"A record with schema_ref '{ohe.schema_ref}', data_name '{ohe.data_name}', and version_timestamp '{ohe.version_timestamp}' already exists.")
+        record = dict(first_chunk.attrs)
+        record["data_adapter"] = ohe.data_adapter_name
+        with self._write_ahead([ohe]):
+            try:
+                self._data.add(
+                    data_object=itertools.chain([first_chunk], chunks),
+                    data_adapter=data_adapter,
+                    dim=dim
+                    )
+            except FileSystemDAOTypeError as e:
+                raise DataRepositoryTypeError(str(e))
+            except FileSystemDAOFileAlreadyExistsError as e:
+                raise DataRepositoryAlreadyExistsError(str(e))
+            # the summary is taken from the written file; statistics would need a full pass over the data
+            written = self._data.get(
+                schema_ref=ohe.schema_ref,
+                data_name=ohe.data_name,
+                version_timestamp=ohe.version_timestamp,
+                data_adapter=data_adapter
+                )
+            record["data_summary"] = summarize_dataarray(written, statistics=False)
+            if isinstance(record.get("shape"), list):
+                record["shape"] = record["data_summary"]["shape"]
+            record.update(self._time_extent(written))
+            self._records.add(
+                document=record,
+                timestamp=ohe.timestamp,
+                versioning_on=versioning_on
+                )
         return ohe
 
     def remove(self, schema_ref, data_name, version_timestamp=0, data_adapter=None):
@@ -657,9 +1582,12 @@ class DataRepository(AbstractQueriableRepository):
             schema_ref=schema_ref,
             data_name=data_name,
             version_timestamp=version_timestamp)
-        if not self._records.exists(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp):
+        record = self._records.get(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp)
+        if record is None:
             raise DataRepositoryNotFoundError(f"A record with schema_ref '{schema_ref}', data_name '{data_name}', and version_timestamp '{version_timestamp}' does not exist in the repository.")
-        has_file = self._data.exists(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, data_adapter=data_adapter)
+        data_adapter = self._record_adapter(record, data_adapter)
+        # packed objects stay in their pack until it is collected, so only their record is marked
+        has_file = record.get("data_pack") is None and self._data.exists(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, data_adapter=data_adapter)
 
         ohe = OperationHistoryEntry(
             self.timestamp(),
@@ -668,22 +1596,118 @@ class DataRepository(AbstractQueriableRepository):
             data_name=data_name,
             version_timestamp=version_timestamp,
             has_file=has_file,
-            data_adapter=data_adapter
+            data_adapter_name=self._adapter_name(data_adapter)
             )
 
-        if has_file:
-            if data_adapter is None:
-                data_adapter = self._data._default_data_adapter
-            self._data.mark_for_deletion(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, time_of_removal=ohe.timestamp, data_adapter=data_adapter)
-        self._records.mark_for_deletion(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, timestamp=ohe.timestamp)
-        self._operation_history.append(ohe)
+        with self._write_ahead([ohe]):
+            if has_file:
+                if data_adapter is None:
+                    data_adapter = self._data._default_data_adapter
+                self._data.mark_for_deletion(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, time_of_removal=ohe.timestamp, data_adapter=data_adapter)
+            self._records.mark_for_deletion(schema_ref=schema_ref, data_name=data_name, version_timestamp=version_timestamp, timestamp=ohe.timestamp)
         return ohe
 
+    def remove_many(self, filter_or_keys, data_adapter=None):
+        """Mark many records (and their files) for deletion in batches.
+        Arguments:
+            filter_or_keys {dict | list[dict]} -- Either a query filter selecting the records to remove,
+                or a list of dicts with the schema_ref, data_name and (optionally) version_timestamp of each record.
+            data_adapter {AbstractDataFileAdapter} -- The data adapter of the files. Defaults to the adapter recorded
+                with each object (or the file DAO's default adapter).
+        Raises:
+            DataRepositoryNotFoundError -- If some of the keyed records do not exist.
+        Returns:
+            list[OperationHistoryEntry] -- One entry per removed record.
+        """
+        index_projection = self._index_projection
+        if isinstance(filter_or_keys, dict):
+            records = self._records.find(filter=filter_or_keys, projection=index_projection)
+            keys = [self._record_key(record) for record in records]
+        elif isinstance(filter_or_keys, (list, tuple)):
+            keys = [self._record_key(key) for key in filter_or_keys]
+            for key in keys:
+                self._check_args(**key)
+            # a record listed twice is removed once
+            keys = list({self._key_id(key): key for key in keys}.values())
+            records = []
+            for batch in batch_list(keys, self._records._batch_size):
+                records += self._records.find(filter={"$or": batch}, projection=index_projection)
+            found = {self._key_id(record) for record in records}
+            missing = [key for key in keys if self._key_id(key) not in found]
+            if len(missing) > 0:
+                raise DataRepositoryNotFoundError(f"Cannot remove records that do not exist in the repository: {missing}.")
+        else:
+            raise DataRepositoryTypeError(f"filter_or_keys must be a dict or a list of dicts, not {type(filter_or_keys)}.")
+        if len(keys) == 0:
+            return []
+        # the records tell us which objects have files, so we never touch the filesystem to find out
+        has_file = {self._key_id(record): bool(record.get("has_file")) and record.get("data_pack") is None for record in records}
+        adapter_names = {self._key_id(record): self._adapter_name(self._record_adapter(record, data_adapter)) for record in records}
+        timestamp = self.timestamp()
+        ohes = [
+            OperationHistoryEntry(
+                timestamp,
+                self._records.collection_name,
+                "removed",
+                has_file=has_file[self._key_id(key)],
+                data_adapter_name=adapter_names[self._key_id(key)],
+                **key
+                )
+            for key in keys
+        ]
+        with self._write_ahead(ohes):
+            # records are marked first; if a file step fails they are restored, so the two never disagree
+            self._records.mark_many_for_deletion(keys, timestamp=timestamp)
+            try:
+                self._mark_files_for_deletion(self._group_by_adapter(ohes), timestamp)
+            except Exception:
+                self._records.restore_many(keys)
+                raise
+        return ohes
+
+    def _mark_files_for_deletion(self, file_keys, timestamp):
+        """Mark the files of each adapter group for deletion; if a group fails, the groups already marked are restored."""
+        marked = []
+        try:
+            for data_adapter, adapter_keys in file_keys.values():
+                self._data.mark_many_for_deletion(adapter_keys, time_of_removal=timestamp, data_adapter=data_adapter)
+                marked.append((data_adapter, adapter_keys))
+        except Exception:
+            for data_adapter, adapter_keys in marked:
+                self._data.restore_many(adapter_keys, data_adapter=data_adapter)
+            raise
+
+    def _restore_files(self, file_keys, timestamp):
+        """Restore the files of each adapter group; if a group fails, the groups already restored are marked again."""
+        restored = []
+        try:
+            for data_adapter, adapter_keys in file_keys.values():
+                self._data.restore_many(adapter_keys, data_adapter=data_adapter)
+                restored.append((data_adapter, adapter_keys))
+        except Exception:
+            for data_adapter, adapter_keys in restored:
+                self._data.mark_many_for_deletion(adapter_keys, time_of_removal=timestamp, data_adapter=data_adapter)
+            raise
+
+    @staticmethod
+    def _record_key(record):
+        return {
+            "schema_ref": record["schema_ref"],
+            "data_name": record["data_name"],
+            "version_timestamp": record.get("version_timestamp") or 0,
+        }
+
+    @staticmethod
+    def _key_id(key):
+        # MongoDB truncates datetimes to milliseconds, so keys are compared at millisecond precision
+        version_timestamp = key.get("version_timestamp") or 0
+        if version_timestamp != 0:
+            version_timestamp = datetime_to_microseconds(version_timestamp) // 1000
+        return (key["schema_ref"], key["data_name"], version_timestamp)
 
     def undo(self):
-        try:
-            ohe = self._operation_history[-1]
-        except IndexError:
+        ohe = self._last_operation()
+        if ohe is None:
             return None
         if ohe.operation=="removed":
             self._records.restore(
@@ -697,7 +1721,7 @@ class DataRepository(AbstractQueriableRepository):
                     schema_ref = ohe.schema_ref,
                     data_name = ohe.data_name,
                     version_timestamp = ohe.version_timestamp,
-                    data_adapter = ohe.data_adapter,
+                    data_adapter = self._adapter(ohe.data_adapter_name),
                     nth_most_recent = 1
                     )
         elif ohe.operation=="added":
@@ -712,20 +1736,147 @@ class DataRepository(AbstractQueriableRepository):
                     data_name = ohe.data_name,
                     version_timestamp = ohe.version_timestamp,
                     time_of_removal = ohe.timestamp,
-                    data_adapter = ohe.data_adapter
+                    data_adapter = self._adapter(ohe.data_adapter_name)
                     )
+        elif ohe.operation=="updated":
+            self._undo_update(ohe)
+        elif ohe.operation=="appended":
+            self._undo_append(ohe)
         # remove the operation history entry after successfully undoing the operation
-        self._operation_history.pop()
+        self._forget_last_operation()
         return ohe
 
+    def _undo_pending(self, ohe):
+        # the record and file are only changed back as far as the interrupted operation got to change them
+        key = self._record_key(ohe.dict())
+        data_adapter = self._adapter(ohe.data_adapter_name)
+        if ohe.operation == "added":
+            if self._records.exists(**key):
+                self._records.mark_for_deletion(**key, timestamp=ohe.timestamp)
+            if ohe.has_file and self._data.exists(**key, data_adapter=data_adapter):
+                self._data.mark_for_deletion(**key, time_of_removal=ohe.timestamp, data_adapter=data_adapter)
+        elif ohe.operation == "removed":
+            if not self._records.exists(**key):
+                self._records.restore(**key, nth_most_recent=1)
+            if ohe.has_file and not self._data.exists(**key, data_adapter=data_adapter):
+                self._data.restore(**key, data_adapter=data_adapter, nth_most_recent=1)
+        elif ohe.operation == "updated":
+            # restoring the previous values is harmless if they were never changed
+            self._undo_update(ohe)
+        elif ohe.operation == "appended":
+            self._undo_append(ohe)
+
     def undo_all(self):
-        """Undo all CRUD operations in self._operation_history."""
-        undone_operations = []
+        """Undo all CRUD operations in self._operation_history.
+        Consecutive operations of the same kind are undone together with bulk
+        record updates and concurrent file renames.
+        """
+        undone_operations = self._undo_pending_operations()
+        conflicts = []
         while len(self._operation_history) > 0:
-            operation = self.undo()
-            undone_operations.append(operation)
+            # collect the most recent run of operations of the same kind
+            operation = self._operation_history[-1].operation
+            n = 0
+            while n < len(self._operation_history) and self._operation_history[-1 - n].operation == operation:
+                n += 1
+            run = self._operation_history[-n:][::-1]
+            conflicts += self._undo_run(operation, run)
+            del self._operation_history[-n:]
+            if self._journal_open():
+                self._journal.truncate(self._journal_name, n)
+            undone_operations.extend(run)
+        if self._journal_open():
+            # older operations are streamed back from the journal; undone_operations only counts them
+            for operation, run in self._journal.runs(self._journal_name):
+                conflicts += self._undo_run(operation, run)
+                undone_operations.extend(run)
+        if len(conflicts) > 0:
+            # everything else has been undone by now
+            raise DataRepositoryAlreadyExistsError(
+                f"Could not restore removed records because they were added again since: {conflicts}."
+            )
         return undone_operations
 
+    def _undo_run(self, operation, ohes):
+        """Undo a run of operations of the same kind in bulk.
+        Records are changed first; if a file step fails, the record change is reverted.
+        Returns:
+            list[dict] -- The keys of removed records that could not be restored because they were added again.
+        """
+        keys = [self._record_key(ohe.dict()) for ohe in ohes]
+        conflicts = []
+        if operation == "removed":
+            conflicts = self._records.restore_many(keys)
+            # the files of conflicting records belong to the records that were added again
+            conflict_ids = {self._key_id(key) for key in conflicts}
+            restored = [ohe for ohe in ohes if self._key_id(ohe.dict()) not in conflict_ids]
+            restored_keys = [key for key in keys if self._key_id(key) not in conflict_ids]
+            try:
+                self._restore_files(self._group_by_adapter(restored), self.timestamp())
+            except Exception:
+                self._records.mark_many_for_deletion(restored_keys, timestamp=self.timestamp())
+                raise
+        elif operation == "added":
+            timestamp = self.timestamp()
+            self._records.mark_many_for_deletion(keys, timestamp=timestamp)
+            try:
+                self._mark_files_for_deletion(self._group_by_adapter(ohes), timestamp)
+            except Exception:
+                self._records.restore_many(keys)
+                raise
+        elif operation == "updated":
+            # updates of the same record must be undone in order, so they are not batched
+            for ohe in ohes:
+                self._undo_update(ohe)
+        elif operation == "appended":
+            for ohe in ohes:
+                self._undo_append(ohe)
+        return conflicts
+
+    def _undo_update(self, ohe):
+        """Restore the attributes an update_attrs call changed; attributes it added are removed."""
+        added = [key for key in ohe.patch if key not in ohe.previous_attrs]
+        self._apply_attrs(ohe, set_attrs=ohe.previous_attrs, unset_attrs=added)
+
+    def _select_adapter(self, object, streamed=False):
+        """The data adapter for an object added without one: the policy's choice, or the file DAO's default."""
+        if self._adapter_policy is None:
+            return self._data._default_data_adapter
+        return self._adapter_policy.select(object, streamed=streamed)
+
+    def _record_adapter(self, record, data_adapter=None):
+        """The data adapter passed by the caller, or else the one recorded when the object was added
+        (None, i.e. the file DAO's default, for records that predate recorded adapters)."""
+        if data_adapter is not None:
+            return data_adapter
+        return self._adapter(record.get("data_adapter"))
+
+    def _adapter_name(self, data_adapter):
+        """The name an operation history entry refers to a data adapter by; the adapter is kept for undo."""
+        if data_adapter is None:
+            return None
+        name = data_adapter_name(data_adapter)
+        self._data_adapters.setdefault(name, data_adapter)
+        return name
+
+    def _adapter(self, name):
+        """The data adapter an operation history entry refers to. Entries read back from a journal
+        may name adapters this repository has not used yet; those are created by data_adapter_from_name.
+        """
+        if name is None:
+            return None
+        if name not in self._data_adapters:
+            self._data_adapters[name] = data_adapter_from_name(name)
+        return self._data_adapters[name]
+
+    def _group_by_adapter(self, ohes):
+        """Group the record keys of file operations by data adapter, since each adapter has its own file extension."""
+        file_keys = {}
+        for ohe in ohes:
+            if ohe.has_file:
+                file_keys.setdefault(ohe.data_adapter_name, (self._adapter(ohe.data_adapter_name), []))[1].append(self._record_key(ohe.dict()))
+        return file_keys
+
     def clear_operation_history(self):
         """Clear the history of CRUD operations."""
         self._operation_history = []
@@ -738,7 +1889,7 @@ class DataRepository(AbstractQueriableRepository):
         records_with_paths = []
         records_without_paths = []
         for record in records:
-            if record.get("has_file"):
+            if record.get("has_file") and record.get("data_pack") is None:
                 records_with_paths.append(record)
             else:
                 records_without_paths.append(record)
@@ -748,27 +1899,53 @@ class DataRepository(AbstractQueriableRepository):
         tuples.sort(key=lambda x: x[0].get("time_of_removal"))
         return tuples
 
-    def purge(self, time_threshold=None):
-        """Purge (permanently delete) records marked for deletion."""
-        self._records.purge(time_threshold=time_threshold)
-        self._data.purge(time_threshold=time_threshold)
-
-    def _validate(self, record):
-        """Validate a single object prior to adding it into the repository."""
-        schema_ref = record.get("schema_ref")
-        # get teh main domain model using the schema_ref
-        domain_model = self._domain_models.get(schema_name=schema_ref)
-        # check that the schema_ref exists in the repository
-        if domain_model is None:
-            raise DataRepositoryValidationError(f"The schema_ref '{schema_ref}' does not exist in the repository. The original record is\n\n{record}.")
-        # get the json schema from the domain model and try to validate the record
-        record_json_schema = domain_model.get("json_schema")
-        try:
-            validator = self._get_validator(record_json_schema)
-            validator.validate(record)
-        except jsonschema.exceptions.ValidationError as e:
-            message = self._validation_error_message(e, record, record_json_schema)
-            raise DataRepositoryValidationError(message)
+    def purge(self, time_threshold=None, dry_run=False, progress_callback=None):
+        """Purge (permanently delete) records and data objects marked for deletion.
+        The trash is derived from the stored state on every call, so an interrupted
+        purge is resumed by calling purge again. Files are deleted before records, so
+        an interruption never leaves a file without its trashed record.
+        Arguments:
+            time_threshold {datetime} -- Only purge objects removed before this time.
+            dry_run {bool} -- If True, only report what would be purged, including the reclaimed bytes.
+            progress_callback {callable} -- Called as progress_callback(n_purged, n_total) while files are deleted.
+        Returns:
+            PurgeReport -- The number of purged records and files (and the reclaimable bytes on a dry run).
+        """
+        if dry_run:
+            n_files, nbytes = self._data.estimate_purge(time_threshold=time_threshold)
+            n_records = self._records.count_marked_for_deletion(time_threshold=time_threshold)
+            return PurgeReport(n_records=n_records, n_files=n_files, nbytes=nbytes, dry_run=True)
+        # blobs are collected below from the references in the records, without reading reference files
+        n_files = self._data.purge(time_threshold=time_threshold, progress_callback=progress_callback, collect_blobs=False)
+        n_records = self._records.purge(time_threshold=time_threshold)
+        if self._data.has_blobs:
+            # records marked for deletion can still be restored, so their blobs are kept
+            n_files += self._data.collect_blobs(self._records.distinct("data_blob.blob", include_removed=True))
+        if self._data.has_packs:
+            # records marked for deletion can still be restored, so their packs are kept
+            n_files += self._data.collect_packs(self._records.distinct("data_pack.pack", include_removed=True))
+        return PurgeReport(n_records=n_records, n_files=n_files)
+
+    def _validate(self, record, partial=False):
+        """Validate a single object prior to adding it into the repository.
+        If partial is True (e.g. for a projected record), only the properties present in the record are validated.
+        """
+        record = {key: value for key, value in record.items() if key not in self._system_fields}
+        if not partial:
+            schema_ref = record.get("schema_ref")
+            # get teh main domain model using the schema_ref
+            domain_model = self._domain_models.get(schema_name=schema_ref)
+            # check that the schema_ref exists in the repository
+            if domain_model is None:
+                raise DataRepositoryValidationError(f"The schema_ref '{schema_ref}' does not exist in the repository. The original record is\n\n{record}.")
+            # get the json schema from the domain model and try to validate the record
+            record_json_schema = domain_model.get("json_schema")
+            try:
+                validator = self._get_validator(record_json_schema)
+                validator.validate(record)
+            except jsonschema.exceptions.ValidationError as e:
+                message = self._validation_error_message(e, record, record_json_schema)
+                raise DataRepositoryValidationError(message)
         # if the record has passed overall validation, then check that each property is valid
         # each property should have a corresponding domain model with the same schema_name as the property name
         def validate_property(property_name, value):
@@ -805,6 +1982,18 @@ class DataRepository(AbstractQueriableRepository):
             "time_threshold": (datetime, type(None)),
             "filter": (dict, type(None)),
             "projection": (dict, type(None)),
+            "fields": (list, tuple, type(None)),
+            "field": (str),
+            "group_by": (list, tuple),
+            "metrics": (dict),
+            "page_size": (int),
+            "session": (str),
+            "t_start": (int, float),
+            "t_stop": (int, float),
+            "resume_token": (str, type(None)),
+            "patch": (dict),
+            "columns": (list, type(None)),
+            "row_filter": (list, type(None)),
         }
 
     def _get_validator(self, schema):
@@ -907,6 +2096,10 @@ class InMemoryObjectRepository(AbstractRepository):
         # remove the operation history entry after successfully undoing the operation
         self._operation_history.pop()
 
+    def _undo_pending(self, ohe):
+        # in-memory objects do not outlive the process, so they are never journaled or recovered
+        pass
+
     def undo_all(self):
         """Undo all CRUD operations in self._operation_history."""
         while len(self._operation_history) > 0:
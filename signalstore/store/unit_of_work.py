@@ -26,10 +26,23 @@ class UnitOfWorkContextError(Exception):
     pass
 
 class UnitOfWork:
-    def __init__(self, domain_model_repo, data_repo, in_memory_object_repo):
+    def __init__(self, domain_model_repo, data_repo, in_memory_object_repo, journal=None):
+        """
+        Arguments:
+            domain_model_repo {DomainModelRepository} -- The domain model repository.
+            data_repo {DataRepository} -- The data repository.
+            in_memory_object_repo {InMemoryObjectRepository} -- The in-memory object repository.
+            journal {OperationJournal} -- Optional durable journal of the domain model and data operations,
+                                          which makes transactions recoverable after a crash.
+        """
         self._domain_models = domain_model_repo
         self._data = data_repo
         self._memory = in_memory_object_repo
+        self._journal = journal
+        if journal is not None:
+            # in-memory objects do not outlive the process, so they need no journal
+            domain_model_repo.attach_journal(journal, 'domain_models')
+            data_repo.attach_journal(journal, 'data')
         self._in_context = False
 
     @property
@@ -58,26 +71,58 @@ class UnitOfWork:
         # reset the operations history for each repository
         self._in_context = True
         self._clear_operation_history()
+        if self._journal is not None:
+            self._journal.begin()
         return self
 
     def __exit__(self, type, value, traceback):
-        self.rollback()
-        self._in_context = False
+        try:
+            self.rollback()
+        finally:
+            if self._journal is not None:
+                self._journal.end()
+            self._in_context = False
 
     def rollback(self):
+        self.data.discard_staged()
         self.domain_models.undo_all()
-        self.data.undo_all()
-        self.memory.undo_all()
-
-    def commit(self):
-        operations = self._get_all_operations()
+        try:
+            # raises after undoing everything else if removed records were added again meanwhile
+            self.data.undo_all()
+        finally:
+            self.memory.undo_all()
+
+    def commit(self, summary=False):
+        """Commits the unit of work and reports its operations.
+        Arguments:
+            summary {bool} -- Report counts per operation and schema instead of the operation history entries,
+                              which keeps the report small for bulk transactions.
+        Returns:
+            dict -- {repository: [OperationHistoryEntry]}, or {repository: {operation: {schema: count}}} if summary is True.
+        """
+        # staged data objects become visible here, before the operations are reported
+        self.data.commit_staged()
+        if self.domain_models.indexed_properties_changed:
+            # the indexes are otherwise only maintained when the provider first opens the project
+            self.data.ensure_indexes()
+        operations = self._get_operation_summary() if summary else self._get_all_operations()
         self._clear_operation_history()
+        if self._journal is not None:
+            # the committed operations are no longer needed for recovery
+            self._journal.end()
+            self._journal.begin()
         return operations
 
-    def purge(self, time_threshold=None):
+    def purge(self, time_threshold=None, dry_run=False, progress_callback=None):
+        """Purges everything marked for deletion and returns the data repository's PurgeReport.
+        A dry run only estimates the data purge and leaves all repositories untouched.
+        """
+        if dry_run:
+            return self.data.purge(time_threshold, dry_run=True)
         self.domain_models.purge(time_threshold)
-        self.data.purge(time_threshold)
+        report = self.data.purge(time_threshold, progress_callback=progress_callback)
         self.memory.purge(time_threshold)
+        return report
 
     def _clear_operation_history(self):
         self.domain_models.clear_operation_history()
@@ -88,9 +133,16 @@ class UnitOfWork:
         # (timestamp, report{operation, kwargs, result})
         # TODO document operation_history entries more clearly
         return {
-            'domain_models': self.domain_models._operation_history,
-            'data': self.data._operation_history,
-            'memory': self.memory._operation_history,
+            'domain_models': self.domain_models.operation_history(),
+            'data': self.data.operation_history(),
+            'memory': self.memory.operation_history(),
+        }
+
+    def _get_operation_summary(self):
+        return {
+            'domain_models': self.domain_models.operation_summary(),
+            'data': self.data.operation_summary(),
+            'memory': self.memory.operation_summary(),
         }
 
 
@@ -13,24 +13,108 @@ from signalstore.store.repositories import (
 from signalstore.store.datafile_adapters import (
     AbstractDataFileAdapter,
     XarrayDataArrayNetCDFAdapter,
-    XarrayDataArrayZarrAdapter
+    XarrayDataArrayZarrAdapter,
+    XarrayDataArrayRawNumpyAdapter,
+    PandasDataFrameParquetAdapter
 )
 
 
+from signalstore.store.adapter_policy import DataAdapterPolicy
+from signalstore.store.file_cache import LocalFileCache
+
 from signalstore.store.unit_of_work import UnitOfWork
+from signalstore.store.operation_journal import OperationJournal
 
 class UnitOfWorkProvider:
-    def __init__(self, mongo_client, filesystem, memory_store, default_filetype='netcdf'):
+    def __init__(self, mongo_client, filesystem, memory_store, default_filetype='netcdf', cache_dir=None, cache_max_bytes=10 * 2**30, deduplicate=False, journal=False, journal_batch_size=1000, staged_writes=False, adapter_rules=None):
+        """Creates UnitOfWork instances for projects.
+        Arguments:
+            mongo_client -- The MongoDB client.
+            filesystem {fsspec.AbstractFileSystem} -- The filesystem that stores the data files.
+            memory_store {dict} -- The dictionary backing the in-memory object repository.
+            default_filetype {str} -- The default file type ('netcdf', 'zarr', 'numpy' or 'parquet').
+            cache_dir {str} -- Optional local directory for caching immutable (versioned) data files.
+                               Useful when the filesystem is remote (e.g. gcsfs).
+            cache_max_bytes {int} -- The size limit of the local file cache in bytes.
+            deduplicate {bool} -- Store identical versioned arrays once (content addressed), so that
+                                  metadata-only revisions do not copy the data.
+            journal {bool} -- Keep a durable operation journal in MongoDB, so that transactions interrupted
+                              by a crash can be rolled back with recover and large transactions do not
+                              hold their whole operation history in memory.
+            journal_batch_size {int} -- The number of operations per repository kept in memory and read back from the journal at once.
+            staged_writes {bool} -- Write data files concurrently into a staging area and publish them
+                                    (files and records) only when the unit of work commits.
+            adapter_rules {list[dict]} -- Rules that choose the file type of each object added without a data
+                                          adapter from its size, shape, dtype and schema_ref (see DataAdapterPolicy,
+                                          e.g. DataAdapterPolicy.default_rules). Objects no rule matches get
+                                          default_filetype. The chosen adapter is recorded with each object, so
+                                          get, remove and undo find its file without being passed the adapter.
+                                          If None, every object gets default_filetype.
+        """
         self._mongo_client = mongo_client
         self._filesystem = filesystem
         self._memory_store = memory_store
         self._default_file_type = default_filetype
+        self._deduplicate = deduplicate
+        self._journal = journal
+        self._journal_batch_size = journal_batch_size
+        self._staged_writes = staged_writes
+        self._indexed_projects = set() # projects whose record indexes were maintained by this provider
         self._file_adapter_options = {
             'netcdf': XarrayDataArrayNetCDFAdapter(),
-            'zarr': XarrayDataArrayZarrAdapter()
+            'zarr': XarrayDataArrayZarrAdapter(),
+            'numpy': XarrayDataArrayRawNumpyAdapter(),
+            'parquet': PandasDataFrameParquetAdapter()
         }
+        if adapter_rules is None:
+            self._adapter_policy = None
+        else:
+            self._adapter_policy = DataAdapterPolicy(self._file_adapter_options, default=default_filetype, rules=adapter_rules)
+        if cache_dir is None:
+            self._file_cache = None
+        else:
+            self._file_cache = LocalFileCache(cache_dir=cache_dir, max_bytes=cache_max_bytes)
 
     def __call__(self, project_name):
+        domain_model_repo, data_repo, in_memory_object_repo = self._make_repositories(project_name)
+        return UnitOfWork(
+            domain_model_repo=domain_model_repo,
+            data_repo=data_repo,
+            in_memory_object_repo=in_memory_object_repo,
+            journal=self._make_journal(project_name) if self._journal else None,
+        )
+
+    def recover(self, project_name):
+        """Rolls back the transactions of a project that were left open by a crashed process
+        and deletes the staging areas those transactions never published.
+        Only call this when no other process is writing to the project, since its open transactions
+        cannot be told apart from abandoned ones.
+        Returns:
+            list[str] -- The ids of the rolled back transactions.
+        """
+        domain_model_repo, data_repo, _ = self._make_repositories(project_name)
+        journal = self._make_journal(project_name)
+        domain_model_repo.attach_journal(journal, 'domain_models')
+        data_repo.attach_journal(journal, 'data')
+        recovered = journal.open_transactions()
+        for transaction_id in recovered:
+            journal.resume(transaction_id)
+            # staging areas of unfinished transactions were never published
+            for staging_id in journal.staging_ids():
+                data_repo._data.discard_staging(staging_id)
+            domain_model_repo.undo_all()
+            data_repo.undo_all()
+            journal.end()
+        return recovered
+
+    def _make_journal(self, project_name):
+        return OperationJournal(
+            client=self._mongo_client,
+            database_name=project_name,
+            batch_size=self._journal_batch_size
+            )
+
+    def _make_repositories(self, project_name):
         if not isinstance(project_name, str):
             raise ValueError("project_name must be a string")
         model_dao = MongoDAO(client=self._mongo_client,
@@ -47,7 +131,9 @@ class UnitOfWorkProvider:
         file_system_dao = FileSystemDAO(
             filesystem=self._filesystem,
             project_dir=project_name,
-            default_data_adapter=self._file_adapter_options[self._default_file_type]
+            default_data_adapter=self._file_adapter_options[self._default_file_type],
+            file_cache=self._file_cache,
+            deduplicate=self._deduplicate
             )
 
         in_memory_object_dao = InMemoryObjectDAO(memory_store=self._memory_store)
@@ -56,12 +142,14 @@ class UnitOfWorkProvider:
 
         data_repo = DataRepository(record_dao=record_dao,
                                 file_dao=file_system_dao,
-                                domain_repo=domain_model_repo)
+                                domain_repo=domain_model_repo,
+                                staged_writes=self._staged_writes,
+                                adapter_policy=self._adapter_policy)
+        if project_name not in self._indexed_projects:
+            # later changes to the indexed properties are applied when their unit of work commits
+            data_repo.ensure_indexes()
+            self._indexed_projects.add(project_name)
 
         in_memory_object_repo = InMemoryObjectRepository(memory_dao=in_memory_object_dao)
 
-        return UnitOfWork(
-            domain_model_repo=domain_model_repo,
-            data_repo=data_repo,
-            in_memory_object_repo=in_memory_object_repo,
-        )
+        return domain_model_repo, data_repo, in_memory_object_repo
@@ -0,0 +1,397 @@
+"""Synthetic, valid acquisition files for testing and benchmarking the Axona and Intan readers.
+
+The files follow the layouts the readers in signalstore.adapters.read_adapters.recording_acquisitions
+decode: Axona .eeg/.egf (continuous LFP), .pos (position), .N (tetrode spikes) and .cut (cluster labels),
+and Intan .rhd/.rhs (amplifier recordings) and spike.dat (detected spikes). The signals are random but
+well formed (e.g. positions are a smooth walk inside the arena and spike times increase), and every
+generator takes a seed, so the same arguments always write the same bytes.
+"""
+
+import importlib
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Axona system constants
+AXONA_EEG_SAMPLE_RATE = 250
+AXONA_EGF_SAMPLE_RATE = 4800
+AXONA_POS_SAMPLE_RATE = 50
+AXONA_SPIKE_TIMEBASE = 96000
+AXONA_SAMPLES_PER_SPIKE = 50
+AXONA_TETRODE_CHANNELS = 4
+# Intan magic numbers and data block sizes
+INTAN_RHD_MAGIC = 0xC6912702
+INTAN_RHS_MAGIC = 0xD69127AC
+INTAN_SPIKE_MAGIC = 0x18F8474B # multichannel spike.dat
+INTAN_SAMPLES_PER_BLOCK = 128
+INTAN_SNAPSHOT_SAMPLES = (10, 30) # samples before and after detection
+# the Intan readers are scripts that import their helpers as the top-level package 'intanutil'
+_intan_reader_modules = {
+    "rhd": "signalstore.adapters.read_adapters.recording_acquisitions.intan.load_intan_rhd_format.load_intan_rhd_format",
+    "rhs": "signalstore.adapters.read_adapters.recording_acquisitions.intan.load_intan_rhs_format.load_intan_rhs_format",
+}
+
+
+# =============================================================================
+# Axona
+# =============================================================================
+
+def _axona_header(lines):
+    return b"".join(f"{key} {value}\r\n".encode("utf-8") for key, value in lines)
+
+
+def _axona_file(path, header_lines, data):
+    with open(path, "wb") as f:
+        f.write(_axona_header(header_lines))
+        f.write(b"data_start")
+        f.write(data)
+        f.write(b"\r\ndata_end\r\n")
+    return Path(path)
+
+
+def _axona_trial_lines(duration):
+    return [
+        ("trial_date", "Thursday, 10 Aug 2023"),
+        ("trial_time", "12:00:00"),
+        ("experimenter", "synthetic"),
+        ("duration", int(np.ceil(duration))),
+        ("sw_version", "1.2.2.16"),
+    ]
+
+
+def write_axona_lfp(path, duration, file_type="eeg", seed=0):
+    """Write an Axona .eeg (250 Hz, int8) or .egf (4.8 kHz, int16) file of a noisy theta oscillation.
+    Arguments:
+        path {str | Path} -- The file to write.
+        duration {float} -- The recording duration in seconds.
+        file_type {str} -- 'eeg' or 'egf'.
+        seed {int} -- The seed of the noise.
+    Returns:
+        Path -- The written file.
+    """
+    if file_type == "eeg":
+        sample_rate, dtype, sample_key = AXONA_EEG_SAMPLE_RATE, ">i1", "num_EEG_samples"
+    elif file_type == "egf":
+        sample_rate, dtype, sample_key = AXONA_EGF_SAMPLE_RATE, "<i2", "num_EGF_samples"
+    else:
+        raise ValueError(f"file_type must be 'eeg' or 'egf', not {file_type}.")
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * sample_rate)
+    amplitude = np.iinfo(np.dtype(dtype)).max // 2
+    theta = np.sin(2 * np.pi * 8 * np.arange(n_samples) / sample_rate)
+    samples = np.clip(amplitude * theta + rng.normal(0, amplitude / 4, n_samples), -amplitude * 2, amplitude * 2).astype(dtype)
+    header_lines = _axona_trial_lines(duration) + [
+        ("num_chans", 1),
+        ("sample_rate", f"{sample_rate}.0 hz"),
+        ("EEG_samples_per_position", sample_rate // AXONA_POS_SAMPLE_RATE),
+        ("bytes_per_sample", np.dtype(dtype).itemsize),
+        (sample_key, n_samples),
+    ]
+    return _axona_file(path, header_lines, samples.tobytes())
+
+
+def write_axona_pos(path, duration, arena_size=(400, 400), pixels_per_metre=600, seed=0):
+    """Write an Axona two-spot .pos file of an animal walking smoothly around a square arena.
+    Arguments:
+        path {str | Path} -- The file to write.
+        duration {float} -- The recording duration in seconds.
+        arena_size {tuple[int, int]} -- The arena width and height in pixels.
+        pixels_per_metre {int} -- The camera resolution.
+        seed {int} -- The seed of the walk.
+    Returns:
+        Path -- The written file.
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * AXONA_POS_SAMPLE_RATE)
+    width, height = arena_size
+    # a slow random walk (about 20 cm/s) reflected at the arena walls
+    steps = rng.normal(0, 0.2 * pixels_per_metre / AXONA_POS_SAMPLE_RATE, (n_samples, 2))
+    walk = np.cumsum(steps, axis=0) + np.array([width, height]) / 2
+    walk = np.abs(np.mod(walk, 2 * np.array([width, height])) - np.array([width, height]))
+    x, y = np.rint(walk).astype(">i2").T
+    samples = np.zeros(n_samples, dtype=[("t", ">i4"), ("words", ">i2", 8)])
+    samples["t"] = np.arange(n_samples)
+    samples["words"][:, 0] = x
+    samples["words"][:, 1] = y
+    samples["words"][:, 2:4] = 1023 # the second spot is not tracked
+    samples["words"][:, 4] = 40 # pixels of the first spot
+    samples["words"][:, 6] = 40
+    header_lines = _axona_trial_lines(duration) + [
+        ("min_x", 0),
+        ("max_x", width),
+        ("min_y", 0),
+        ("max_y", height),
+        ("window_min_x", 0),
+        ("window_max_x", width),
+        ("window_min_y", 0),
+        ("window_max_y", height),
+        ("timebase", f"{AXONA_POS_SAMPLE_RATE}.0 hz"),
+        ("bytes_per_timestamp", 4),
+        ("sample_rate", f"{AXONA_POS_SAMPLE_RATE}.0 hz"),
+        ("pos_format", "t,x1,y1,x2,y2,numpix1,numpix2"),
+        ("bytes_per_coord", 2),
+        ("pixels_per_metre", pixels_per_metre),
+        ("num_pos_samples", n_samples),
+    ]
+    return _axona_file(path, header_lines, samples.tobytes())
+
+
+def write_axona_tetrode(path, duration, spike_rate=20.0, seed=0):
+    """Write an Axona tetrode (.N) file: per spike, a big-endian timestamp and 50 int8 samples for each of 4 channels.
+    Arguments:
+        path {str | Path} -- The file to write.
+        duration {float} -- The recording duration in seconds.
+        spike_rate {float} -- The mean number of spikes per second.
+        seed {int} -- The seed of the spike times and waveforms.
+    Returns:
+        Path -- The written file.
+    """
+    rng = np.random.default_rng(seed)
+    n_spikes = max(int(duration * spike_rate), 1)
+    timestamps = np.sort(rng.integers(0, int(duration * AXONA_SPIKE_TIMEBASE), n_spikes))
+    template = -60 * np.exp(-0.5 * ((np.arange(AXONA_SAMPLES_PER_SPIKE) - 12) / 3) ** 2)
+    waveforms = template * rng.uniform(0.5, 1.5, (n_spikes, AXONA_TETRODE_CHANNELS, 1))
+    waveforms = np.clip(waveforms + rng.normal(0, 5, waveforms.shape), -128, 127).astype("i1")
+    spikes = np.zeros((n_spikes, AXONA_TETRODE_CHANNELS), dtype=[("t", ">u4"), ("samples", "i1", AXONA_SAMPLES_PER_SPIKE)])
+    spikes["t"] = timestamps[:, None]
+    spikes["samples"] = waveforms
+    header_lines = _axona_trial_lines(duration) + [
+        ("num_chans", AXONA_TETRODE_CHANNELS),
+        ("timebase", f"{AXONA_SPIKE_TIMEBASE} hz"),
+        ("bytes_per_timestamp", 4),
+        ("samples_per_spike", AXONA_SAMPLES_PER_SPIKE),
+        ("sample_rate", "48000 hz"),
+        ("bytes_per_sample", 1),
+        ("spike_format", "t,ch1,t,ch2,t,ch3,t,ch4"),
+        ("num_spikes", n_spikes),
+    ]
+    return _axona_file(path, header_lines, spikes.tobytes())
+
+
+def write_axona_cut(path, n_spikes, session="session", n_clusters=4, seed=0):
+    """Write an Axona .cut file that assigns each of n_spikes spikes to one of n_clusters clusters (0 is noise).
+    Arguments:
+        path {str | Path} -- The file to write.
+        n_spikes {int} -- The number of spikes of the tetrode file the cut belongs to.
+        session {str} -- The session named in the cut.
+        n_clusters {int} -- The number of clusters.
+        seed {int} -- The seed of the labels.
+    Returns:
+        Path -- The written file.
+    """
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, n_clusters + 1, n_spikes)
+    lines = [f"n_clusters: {n_clusters}", f"n_channels: {AXONA_TETRODE_CHANNELS}", "n_params: 2", f"Exact_cut_for: {session} spikes: {n_spikes}"]
+    lines += [" ".join(str(label) for label in labels[start:start + 25]) for start in range(0, n_spikes, 25)]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return Path(path)
+
+
+def axona_spike_count(tetrode_path):
+    """The num_spikes of an Axona tetrode file (read from its header), e.g. to write a matching .cut file."""
+    with open(tetrode_path, "rb") as f:
+        for line in f:
+            if line.startswith(b"num_spikes"):
+                return int(line.split()[1])
+    raise ValueError(f"{tetrode_path} has no num_spikes header line.")
+
+
+def write_axona_session(directory, duration, n_tetrodes=1, session="session", spike_rate=20.0, seed=0):
+    """Write the files of one Axona session: .pos, .eeg, .egf and a tetrode (.N) and .cut file per tetrode.
+    Arguments:
+        directory {str | Path} -- The directory to write to (created if missing).
+        duration {float} -- The recording duration in seconds.
+        n_tetrodes {int} -- The number of tetrodes (the channel count is 4 per tetrode).
+        session {str} -- The session name, used as the file stem.
+        spike_rate {float} -- The mean number of spikes per second on each tetrode.
+        seed {int} -- The seed of the first file; the other files use the following seeds.
+    Returns:
+        dict -- The written paths: 'pos', 'eeg', 'egf', and 'tetrodes' and 'cuts' lists.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {
+        "pos": write_axona_pos(directory / f"{session}.pos", duration, seed=seed),
+        "eeg": write_axona_lfp(directory / f"{session}.eeg", duration, "eeg", seed=seed + 1),
+        "egf": write_axona_lfp(directory / f"{session}.egf", duration, "egf", seed=seed + 2),
+        "tetrodes": [],
+        "cuts": [],
+    }
+    for tetrode in range(1, n_tetrodes + 1):
+        tetrode_path = write_axona_tetrode(directory / f"{session}.{tetrode}", duration, spike_rate=spike_rate, seed=seed + 2 + tetrode)
+        paths["tetrodes"].append(tetrode_path)
+        paths["cuts"].append(write_axona_cut(directory / f"{session}_{tetrode}.cut", axona_spike_count(tetrode_path), session=session, seed=seed + 2 + tetrode))
+    return paths
+
+
+# =============================================================================
+# Intan
+# =============================================================================
+
+def _qstring(text):
+    """A Qt QString: its length in bytes followed by UTF-16 characters (0xFFFFFFFF for an empty string)."""
+    if not text:
+        return struct.pack("<I", 0xFFFFFFFF)
+    data = text.encode("utf-16-le")
+    return struct.pack("<I", len(data)) + data
+
+
+def _intan_channel_names(n_channels):
+    return [f"A-{channel:03d}" for channel in range(n_channels)]
+
+
+def _intan_signal_group(n_channels, channel_struct):
+    """The signal group of the amplifier channels, all on port A."""
+    group = _qstring("Port A") + _qstring("A") + struct.pack("<hhh", 1, n_channels, n_channels)
+    for channel, name in enumerate(_intan_channel_names(n_channels)):
+        group += _qstring(name) + _qstring(name)
+        group += struct.pack(channel_struct, *([channel, channel, 0, 1, channel] + [0] * (len(channel_struct) - 6)))
+        group += struct.pack("<hhhh", 0, 0, 0, 0) # spike trigger
+        group += struct.pack("<ff", 1.0e5, 0.0) # impedance
+    return group
+
+
+def _intan_amplifier_samples(rng, n_channels, n_samples, sample_rate):
+    """Amplifier samples (uint16, 0.195 uV per bit around 32768) of noise and an 8 Hz oscillation."""
+    t = np.arange(n_samples) / sample_rate
+    signal = 100 * np.sin(2 * np.pi * 8 * t) + rng.normal(0, 20, (n_channels, n_samples))
+    return np.clip(32768 + signal / 0.195, 0, 65535).astype("<u2")
+
+
+def _write_intan_blocks(f, n_blocks, block_writer, blocks_per_chunk=256):
+    """Write the data blocks in chunks, so long recordings are written in bounded memory."""
+    for first in range(0, n_blocks, blocks_per_chunk):
+        f.write(block_writer(first, min(blocks_per_chunk, n_blocks - first)))
+
+
+def write_intan_rhd(path, duration, n_channels=32, sample_rate=30000.0, seed=0):
+    """Write an Intan RHD2000 (.rhd, format version 3.0) file with amplifier channels only.
+    Arguments:
+        path {str | Path} -- The file to write.
+        duration {float} -- The recording duration in seconds (rounded up to whole 128 sample blocks).
+        n_channels {int} -- The number of amplifier channels.
+        sample_rate {float} -- The amplifier sample rate in Hz.
+        seed {int} -- The seed of the noise.
+    Returns:
+        Path -- The written file.
+    """
+    rng = np.random.default_rng(seed)
+    header = struct.pack("<I", INTAN_RHD_MAGIC) + struct.pack("<hh", 3, 0) + struct.pack("<f", sample_rate)
+    header += struct.pack("<hffffff", 1, 1.0, 0.1, 7500.0, 1.0, 0.1, 7500.0)
+    header += struct.pack("<h", 0) # no notch filter
+    header += struct.pack("<ff", 1000.0, 1000.0)
+    header += _qstring("synthetic") + _qstring("") + _qstring("")
+    header += struct.pack("<h", 0) # temperature sensors
+    header += struct.pack("<h", 0) # eval board mode
+    header += _qstring("hardware")
+    header += struct.pack("<h", 1) + _intan_signal_group(n_channels, "<hhhhhh")
+    n_blocks = int(np.ceil(duration * sample_rate / INTAN_SAMPLES_PER_BLOCK))
+
+    def blocks(first, n):
+        samples = _intan_amplifier_samples(rng, n_channels, n * INTAN_SAMPLES_PER_BLOCK, sample_rate)
+        data = np.zeros(n, dtype=[("t", "<i4", INTAN_SAMPLES_PER_BLOCK), ("amplifier", "<u2", (n_channels, INTAN_SAMPLES_PER_BLOCK))])
+        data["t"] = np.arange(first * INTAN_SAMPLES_PER_BLOCK, (first + n) * INTAN_SAMPLES_PER_BLOCK).reshape(n, INTAN_SAMPLES_PER_BLOCK)
+        data["amplifier"] = samples.reshape(n_channels, n, INTAN_SAMPLES_PER_BLOCK).transpose(1, 0, 2)
+        return data.tobytes()
+
+    with open(path, "wb") as f:
+        f.write(header)
+        _write_intan_blocks(f, n_blocks, blocks)
+    return Path(path)
+
+
+def write_intan_rhs(path, duration, n_channels=32, sample_rate=30000.0, seed=0):
+    """Write an Intan RHS2000 (.rhs, format version 3.0) stimulation/recording file with amplifier channels only.
+    Arguments:
+        path {str | Path} -- The file to write.
+        duration {float} -- The recording duration in seconds (rounded up to whole 128 sample blocks).
+        n_channels {int} -- The number of amplifier channels.
+        sample_rate {float} -- The amplifier sample rate in Hz.
+        seed {int} -- The seed of the noise.
+    Returns:
+        Path -- The written file.
+    """
+    rng = np.random.default_rng(seed)
+    header = struct.pack("<I", INTAN_RHS_MAGIC) + struct.pack("<hh", 3, 0) + struct.pack("<f", sample_rate)
+    header += struct.pack("<hffffffff", 1, 1.0, 0.1, 1000.0, 7500.0, 1.0, 0.1, 1000.0, 7500.0)
+    header += struct.pack("<h", 0) # no notch filter
+    header += struct.pack("<ff", 1000.0, 1000.0)
+    header += struct.pack("<hh", 0, 0) # amp settle and charge recovery modes
+    header += struct.pack("<fff", 1.0e-6, 1.0e-6, 0.0) # stim step size, recovery current limit and target voltage
+    header += _qstring("synthetic") + _qstring("") + _qstring("")
+    header += struct.pack("<hh", 0, 0) # no dc amplifier data, eval board mode
+    header += _qstring("hardware")
+    header += struct.pack("<h", 1) + _intan_signal_group(n_channels, "<hhhhhhh")
+    n_blocks = int(np.ceil(duration * sample_rate / INTAN_SAMPLES_PER_BLOCK))
+
+    def blocks(first, n):
+        samples = _intan_amplifier_samples(rng, n_channels, n * INTAN_SAMPLES_PER_BLOCK, sample_rate)
+        data = np.zeros(n, dtype=[
+            ("t", "<i4", INTAN_SAMPLES_PER_BLOCK),
+            ("amplifier", "<u2", (n_channels, INTAN_SAMPLES_PER_BLOCK)),
+            ("stim", "<u2", (n_channels, INTAN_SAMPLES_PER_BLOCK)),
+            ])
+        data["t"] = np.arange(first * INTAN_SAMPLES_PER_BLOCK, (first + n) * INTAN_SAMPLES_PER_BLOCK).reshape(n, INTAN_SAMPLES_PER_BLOCK)
+        data["amplifier"] = samples.reshape(n_channels, n, INTAN_SAMPLES_PER_BLOCK).transpose(1, 0, 2)
+        return data.tobytes()
+
+    with open(path, "wb") as f:
+        f.write(header)
+        _write_intan_blocks(f, n_blocks, blocks)
+    return Path(path)
+
+
+def write_intan_spike_dat(path, duration, n_channels=32, sample_rate=30000.0, spike_rate=5.0, seed=0):
+    """Write an Intan RHX multichannel spike.dat file with a spike snapshot (40 samples) per spike.
+    Arguments:
+        path {str | Path} -- The file to write.
+        duration {float} -- The recording duration in seconds.
+        n_channels {int} -- The number of channels.
+        sample_rate {float} -- The sample rate in Hz.
+        spike_rate {float} -- The mean number of spikes per second on each channel.
+        seed {int} -- The seed of the spike times and snapshots.
+    Returns:
+        Path -- The written file.
+    """
+    rng = np.random.default_rng(seed)
+    names = _intan_channel_names(n_channels)
+    n_pre, n_post = INTAN_SNAPSHOT_SAMPLES
+    n_spikes = max(int(duration * spike_rate * n_channels), 1)
+    header = struct.pack("<I", INTAN_SPIKE_MAGIC) + struct.pack("<H", 1)
+    for text in (Path(path).name, ",".join(names), ",".join(names)):
+        header += text.encode("utf-8") + b"\0"
+    header += struct.pack("<f", sample_rate) + struct.pack("<II", n_pre, n_post)
+    spikes = np.zeros(n_spikes, dtype=[("channel", "S5"), ("t", "<i4"), ("id", "u1"), ("snapshot", "<u2", n_pre + n_post)])
+    spikes["channel"] = np.array(names, dtype="S5")[rng.integers(0, n_channels, n_spikes)]
+    spikes["t"] = np.sort(rng.integers(0, int(duration * sample_rate), n_spikes))
+    spikes["id"] = np.where(rng.random(n_spikes) < 0.05, 128, 1) # a few artifacts
+    template = -80 * np.exp(-0.5 * ((np.arange(n_pre + n_post) - n_pre) / 3) ** 2)
+    spikes["snapshot"] = np.clip(32768 + (template + rng.normal(0, 10, (n_spikes, n_pre + n_post))) / 0.195, 0, 65535)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(spikes.tobytes())
+    return Path(path)
+
+
+def load_intan_reader(file_format):
+    """Import the read_data function of the Intan 'rhd' or 'rhs' reader.
+    Both readers import their helpers as the top-level package 'intanutil', so each is imported
+    with its own directory on sys.path and without the other's helpers in sys.modules.
+    """
+    if file_format not in _intan_reader_modules:
+        raise ValueError(f"file_format must be one of {list(_intan_reader_modules)}, not {file_format}.")
+    module_name = _intan_reader_modules[file_format]
+    if module_name in sys.modules:
+        return sys.modules[module_name].read_data
+    reader_dir = str(Path(importlib.util.find_spec(module_name.rsplit(".", 1)[0]).submodule_search_locations[0]))
+    for name in [name for name in sys.modules if name == "intanutil" or name.startswith("intanutil.")]:
+        del sys.modules[name]
+    sys.path.insert(0, reader_dir)
+    try:
+        module = importlib.import_module(module_name)
+    finally:
+        sys.path.remove(reader_dir)
+    return module.read_data
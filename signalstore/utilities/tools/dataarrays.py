@@ -1,3 +1,6 @@
+import hashlib
+
+import numpy as np
 
 
 def dataarray_isequal(dataarray1, dataarray2):
@@ -47,3 +50,62 @@ def dataarray_isequal(dataarray1, dataarray2):
     if result == False:
         print(assertions)
     return result
+
+
+def summarize_dataarray(dataarray, statistics=True):
+    """Computes compact, JSON/BSON friendly summary metadata of an array.
+    Arguments:
+        dataarray -- An xarray DataArray (or any object with shape, dtype and nbytes).
+        statistics {bool} -- If True, include min/max/mean of numeric in-memory data.
+            Statistics are skipped for lazily loaded (chunked) data, since computing them would read the whole array.
+    Returns:
+        dict -- shape, dims, dtype, nbytes, chunks (the nominal chunk shape, i.e. the first chunk of each dimension),
+                coords (per dimension coordinate ranges) and optionally min/max/mean.
+    """
+    chunks = getattr(dataarray, "chunks", None)
+    summary = {
+        "shape": [int(n) for n in dataarray.shape],
+        "dims": [str(dim) for dim in getattr(dataarray, "dims", [])],
+        "dtype": str(dataarray.dtype),
+        "nbytes": int(dataarray.nbytes),
+        # the per chunk sizes grow with the array, so only the nominal chunk shape is kept
+        "chunks": None if chunks is None else [int(dim_chunks[0]) for dim_chunks in chunks],
+        "coords": {},
+    }
+    coords = getattr(dataarray, "coords", {})
+    for dim in summary["dims"]:
+        if dim not in coords or coords[dim].size == 0:
+            continue
+        values = coords[dim].values
+        if values.dtype.kind not in "iufM":
+            continue
+        summary["coords"][dim] = {"size": int(values.size), "min": _scalar(values.min()), "max": _scalar(values.max())}
+    if statistics and chunks is None and dataarray.dtype.kind in "iuf" and dataarray.size > 0:
+        data = np.asarray(dataarray)
+        summary["min"] = _scalar(np.nanmin(data))
+        summary["max"] = _scalar(np.nanmax(data))
+        summary["mean"] = float(np.nanmean(data))
+    return summary
+
+
+def dataarray_digest(dataarray):
+    """Computes a content hash of the data, dimensions and coordinates of a DataArray, ignoring its name and attrs.
+    Returns None for lazily loaded (chunked) data, since hashing it would read the whole array.
+    """
+    if getattr(dataarray, "chunks", None) is not None:
+        return None
+    digest = hashlib.blake2b(digest_size=32)
+    for name, variable in [(None, dataarray.variable), *sorted(dataarray.coords.items(), key=lambda item: str(item[0]))]:
+        values = np.ascontiguousarray(variable.values)
+        if values.dtype.hasobject:
+            return None
+        digest.update(repr((str(name), tuple(str(dim) for dim in variable.dims), values.shape, values.dtype.str)).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def _scalar(value):
+    """Converts a numpy scalar into a plain python value (datetimes become ISO strings)."""
+    if isinstance(value, np.datetime64):
+        return str(value)
+    return value.item() if hasattr(value, "item") else value
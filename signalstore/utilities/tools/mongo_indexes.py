@@ -0,0 +1,51 @@
+"""Helpers for finding record queries that MongoDB answers with a collection scan.
+
+Typical use against a live MongoDB server:
+
+    workload = [{"schema_ref": "spike_times", "session_data_ref": "s1"}, ...]
+    for entry in report_collection_scans(record_dao, workload):
+        if entry["collscan"]:
+            print(entry["filter"], entry["stages"])
+
+Collection scans can usually be removed by declaring the filtered property in
+the `indexed_properties` of the data model (see DataRepository.ensure_indexes).
+"""
+
+
+def winning_plan_stages(plan):
+    """Returns the stage names of the winning plan of an explain() result, from the root down.
+    Handles both the classic plan layout (stage / inputStage / inputStages) and the
+    slot based execution layout, where the classic tree is nested under 'queryPlan'.
+    """
+    winning_plan = plan.get("queryPlanner", plan).get("winningPlan", {})
+    winning_plan = winning_plan.get("queryPlan", winning_plan)
+    stages = []
+    pending = [winning_plan]
+    while pending:
+        node = pending.pop(0)
+        if "stage" in node:
+            stages.append(node["stage"])
+        if "inputStage" in node:
+            pending.append(node["inputStage"])
+        pending.extend(node.get("inputStages", []))
+    return stages
+
+
+def is_collection_scan(plan):
+    """Returns True if the winning plan of an explain() result scans the whole collection."""
+    return "COLLSCAN" in winning_plan_stages(plan)
+
+
+def report_collection_scans(dao, filters):
+    """Explains every filter of a workload and reports which ones hit a COLLSCAN.
+    Arguments:
+        dao {MongoDAO} -- The data access object of the queried collection (e.g. the records DAO).
+        filters {list[dict]} -- The find filters of the workload.
+    Returns:
+        list[dict] -- One {'filter', 'collscan', 'stages'} entry per filter, in workload order.
+    """
+    report = []
+    for query_filter in filters:
+        stages = winning_plan_stages(dao.explain(query_filter))
+        report.append({"filter": query_filter, "collscan": "COLLSCAN" in stages, "stages": stages})
+    return report
@@ -32,6 +32,7 @@ from signalstore.store.datafile_adapters import (
 )
 
 from signalstore.store import UnitOfWorkProvider
+from signalstore.store.file_cache import LocalFileCache
 
 from signalstore.operations.helpers.abstract_helper import AbstractMutableHelper
 
@@ -598,6 +599,28 @@ def _file_dao_options_fixture(populated_netcdf_file_dao, populated_zarr_file_dao
         "numpy": populated_numpy_file_dao
     }
 
+@pytest.fixture(name="file_cache")
+def _file_cache_fixture(tmpdir):
+    return LocalFileCache(cache_dir=str(tmpdir) + "/cache", max_bytes=2**20)
+
+@pytest.fixture(name="cached_file_dao")
+def _cached_file_dao_fixture(tmpdir, file_cache):
+    project_dir = str(tmpdir) + "/cached"
+    filesystem = LocalFileSystem(root=str(project_dir))
+    return FileSystemDAO(filesystem=filesystem,
+                        project_dir=project_dir,
+                        default_data_adapter=XarrayDataArrayNetCDFAdapter(),
+                        file_cache=file_cache)
+
+@pytest.fixture(name="deduplicated_file_dao")
+def _deduplicated_file_dao_fixture(tmpdir):
+    project_dir = str(tmpdir) + "/deduplicated"
+    filesystem = LocalFileSystem(root=str(project_dir))
+    return FileSystemDAO(filesystem=filesystem,
+                        project_dir=project_dir,
+                        default_data_adapter=XarrayDataArrayNetCDFAdapter(),
+                        deduplicate=True)
+
 @pytest.fixture(name="data_adapter_options")
 def _data_adapter_options_fixture(xarray_netcdf_adapter, xarray_zarr_adapter, model_numpy_adapter):
     return {
@@ -766,6 +789,21 @@ def _unit_of_work_provider_fixture(tmpdir):
         uow.commit()
     return uow
 
+@pytest.fixture(name="journaled_uow_provider")
+def _journaled_uow_provider_fixture(tmpdir):
+    mongo_client = mongomock.MongoClient()
+    og_filesystem = LocalFileSystem(root=str(tmpdir))
+    filesystem = DirFileSystem(tmpdir, og_filesystem)
+    uow_provider = UnitOfWorkProvider(mongo_client, filesystem, dict(), journal=True, journal_batch_size=3)
+    with uow_provider("testproject") as uow:
+        for model in raw_property_models + raw_metamodels + raw_data_models:
+            uow.domain_models.add(model)
+        for record in raw_records:
+            if not record.get("has_file"):
+                uow.data.add(record)
+        uow.commit()
+    return uow_provider
+
 
 
 # ==========================================================
@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+import pandas as pd
+import xarray as xr
+from signalstore.store.adapter_policy import *
+from signalstore.store.datafile_adapters import (
+    XarrayDataArrayNetCDFAdapter,
+    XarrayDataArrayZarrAdapter,
+    XarrayDataArrayRawNumpyAdapter,
+    PandasDataFrameParquetAdapter,
+)
+
+
+class TestDataAdapterPolicy:
+
+    @pytest.fixture
+    def adapters(self):
+        return {
+            "netcdf": XarrayDataArrayNetCDFAdapter(),
+            "zarr": XarrayDataArrayZarrAdapter(),
+            "numpy": XarrayDataArrayRawNumpyAdapter(),
+            "parquet": PandasDataFrameParquetAdapter(),
+        }
+
+    @staticmethod
+    def _array(nbytes, schema_ref="spike_waveforms", dtype="float64"):
+        return xr.DataArray(np.zeros(nbytes // np.dtype(dtype).itemsize, dtype=dtype), dims=["time"], attrs={"schema_ref": schema_ref})
+
+    def test_default_rules_choose_by_size(self, adapters):
+        policy = DataAdapterPolicy(adapters, default="numpy")
+        assert policy.select(self._array(2**10)) is adapters["netcdf"]
+        assert policy.select(self._array(2**22)) is adapters["numpy"]
+        large = xr.DataArray(np.zeros(2**25), dims=["time"]).chunk({"time": 2**20})
+        assert policy.select(large) is adapters["zarr"]
+
+    def test_rules_apply_in_order(self, adapters):
+        rules = [
+            {"schema_ref": ["spike_times", "spike_labels"], "adapter": "numpy"},
+            {"ndim": 1, "dtype_kinds": "iu", "adapter": "zarr"},
+        ]
+        policy = DataAdapterPolicy(adapters, default="netcdf", rules=rules)
+        assert policy.select(self._array(64, schema_ref="spike_times", dtype="int64")) is adapters["numpy"]
+        assert policy.select(self._array(64, dtype="int64")) is adapters["zarr"]
+        assert policy.select(self._array(64)) is adapters["netcdf"]
+
+    def test_objects_get_an_adapter_for_their_type(self, adapters):
+        policy = DataAdapterPolicy(adapters, default="netcdf")
+        table = pd.DataFrame({"time": np.arange(10.0)})
+        assert policy.select(table) is adapters["parquet"]
+
+    def test_streams_get_an_appending_adapter(self, adapters):
+        policy = DataAdapterPolicy(adapters, default="netcdf")
+        assert policy.select(self._array(2**10), streamed=True) is adapters["zarr"]
+
+    @pytest.mark.parametrize("default, rules", [
+        ("hdf5", DataAdapterPolicy.default_rules),
+        ("netcdf", [{"max_nbytes": 10, "adapter": "hdf5"}]),
+        ("netcdf", [{"max_bytes": 10, "adapter": "zarr"}]),
+    ])
+    def test_bad_config(self, adapters, default, rules):
+        with pytest.raises(DataAdapterPolicyConfigError):
+            DataAdapterPolicy(adapters, default=default, rules=rules)
@@ -1,6 +1,9 @@
 import pytest
+import mongomock
 from datetime import datetime, timezone, timedelta
 from signalstore.store.data_access_objects import *
+from fsspec.implementations.local import LocalFileSystem
+from signalstore.store.datafile_adapters import XarrayDataArrayZarrAdapter
 
 class TestDomainModelDAO:
 
@@ -344,6 +347,91 @@ class TestDomainModelDAO:
         with pytest.raises(MongoDAOTypeError):
             populated_domain_model_dao.purge(1)
 
+    def test_serialize_round_trip_only_touches_known_keys(self, populated_domain_model_dao, timestamp):
+        document = {'schema_name': 'x', 'json_schema': {'type': 'object'}, 'time_of_save': timestamp, 'time_of_removal': None, 'version_timestamp': 0, 'extra': [1, 2]}
+        serialized = populated_domain_model_dao._serialize(document)
+        assert serialized['json_schema'] == b'{"type": "object"}'
+        assert serialized['extra'] is document['extra']
+        assert document['json_schema'] == {'type': 'object'} # the input is not mutated
+        deserialized = populated_domain_model_dao._deserialize(serialized)
+        assert deserialized['json_schema'] == {'type': 'object'}
+        assert deserialized['time_of_save'] == timestamp
+        assert deserialized['time_of_removal'] is None
+        assert deserialized['version_timestamp'] == 0
+
+
+class TestMongoDAOPagination:
+
+    @pytest.fixture
+    def paged_dao(self, empty_client, timestamp):
+        dao = MongoDAO(empty_client, 'pagination', 'records', ['schema_ref', 'data_name', 'version_timestamp'])
+        for schema_ref in ['a', 'b']:
+            for data_name in ['x', 'y']:
+                # one unversioned and three versioned documents per key
+                dao.add(document={'schema_ref': schema_ref, 'data_name': data_name, 'version_timestamp': 0}, timestamp=timestamp)
+                for i in range(1, 4):
+                    dao.add(document={'schema_ref': schema_ref, 'data_name': data_name, 'version_timestamp': timestamp + timedelta(seconds=i)}, timestamp=timestamp)
+        return dao
+
+    @staticmethod
+    def key(document):
+        return (document['schema_ref'], document['data_name'], document['version_timestamp'])
+
+    @pytest.mark.parametrize('page_size', [1, 3, 4, 16, 100])
+    def test_pages_cover_all_documents_in_key_order(self, paged_dao, page_size):
+        pages = list(paged_dao.iterate_pages(page_size=page_size))
+        documents = [document for page, token in pages for document in page]
+        assert len(documents) == 16
+        assert all(len(page) <= page_size for page, token in pages)
+        assert pages[-1][1] is None or len(pages[-1][0]) == page_size
+        keys = [self.key(document) for document in documents]
+        assert len(set(keys)) == 16
+        expected = sorted(keys, key=lambda key: (key[0], key[1], 0 if key[2] == 0 else datetime_to_microseconds(key[2])))
+        assert keys == expected
+
+    def test_resume_after_a_page(self, paged_dao):
+        pages = paged_dao.iterate_pages(page_size=5)
+        first_page, token = next(pages)
+        resumed = [document for page, _ in paged_dao.iterate_pages(page_size=5, resume_token=token) for document in page]
+        remaining = [document for page, _ in pages for document in page]
+        assert [self.key(d) for d in resumed] == [self.key(d) for d in remaining]
+        assert len(first_page) + len(resumed) == 16
+
+    def test_pages_with_filter_and_projection(self, paged_dao):
+        documents, token = paged_dao.find_page(filter={'schema_ref': 'b'}, projection={'data_name': 1}, page_size=10)
+        assert token is None
+        assert len(documents) == 8
+        assert all(set(document.keys()) == {'data_name'} for document in documents)
+
+    @pytest.mark.parametrize('bad_token', ['not a token', 'WzFd'])
+    def test_bad_resume_token(self, paged_dao, bad_token):
+        with pytest.raises(MongoDAOTypeError):
+            paged_dao.find_page(resume_token=bad_token)
+
+
+class TestMongoDAOMarkManyForDeletion:
+
+    @pytest.fixture
+    def dao(self, empty_client, timestamp):
+        dao = MongoDAO(empty_client, 'removal', 'records', ['schema_ref', 'data_name', 'version_timestamp'])
+        for data_name in ['x', 'y']:
+            dao.add(document={'schema_ref': 'a', 'data_name': data_name, 'version_timestamp': 0}, timestamp=timestamp)
+            dao.add(document={'schema_ref': 'a', 'data_name': data_name, 'version_timestamp': timestamp}, timestamp=timestamp)
+        return dao
+
+    def test_duplicate_keys_are_marked_once(self, dao, timestamp):
+        keys = [{'schema_ref': 'a', 'data_name': 'x'}, {'schema_ref': 'a', 'data_name': 'x', 'version_timestamp': 0}, {'schema_ref': 'a', 'data_name': 'y', 'version_timestamp': timestamp}]
+        assert dao.mark_many_for_deletion(keys, timestamp=timestamp) == 2
+        assert not dao.exists(schema_ref='a', data_name='x')
+        assert not dao.exists(schema_ref='a', data_name='y', version_timestamp=timestamp)
+
+    def test_missing_key_marks_nothing(self, dao, timestamp):
+        keys = [{'schema_ref': 'a', 'data_name': 'x'}, {'schema_ref': 'a', 'data_name': 'z'}]
+        with pytest.raises(MongoDAODocumentNotFoundError):
+            dao.mark_many_for_deletion(keys, timestamp=timestamp)
+        assert dao.exists(schema_ref='a', data_name='x')
+        assert dao.list_marked_for_deletion() == []
+
 
 class TestFileSystemDAO:
 
@@ -489,6 +577,12 @@ class TestFileSystemDAO:
         result = populated_numpy_file_dao.exists(schema_ref='test', data_name='test', version_timestamp=ts)
         assert result, f'Expected exists to return True, got {result}'
 
+    def test_exists_does_not_read_file(self, populated_numpy_file_dao, model_numpy_adapter, monkeypatch):
+        def read_file(path):
+            raise AssertionError('exists should only use filesystem metadata')
+        monkeypatch.setattr(model_numpy_adapter, 'read_file', read_file)
+        assert populated_numpy_file_dao.exists(schema_ref='test', data_name='test')
+
     @pytest.mark.parametrize('file_type', ['netcdf', 'zarr', 'numpy'])
     def test_exists_with_file_that_does_not_exist(self, file_dao_options, file_type):
         file_dao = file_dao_options[file_type]
@@ -604,6 +698,14 @@ class TestFileSystemDAO:
         with pytest.raises(FileSystemDAOFileAlreadyExistsError):
             file_dao.add(data_object=data_object)
 
+    def test_add_chunks_of_file_that_already_exists(self, tmp_path):
+        file_dao = FileSystemDAO(filesystem=LocalFileSystem(auto_mkdir=True), project_dir=str(tmp_path / 'project'), default_data_adapter=XarrayDataArrayZarrAdapter())
+        def chunks():
+            yield xr.DataArray(np.zeros((2, 3)), dims=['time', 'channel'], attrs={'schema_ref': 'test', 'data_name': 'chunked'})
+        file_dao.add(data_object=chunks())
+        with pytest.raises(FileSystemDAOFileAlreadyExistsError):
+            file_dao.add(data_object=chunks())
+
     def test_add_versioned_file_that_already_exists_with_same_timestamp(self, populated_numpy_file_dao):
         data_object = populated_numpy_file_dao.get(schema_ref='test', data_name='test', nth_most_recent = 1)
         with pytest.raises(FileSystemDAOFileAlreadyExistsError):
@@ -978,6 +1080,97 @@ class TestFileSystemDAO:
         count = populated_numpy_file_dao.purge(time_threshold=first_tod+timedelta(seconds=n - 1))
         assert count == n, f"count is {count}"
 
+    def test_purge_in_batches_reports_progress(self, populated_numpy_file_dao):
+        to_delete = populated_numpy_file_dao.get(schema_ref='test', data_name='test', nth_most_recent=1)
+        ts = to_delete.attrs['version_timestamp']
+        populated_numpy_file_dao.mark_for_deletion(schema_ref='test', data_name='test', version_timestamp=ts, time_of_removal=datetime.now().astimezone())
+        for i in range(4):
+            to_delete.attrs['data_name'] = f'test{i}'
+            to_delete.attrs['schema_ref'] = f'test{i}'
+            populated_numpy_file_dao.add(data_object=to_delete)
+            populated_numpy_file_dao.mark_for_deletion(schema_ref=f'test{i}', data_name=f'test{i}', version_timestamp=ts, time_of_removal=datetime.now().astimezone())
+        progress = []
+        count = populated_numpy_file_dao.purge(batch_size=2, progress_callback=lambda done, total: progress.append((done, total)))
+        assert count == 5
+        assert progress == [(2, 5), (4, 5), (5, 5)]
+        assert len(populated_numpy_file_dao.list_marked_for_deletion()) == 0
+
+    def test_estimate_purge_does_not_delete(self, populated_numpy_file_dao):
+        assert populated_numpy_file_dao.estimate_purge() == (0, 0)
+        to_delete = populated_numpy_file_dao.get(schema_ref='test', data_name='test', nth_most_recent=1)
+        ts = to_delete.attrs['version_timestamp']
+        populated_numpy_file_dao.mark_for_deletion(schema_ref='test', data_name='test', version_timestamp=ts, time_of_removal=datetime.now().astimezone())
+        n_files, nbytes = populated_numpy_file_dao.estimate_purge()
+        assert n_files == 1
+        assert nbytes > 0
+        assert len(populated_numpy_file_dao.list_marked_for_deletion()) == 1
+
+
+class TestDeduplicatedFileSystemDAO:
+
+    @staticmethod
+    def _version(timestamp, values, **attrs):
+        return xr.DataArray(np.asarray(values), dims=("x", "y"), coords={"x": [10, 20]},
+                            attrs={"schema_ref": "test", "data_name": "test", "version_timestamp": timestamp, **attrs})
+
+    def _blobs(self, dao):
+        return dao._fs.ls(dao._blob_dir) if dao._fs.exists(dao._blob_dir) else []
+
+    def test_metadata_only_revision_shares_blob(self, deduplicated_file_dao, timestamp):
+        values = np.arange(6).reshape(2, 3)
+        revision = timestamp + timedelta(seconds=1)
+        deduplicated_file_dao.add(self._version(timestamp, values, note="typo"))
+        deduplicated_file_dao.add(self._version(revision, values, note="fixed"))
+        assert len(self._blobs(deduplicated_file_dao)) == 1
+        first = deduplicated_file_dao.get("test", "test", version_timestamp=timestamp)
+        second = deduplicated_file_dao.get("test", "test", version_timestamp=revision)
+        assert (first.attrs["note"], second.attrs["note"]) == ("typo", "fixed")
+        assert second.attrs["version_timestamp"] == deduplicated_file_dao.get("test", "test").attrs["version_timestamp"]
+        assert np.array_equal(second.values, values)
+        assert list(second.coords["x"].values) == [10, 20]
+
+    def test_changed_data_gets_own_blob(self, deduplicated_file_dao, timestamp):
+        deduplicated_file_dao.add(self._version(timestamp, np.zeros((2, 3))))
+        deduplicated_file_dao.add(self._version(timestamp + timedelta(seconds=1), np.ones((2, 3))))
+        assert len(self._blobs(deduplicated_file_dao)) == 2
+
+    def test_unversioned_objects_are_not_deduplicated(self, deduplicated_file_dao):
+        deduplicated_file_dao.add(self._version(0, np.zeros((2, 3))))
+        assert self._blobs(deduplicated_file_dao) == []
+        assert np.array_equal(deduplicated_file_dao.get("test", "test").values, np.zeros((2, 3)))
+
+    def test_purge_keeps_referenced_blobs(self, deduplicated_file_dao, timestamp):
+        revision = timestamp + timedelta(seconds=1)
+        for version_timestamp in (timestamp, revision):
+            deduplicated_file_dao.add(self._version(version_timestamp, np.zeros((2, 3))))
+        deduplicated_file_dao.mark_for_deletion("test", "test", timestamp, version_timestamp=timestamp)
+        deduplicated_file_dao.purge()
+        assert len(self._blobs(deduplicated_file_dao)) == 1
+        assert np.array_equal(deduplicated_file_dao.get("test", "test", version_timestamp=revision).values, np.zeros((2, 3)))
+        deduplicated_file_dao.mark_for_deletion("test", "test", timestamp, version_timestamp=revision)
+        assert len(self._blobs(deduplicated_file_dao)) == 1 # still referenced from the trash
+        deduplicated_file_dao.purge()
+        assert self._blobs(deduplicated_file_dao) == []
+
+    def test_blobs_are_written_atomically(self, deduplicated_file_dao, timestamp, monkeypatch):
+        deduplicated_file_dao.add(self._version(timestamp, np.zeros((2, 3))))
+        assert not any(FileSystemDAO._temporary_blob_prefix in path for path in self._blobs(deduplicated_file_dao))
+        adapter = deduplicated_file_dao._default_data_adapter
+        write_file = adapter.write_file
+        def fail(path, data_object):
+            write_file(path=path, data_object=data_object)
+            raise OSError("disk full")
+        monkeypatch.setattr(adapter, "write_file", fail)
+        with pytest.raises(OSError):
+            deduplicated_file_dao.add(self._version(timestamp + timedelta(seconds=1), np.ones((2, 3))))
+        # the partial write never took the name of the blob
+        blob_ref = deduplicated_file_dao.make_blob_ref(self._version(timestamp, np.ones((2, 3))))
+        assert not deduplicated_file_dao._fs.exists(deduplicated_file_dao._blob_dir + "/" + blob_ref["blob"])
+
+    def test_bad_deduplicate(self, tmpdir):
+        with pytest.raises(FileSystemDAOConfigError):
+            FileSystemDAO(filesystem=fsspec.filesystem("file"), project_dir=str(tmpdir), deduplicate="yes")
+
 
 class TestInMemoryObjectDAO:
 
@@ -1232,4 +1425,118 @@ class TestInMemoryObjectDAO:
     @pytest.mark.parametrize('bad_arg', [1, 12.5, {"set"}, {"hash": "map"}])
     def test_purge_with_bad_time_threshold_arg(self, populated_memory_dao, bad_arg):
         with pytest.raises(InMemoryObjectDAOTypeError):
-            populated_memory_dao.purge(time_threshold=bad_arg)
\ No newline at end of file
+            populated_memory_dao.purge(time_threshold=bad_arg)
+
+class TestUniqueUtcNow:
+
+    def test_timestamps_are_strictly_increasing_utc(self):
+        timestamps = [unique_utc_now() for _ in range(10000)]
+        assert all(ts.tzinfo == timezone.utc for ts in timestamps)
+        microseconds = [datetime_to_microseconds(ts) for ts in timestamps]
+        assert all(a < b for a, b in zip(microseconds, microseconds[1:]))
+
+    def test_timestamps_are_unique_across_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            timestamps = list(executor.map(lambda _: unique_utc_now(), range(10000)))
+        assert len(set(timestamps)) == len(timestamps)
+
+
+    def test_version_timestamps_are_unique_at_millisecond_precision(self):
+        versions = [unique_utc_now(version=True) for _ in range(200)]
+        milliseconds = [datetime_to_microseconds(ts) // 1000 for ts in versions]
+        assert len(set(milliseconds)) == len(milliseconds)
+        # other timestamps keep following the clock past the versions
+        assert unique_utc_now() > versions[-1]
+
+    def test_back_to_back_versioned_adds(self):
+        dao = MongoDAO(client=mongomock.MongoClient(), database_name="test", collection_name="records", index_fields=["schema_ref", "data_name", "version_timestamp"])
+        for _ in range(200):
+            dao.add({"schema_ref": "test", "data_name": "test"}, timestamp=unique_utc_now(version=True), versioning_on=True)
+        assert len(dao.find({"schema_ref": "test"})) == 200
+
+class TestRawNumpyFileSystemDAO:
+
+    @pytest.fixture
+    def numpy_file_dao(self, tmp_path):
+        from fsspec.implementations.local import LocalFileSystem
+        from signalstore.store.datafile_adapters import XarrayDataArrayRawNumpyAdapter
+        return FileSystemDAO(LocalFileSystem(auto_mkdir=True), str(tmp_path / "numpy_project"), default_data_adapter=XarrayDataArrayRawNumpyAdapter())
+
+    @staticmethod
+    def _traces(**attrs):
+        return xr.DataArray(
+            np.arange(12, dtype="int16").reshape(4, 3),
+            dims=("time", "channel"),
+            coords={"time": np.arange(4) / 1000, "channel": np.array(["a", "b", "c"], dtype=object)},
+            attrs={"schema_ref": "test", "data_name": "test", "version_timestamp": 0, **attrs},
+            )
+
+    def test_round_trip_memory_maps_data(self, numpy_file_dao):
+        numpy_file_dao.add(self._traces(animal_data_ref={"schema_ref": "animal", "data_name": "A10"}))
+        traces = numpy_file_dao.get("test", "test")
+        assert isinstance(traces.variable._data, np.memmap)
+        assert traces.dtype == np.int16 and traces.dims == ("time", "channel")
+        assert np.array_equal(traces.values, np.arange(12).reshape(4, 3))
+        assert list(traces.coords["channel"].values) == ["a", "b", "c"]
+        assert traces.attrs["animal_data_ref"] == {"schema_ref": "animal", "data_name": "A10"}
+        assert traces.name == "test__test"
+
+    def test_remove_and_restore(self, numpy_file_dao, timestamp):
+        numpy_file_dao.add(self._traces())
+        numpy_file_dao.mark_for_deletion("test", "test", timestamp)
+        assert not numpy_file_dao.exists("test", "test")
+        numpy_file_dao.restore("test", "test")
+        assert np.array_equal(numpy_file_dao.get("test", "test").values, np.arange(12).reshape(4, 3))
+
+    def test_provider_built_dao_memory_maps_data(self, tmp_path):
+        from fsspec.implementations.dirfs import DirFileSystem
+        from signalstore.store.unit_of_work_provider import UnitOfWorkProvider
+        filesystem = DirFileSystem(str(tmp_path), LocalFileSystem(auto_mkdir=True))
+        uow_provider = UnitOfWorkProvider(mongomock.MongoClient(), filesystem, dict(), default_filetype='numpy')
+        with uow_provider("testproject") as uow:
+            file_dao = uow.data._data
+            file_dao.add(self._traces())
+            traces = file_dao.get("test", "test")
+        assert isinstance(traces.variable._data, np.memmap)
+        assert np.array_equal(traces.values, np.arange(12).reshape(4, 3))
+
+    def test_update_attrs_rewrites_sidecar_only(self, numpy_file_dao):
+        numpy_file_dao.add(self._traces(note="typo"))
+        path = numpy_file_dao.make_filepath("test", "test", 0, numpy_file_dao._default_data_adapter)
+        data_mtime = numpy_file_dao._fs.modified(f"{path}/data.npy")
+        numpy_file_dao.update_attrs("test", "test", {"note": "fixed"}, unset_attrs=["data_name"])
+        attrs = numpy_file_dao.get("test", "test").attrs
+        assert attrs["note"] == "fixed" and "data_name" not in attrs
+        assert numpy_file_dao._fs.modified(f"{path}/data.npy") == data_mtime
+
+
+class TestPackedFileSystemDAO:
+
+    @staticmethod
+    def _scalar(data_name, value):
+        return xr.DataArray(np.array([value]), dims=("value",), attrs={"schema_ref": "sampling_rate", "data_name": data_name, "version_timestamp": 0, "unit": "Hz"})
+
+    def test_packed_objects_are_read_with_ranged_reads(self, populated_netcdf_file_dao):
+        dao = populated_netcdf_file_dao
+        rates = [self._scalar(f"tetrode_{i}", 48000.0 + i) for i in range(4)]
+        pack, extents = dao.write_pack(rates)
+        assert dao._fs.ls(dao._pack_dir) == [dao._pack_path(pack)]
+        assert [offset for offset, _ in extents] == [0] + list(np.cumsum([length for _, length in extents])[:-1])
+        offset, length = extents[2]
+        rate = dao.read_packed(pack, offset, length)
+        assert float(rate.values[0]) == 48002.0
+        assert rate.attrs["data_name"] == "tetrode_2" and rate.attrs["version_timestamp"] == 0
+
+    def test_collect_packs_keeps_referenced_packs(self, populated_netcdf_file_dao):
+        dao = populated_netcdf_file_dao
+        kept, _ = dao.write_pack([self._scalar("kept", 1.0)])
+        dao.write_pack([self._scalar("dropped", 2.0)])
+        assert dao.collect_packs([kept]) == 1
+        assert [os.path.basename(path) for path in dao._fs.ls(dao._pack_dir)] == [kept]
+        with pytest.raises(FileSystemDAOFileNotFoundError):
+            dao.read_packed("missing.pack", 0, 10)
+
+    def test_adapter_must_support_packing(self, populated_netcdf_file_dao, xarray_zarr_adapter):
+        with pytest.raises(FileSystemDAOTypeError):
+            populated_netcdf_file_dao.write_pack([self._scalar("rate", 1.0)], data_adapter=xarray_zarr_adapter)
@@ -0,0 +1,116 @@
+import pytest
+import os
+import numpy as np
+import xarray as xr
+from datetime import timedelta
+from fsspec.implementations.local import LocalFileSystem
+from signalstore.store.file_cache import *
+from signalstore.store.data_access_objects import FileSystemDAO
+from signalstore.store.datafile_adapters import XarrayDataArrayNetCDFAdapter, XarrayDataArrayRawNumpyAdapter
+
+
+class TestLocalFileCache:
+
+    def test_put_and_get(self, tmpdir, file_cache):
+        source = str(tmpdir) + "/source.bin"
+        with open(source, "wb") as f:
+            f.write(b"0" * 100)
+        key = file_cache.make_key(source, 1)
+        assert file_cache.get(key) is None
+        local_path = file_cache.put(key, LocalFileSystem(), source)
+        assert file_cache.get(key) == local_path
+        with open(local_path, "rb") as f:
+            assert f.read() == b"0" * 100
+
+    def test_put_directory(self, tmpdir, file_cache):
+        source = str(tmpdir) + "/source.zarr"
+        os.makedirs(source + "/sub")
+        with open(source + "/sub/chunk", "wb") as f:
+            f.write(b"1" * 10)
+        key = file_cache.make_key(source)
+        local_path = file_cache.put(key, LocalFileSystem(), source)
+        assert os.path.isfile(local_path + "/sub/chunk")
+        assert file_cache.size == 10
+
+    def test_keys_differ_by_version(self, file_cache):
+        assert file_cache.make_key("a", 1) != file_cache.make_key("a", 2)
+
+    def test_invalidate(self, tmpdir, file_cache):
+        source = str(tmpdir) + "/source.bin"
+        with open(source, "wb") as f:
+            f.write(b"0" * 100)
+        key = file_cache.make_key(source)
+        file_cache.put(key, LocalFileSystem(), source)
+        file_cache.invalidate(key)
+        assert file_cache.get(key) is None
+        assert file_cache.size == 0
+        file_cache.invalidate(key) # invalidating a missing entry is a no-op
+
+    def test_least_recently_used_entries_are_evicted(self, tmpdir):
+        cache = LocalFileCache(cache_dir=str(tmpdir) + "/cache", max_bytes=250)
+        filesystem = LocalFileSystem()
+        keys = []
+        for i in range(3):
+            source = str(tmpdir) + f"/source_{i}.bin"
+            with open(source, "wb") as f:
+                f.write(b"0" * 100)
+            key = cache.make_key(source)
+            cache.put(key, filesystem, source)
+            # make the modification times strictly increasing
+            entry_dir = os.path.dirname(cache.get(key))
+            os.utime(entry_dir, (i, i))
+            keys.append(key)
+        # the first entry was evicted when the third was added
+        assert cache.get(keys[0]) is None
+        assert cache.get(keys[1]) is not None
+        assert cache.get(keys[2]) is not None
+        assert cache.size <= 250
+
+    def test_object_larger_than_cache_is_not_cached(self, tmpdir):
+        cache = LocalFileCache(cache_dir=str(tmpdir) + "/cache", max_bytes=10)
+        source = str(tmpdir) + "/source.bin"
+        with open(source, "wb") as f:
+            f.write(b"0" * 100)
+        key = cache.make_key(source)
+        assert cache.put(key, LocalFileSystem(), source) is None
+        assert cache.get(key) is None
+
+    @pytest.mark.parametrize("bad_max_bytes", [0, -1, 1.5, None])
+    def test_bad_max_bytes(self, tmpdir, bad_max_bytes):
+        with pytest.raises(LocalFileCacheConfigError):
+            LocalFileCache(cache_dir=str(tmpdir), max_bytes=bad_max_bytes)
+
+
+class TestCachedFileSystemDAO:
+
+    def test_versioned_get_is_served_from_cache(self, cached_file_dao, file_cache, timestamp):
+        dataarray = xr.DataArray(np.arange(6).reshape(2, 3), dims=("x", "y"), attrs={"schema_ref": "test", "data_name": "test", "version_timestamp": timestamp})
+        cached_file_dao.add(data_object=dataarray)
+        first = cached_file_dao.get(schema_ref="test", data_name="test", version_timestamp=timestamp)
+        assert file_cache.size > 0
+        second = cached_file_dao.get(schema_ref="test", data_name="test", version_timestamp=timestamp)
+        assert np.array_equal(first.values, second.values)
+        assert np.array_equal(second.values, np.arange(6).reshape(2, 3))
+
+    def test_unversioned_get_bypasses_cache(self, cached_file_dao, file_cache):
+        dataarray = xr.DataArray(np.arange(6).reshape(2, 3), dims=("x", "y"), attrs={"schema_ref": "test", "data_name": "test", "version_timestamp": 0})
+        cached_file_dao.add(data_object=dataarray)
+        data_object = cached_file_dao.get(schema_ref="test", data_name="test")
+        assert np.array_equal(data_object.values, np.arange(6).reshape(2, 3))
+        assert file_cache.size == 0
+
+    @pytest.mark.parametrize("data_adapter", [None, XarrayDataArrayRawNumpyAdapter()], ids=["netcdf", "numpy"])
+    def test_update_attrs_of_versioned_object_is_seen_by_other_caches(self, tmpdir, cached_file_dao, timestamp, data_adapter):
+        dataarray = xr.DataArray(np.arange(6).reshape(2, 3), dims=("x", "y"), attrs={"schema_ref": "test", "data_name": "test", "version_timestamp": timestamp})
+        cached_file_dao.add(data_object=dataarray, data_adapter=data_adapter)
+        # another process with a cache of its own
+        other_cache = LocalFileCache(cache_dir=str(tmpdir) + "/other_cache", max_bytes=2**20)
+        other_dao = FileSystemDAO(filesystem=cached_file_dao._fs, project_dir=cached_file_dao._directory,
+                                  default_data_adapter=XarrayDataArrayNetCDFAdapter(), file_cache=other_cache)
+        assert "note" not in other_dao.get(schema_ref="test", data_name="test", version_timestamp=timestamp, data_adapter=data_adapter).attrs
+        assert other_cache.size > 0
+        cached_file_dao.update_attrs("test", "test", {"note": "recalibrated"}, version_timestamp=timestamp, data_adapter=data_adapter)
+        for dao in (cached_file_dao, other_dao):
+            data_object = dao.get(schema_ref="test", data_name="test", version_timestamp=timestamp, data_adapter=data_adapter)
+            assert data_object.attrs["note"] == "recalibrated"
+            assert np.array_equal(data_object.values, np.arange(6).reshape(2, 3))
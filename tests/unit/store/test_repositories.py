@@ -1,6 +1,11 @@
 import pytest
 from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import xarray as xr
 from signalstore.store.repositories import *
+from signalstore.store.datafile_adapters import XarrayDataArrayZarrAdapter, PandasDataFrameParquetAdapter
+from fsspec.implementations.local import LocalFileSystem
 
 class TestDomainModelRepository:
     # get tests (test all expected behaviors of get())
@@ -775,6 +780,18 @@ class TestDataRepository:
         assert data_object.attrs['data_name'] == 'numpy_test', f"Should have returned a data object with argument data_name: numpy_test (time_delta: {time_delta}), but got {data_object.attrs['data_name']}"
         assert data_object.attrs['version_timestamp'] == vts, f"Should have returned a data object with argument version_timestamp: {vts} (timestamp: {timestamp}, time_delta: {time_delta}), but got {data_object.attrs['version_timestamp']}"
 
+    def test_get_nth_most_recent_version_with_one_query(self, populated_data_repo, timestamp, model_numpy_adapter, monkeypatch):
+        collection = populated_data_repo._records._collection
+        queries = []
+        def find(*args, **kwargs):
+            queries.append(kwargs)
+            return type(collection).find(collection, *args, **kwargs)
+        monkeypatch.setattr(collection, 'find', find)
+        monkeypatch.setattr(collection, 'find_one', lambda *args, **kwargs: pytest.fail("the record was fetched twice"))
+        data_object = populated_data_repo.get(schema_ref='numpy_test', data_name="numpy_test", nth_most_recent=3, data_adapter=model_numpy_adapter)
+        assert data_object.attrs['version_timestamp'] == timestamp + timedelta(seconds=3)
+        assert [(query['skip'], query['limit']) for query in queries] == [(2, 1)]
+
     @pytest.mark.parametrize("kwargs", [{'schema_ref': 'session', 'data_name': 'invalid_session_date'}, {'schema_ref': 'session', 'data_name': 'invalid_session_has_file'}])
     def test_get_unversioned_record_that_exists_but_is_invalid(self, populated_data_repo_with_invalid_records, kwargs):
         repo = populated_data_repo_with_invalid_records
@@ -900,6 +917,579 @@ class TestDataRepository:
         data_objects = populated_data_repo.find(filter=query_filter)
         assert len(data_objects) == 0
 
+    def test_find_with_fields_only_returns_those_fields(self, populated_data_repo):
+        records = populated_data_repo.find(filter={'schema_ref': 'numpy_test'}, fields=['data_name', 'version_timestamp'])
+        assert len(records) == 10
+        for record in records:
+            assert set(record.keys()) == {'data_name', 'version_timestamp'}
+
+    def test_find_with_sort_and_limit(self, populated_data_repo):
+        records = populated_data_repo.find(filter={'schema_ref': 'numpy_test'}, sort=[('version_timestamp', -1)], limit=3)
+        assert len(records) == 3
+        assert records[0]['version_timestamp'] > records[1]['version_timestamp'] > records[2]['version_timestamp']
+
+    @pytest.mark.parametrize("fields", [None, ['session_description'], ['schema_ref', 'session_description']])
+    def test_find_get_data_with_fields(self, populated_data_repo, fields):
+        records = populated_data_repo.find(filter={'schema_ref': 'session'}, get_data=True, fields=fields)
+        assert len(records) > 0
+        full_record = populated_data_repo.get(schema_ref='session', data_name='test')
+        for record in records:
+            expected_keys = set(full_record.keys()) if fields is None else set(fields)
+            assert set(record.keys()) == expected_keys
+
+    def test_describe_data_array_without_reading_it(self, populated_data_repo, monkeypatch):
+        attrs = {'data_name': 'describe_test', 'schema_ref': 'spike_waveforms', 'has_file': True, 'data_dimensions': ['spike_idx', 'channel', 'sample'],
+                 'shape': [4, 3, 5], 'dtype': 'float64', 'unit_of_measure': 'microvolts', 'dimension_of_measure': '[charge]',
+                 'animal_data_ref': {'schema_ref': 'animal', 'data_name': 'test'}, 'session_data_ref': {'schema_ref': 'session', 'data_name': 'test'},
+                 'probe_data_ref': {'schema_ref': 'probe', 'data_name': 'probe_0'}}
+        data = np.arange(60, dtype='float64').reshape(4, 3, 5)
+        data_object = xr.DataArray(data, dims=['spike_idx', 'channel', 'sample'], coords={'spike_idx': [0.5, 1.5, 2.5, 3.5]}, attrs=attrs)
+        populated_data_repo.add(data_object)
+        monkeypatch.setattr(populated_data_repo._data, 'get', lambda *args, **kwargs: pytest.fail('describe must not read files'))
+        summary = populated_data_repo.describe(schema_ref='spike_waveforms', data_name='describe_test')
+        assert summary['shape'] == [4, 3, 5]
+        assert summary['dims'] == ['spike_idx', 'channel', 'sample']
+        assert summary['dtype'] == 'float64'
+        assert summary['nbytes'] == data.nbytes
+        assert summary['chunks'] is None
+        assert summary['coords'] == {'spike_idx': {'size': 4, 'min': 0.5, 'max': 3.5}}
+        assert (summary['min'], summary['max'], summary['mean']) == (0.0, 59.0, 29.5)
+        # the summary is system managed, so records carrying it still validate
+        record = populated_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'describe_test'})[0]
+        assert record['data_summary'] == summary
+        assert 'data_summary' not in data_object.attrs
+
+    def test_describe_record_without_summary(self, populated_data_repo):
+        assert populated_data_repo.describe(schema_ref='session', data_name='test') is None
+        assert populated_data_repo.describe(schema_ref='session', data_name='does_not_exist') is None
+
+    @pytest.fixture
+    def windowed_data_repo(self, populated_data_repo):
+        # three one-second recordings of the test session starting at t = 0, 1 and 2 seconds
+        attrs = {'schema_ref': 'spike_waveforms', 'has_file': True, 'data_dimensions': ['spike_idx', 'channel', 'sample'],
+                 'shape': [10, 3, 5], 'dtype': 'float64', 'unit_of_measure': 'microvolts', 'dimension_of_measure': '[charge]',
+                 'animal_data_ref': {'schema_ref': 'animal', 'data_name': 'test'}, 'session_data_ref': {'schema_ref': 'session', 'data_name': 'test'},
+                 'probe_data_ref': {'schema_ref': 'probe', 'data_name': 'probe_0'}}
+        for i in range(3):
+            times = i + np.arange(10) / 10
+            data_object = xr.DataArray(np.random.rand(10, 3, 5), dims=['time', 'channel', 'sample'], coords={'time': times}, attrs={**attrs, 'data_name': f'window_{i}'})
+            populated_data_repo.add(data_object)
+        return populated_data_repo
+
+    @pytest.fixture
+    def zarr_data_repo(self, populated_data_repo, tmp_path):
+        # zarr writes nested chunk files, so the filesystem must create directories on demand
+        file_dao = FileSystemDAO(filesystem=LocalFileSystem(auto_mkdir=True), project_dir=str(tmp_path / 'zarr_project'), default_data_adapter=XarrayDataArrayZarrAdapter())
+        return DataRepository(record_dao=populated_data_repo._records, file_dao=file_dao, domain_repo=populated_data_repo._domain_models)
+
+    def test_append_grows_zarr_array_and_record(self, zarr_data_repo):
+        populated_data_repo = zarr_data_repo
+        zarr_adapter = XarrayDataArrayZarrAdapter()
+        attrs = {'schema_ref': 'spike_waveforms', 'data_name': 'stream', 'has_file': True, 'data_dimensions': ['spike_idx', 'channel', 'sample'],
+                 'shape': [10, 3, 5], 'dtype': 'float64', 'unit_of_measure': 'microvolts', 'dimension_of_measure': '[charge]',
+                 'animal_data_ref': {'schema_ref': 'animal', 'data_name': 'test'}, 'session_data_ref': {'schema_ref': 'session', 'data_name': 'test'},
+                 'probe_data_ref': {'schema_ref': 'probe', 'data_name': 'probe_0'}}
+        def make_chunk(start):
+            return xr.DataArray(np.full((10, 3, 5), float(start)), dims=['time', 'channel', 'sample'], coords={'time': start + np.arange(10) / 10})
+        first = make_chunk(0)
+        first.attrs = attrs
+        populated_data_repo.add(first, data_adapter=zarr_adapter)
+        for start in (1, 2):
+            populated_data_repo.append('spike_waveforms', 'stream', make_chunk(start), data_adapter=zarr_adapter)
+        data = populated_data_repo.get('spike_waveforms', 'stream', data_adapter=zarr_adapter)
+        assert data.shape == (30, 3, 5)
+        assert data.coords['time'].values[-1] == pytest.approx(2.9)
+        record = populated_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'stream'})[0]
+        assert record['shape'] == [30, 3, 5]
+        assert (record['time_start'], record['time_stop']) == (0.0, 2.9)
+        summary = record['data_summary']
+        assert summary['shape'] == [30, 3, 5]
+        assert summary['nbytes'] == data.nbytes
+        assert summary['coords']['time'] == {'size': 30, 'min': 0.0, 'max': 2.9}
+        assert (summary['min'], summary['max']) == (0.0, 2.0)
+        assert 'mean' not in summary
+
+    def test_undo_all_reverts_appends(self, zarr_data_repo):
+        zarr_data_repo.add(self._waveform_chunks(1))
+        record = zarr_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'streamed'})[0]
+        zarr_data_repo.clear_operation_history()
+        for chunk in list(self._waveform_chunks(3))[1:]:
+            zarr_data_repo.append('spike_waveforms', 'streamed', chunk)
+        assert zarr_data_repo.get('spike_waveforms', 'streamed').shape == (30, 3, 5)
+        undone = zarr_data_repo.undo_all()
+        assert [ohe.operation for ohe in undone] == ['appended', 'appended']
+        data = zarr_data_repo.get('spike_waveforms', 'streamed')
+        assert data.shape == (10, 3, 5)
+        assert data.coords['time'].values[-1] == pytest.approx(0.9)
+        assert zarr_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'streamed'})[0] == record
+        # the truncated object can grow again
+        zarr_data_repo.append('spike_waveforms', 'streamed', list(self._waveform_chunks(2))[1])
+        assert zarr_data_repo.get('spike_waveforms', 'streamed').shape == (20, 3, 5)
+
+    def test_append_truncates_file_when_record_update_fails(self, zarr_data_repo, monkeypatch):
+        zarr_data_repo.add(self._waveform_chunks(1))
+        def fail(*args, **kwargs):
+            raise MongoDAOUncaughtError("update failed")
+        monkeypatch.setattr(zarr_data_repo._records, 'update', fail)
+        with pytest.raises(MongoDAOUncaughtError):
+            zarr_data_repo.append('spike_waveforms', 'streamed', list(self._waveform_chunks(2))[1])
+        assert zarr_data_repo.get('spike_waveforms', 'streamed').shape == (10, 3, 5)
+        assert zarr_data_repo._operation_history[-1].operation == 'added'
+
+    def test_append_to_object_that_does_not_exist(self, populated_data_repo):
+        chunk = xr.DataArray(np.zeros((2, 3)), dims=['time', 'channel'])
+        with pytest.raises(DataRepositoryNotFoundError):
+            populated_data_repo.append('spike_waveforms', 'does_not_exist', chunk)
+
+    def test_append_with_adapter_that_cannot_append(self, windowed_data_repo):
+        chunk = xr.DataArray(np.zeros((2, 3, 5)), dims=['time', 'channel', 'sample'], coords={'time': [5.0, 5.1]})
+        with pytest.raises(DataRepositoryTypeError):
+            windowed_data_repo.append('spike_waveforms', 'window_0', chunk)
+
+    @staticmethod
+    def _waveform_chunks(n_chunks, data_name='streamed'):
+        for start in range(n_chunks):
+            chunk = xr.DataArray(np.full((10, 3, 5), float(start)), dims=['time', 'channel', 'sample'], coords={'time': start + np.arange(10) / 10})
+            if start == 0:
+                chunk.attrs = {'schema_ref': 'spike_waveforms', 'data_name': data_name, 'data_dimensions': ['spike_idx', 'channel', 'sample'],
+                               'shape': [10, 3, 5], 'dtype': 'float64', 'unit_of_measure': 'microvolts', 'dimension_of_measure': '[charge]',
+                               'animal_data_ref': {'schema_ref': 'animal', 'data_name': 'test'}, 'session_data_ref': {'schema_ref': 'session', 'data_name': 'test'},
+                               'probe_data_ref': {'schema_ref': 'probe', 'data_name': 'probe_0'}}
+            yield chunk
+
+    def test_add_generator_of_chunks(self, zarr_data_repo):
+        ohe = zarr_data_repo.add(self._waveform_chunks(3))
+        assert ohe.data_name == 'streamed' and ohe.has_file
+        data = zarr_data_repo.get('spike_waveforms', 'streamed')
+        assert data.shape == (30, 3, 5)
+        assert float(data.isel(time=-1).max()) == 2.0
+        record = zarr_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'streamed'})[0]
+        assert record['shape'] == [30, 3, 5]
+        assert record['data_summary']['coords']['time'] == {'size': 30, 'min': 0.0, 'max': 2.9}
+        assert (record['time_start'], record['time_stop']) == (0.0, 2.9)
+        zarr_data_repo.undo()
+        assert not zarr_data_repo.exists('spike_waveforms', 'streamed')
+
+    def test_add_generator_of_chunks_removes_partial_file_on_failure(self, zarr_data_repo):
+        def failing_chunks():
+            yield from self._waveform_chunks(2)
+            raise RuntimeError("the reader failed")
+        with pytest.raises(RuntimeError):
+            zarr_data_repo.add(failing_chunks())
+        assert not zarr_data_repo.exists('spike_waveforms', 'streamed')
+        assert not zarr_data_repo._data.exists('spike_waveforms', 'streamed')
+
+    def test_add_generator_of_chunks_needs_appending_adapter(self, windowed_data_repo):
+        with pytest.raises(DataRepositoryTypeError):
+            windowed_data_repo.add(self._waveform_chunks(2))
+        assert not windowed_data_repo.exists('spike_waveforms', 'streamed')
+
+    def test_add_dask_backed_dataarray(self, zarr_data_repo):
+        dataarray = xr.concat(list(self._waveform_chunks(3)), dim='time', combine_attrs='override').chunk({'time': 10})
+        zarr_data_repo.add(dataarray)
+        record = zarr_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'streamed'})[0]
+        assert record['data_summary']['chunks'] == [10, 3, 5]
+        assert 'mean' not in record['data_summary']
+        assert zarr_data_repo.get('spike_waveforms', 'streamed').shape == (30, 3, 5)
+
+    @pytest.fixture
+    def parquet_data_repo(self, populated_data_repo, tmp_path):
+        file_dao = FileSystemDAO(filesystem=LocalFileSystem(auto_mkdir=True), project_dir=str(tmp_path / 'parquet_project'), default_data_adapter=PandasDataFrameParquetAdapter())
+        return DataRepository(record_dao=populated_data_repo._records, file_dao=file_dao, domain_repo=populated_data_repo._domain_models)
+
+    @staticmethod
+    def _spike_table(session, animal, t_start):
+        table = pd.DataFrame({'time': t_start + np.arange(100) / 100, 'unit': np.arange(100) % 4})
+        table.attrs = {'schema_ref': 'spike_times', 'data_name': f'{session}_spikes', 'data_dimensions': ['spike_idx'], 'unit_of_measure': 'seconds',
+                       'dimension_of_measure': '[time]', 'animal_data_ref': {'schema_ref': 'animal', 'data_name': animal},
+                       'session_data_ref': {'schema_ref': 'session', 'data_name': session}, 'probe_data_ref': {'schema_ref': 'probe', 'data_name': 'probe_0'}}
+        return table
+
+    def test_scan_tables_across_sessions(self, parquet_data_repo):
+        pytest.importorskip('pyarrow')
+        for session, animal, t_start in [('s1', 'A10', 0), ('s2', 'A10', 10), ('s3', 'A11', 10)]:
+            parquet_data_repo.add(self._spike_table(session, animal, t_start))
+        assert parquet_data_repo.get('spike_times', 's1_spikes').attrs['animal_data_ref'] == {'schema_ref': 'animal', 'data_name': 'A10'}
+        record = parquet_data_repo.find({'schema_ref': 'spike_times', 'data_name': 's2_spikes'})[0]
+        assert (record['time_start'], record['time_stop']) == (10.0, 10.99)
+        table = parquet_data_repo.scan({'schema_ref': 'spike_times', 'animal_data_ref.data_name': 'A10'},
+                                       columns=['time'], row_filter=[('unit', '==', 0)], t_start=0.5, t_stop=10.5)
+        rows = table.to_pandas()
+        assert set(rows.columns) == {'time', 'data_name'}
+        assert set(rows['data_name']) == {'s1_spikes', 's2_spikes'}
+        assert rows['time'].between(0.5, 10.5).all() and len(rows) == 25
+        assert parquet_data_repo.scan({'schema_ref': 'spike_times'}, t_start=100) is None
+
+    def test_scan_needs_scanning_adapter(self, windowed_data_repo):
+        with pytest.raises(DataRepositoryTypeError):
+            windowed_data_repo.scan({'schema_ref': 'spike_waveforms'})
+
+    def test_time_extent_of_table(self, populated_data_repo):
+        assert populated_data_repo._time_extent(self._spike_table('s1', 'A10', 5)) == {'time_start': 5.0, 'time_stop': 5.99}
+
+    def test_adapter_policy_choice_is_recorded(self, populated_data_repo, tmp_path):
+        from signalstore.store.adapter_policy import DataAdapterPolicy
+        adapters = {'netcdf': XarrayDataArrayNetCDFAdapter(), 'zarr': XarrayDataArrayZarrAdapter()}
+        file_dao = FileSystemDAO(filesystem=LocalFileSystem(auto_mkdir=True), project_dir=str(tmp_path / 'policy_project'), default_data_adapter=XarrayDataArrayNetCDFAdapter())
+        repo = DataRepository(record_dao=populated_data_repo._records, file_dao=file_dao, domain_repo=populated_data_repo._domain_models,
+                              adapter_policy=DataAdapterPolicy(adapters, default='netcdf', rules=[{'min_nbytes': 2000, 'adapter': 'zarr'}]))
+        small = next(self._waveform_chunks(1, data_name='small'))
+        large = xr.concat(list(self._waveform_chunks(2, data_name='large')), dim='time', combine_attrs='override')
+        repo.add(small)
+        repo.add(large)
+        records = {record['data_name']: record for record in repo.find({'data_name': {'$in': ['small', 'large']}})}
+        assert (records['small']['data_adapter'], records['large']['data_adapter']) == ('netcdf', 'zarr')
+        assert file_dao._fs.isdir(file_dao.make_filepath('spike_waveforms', 'large', 0, adapters['zarr']))
+        assert repo.get('spike_waveforms', 'large').shape == (20, 3, 5)
+        assert [data.shape for data in repo.find({'data_name': {'$in': ['small', 'large']}}, get_data=True, sort=[('data_name', 1)])] == [(20, 3, 5), (10, 3, 5)]
+        repo.remove('spike_waveforms', 'large')
+        repo.remove_many([{'schema_ref': 'spike_waveforms', 'data_name': 'small'}])
+        assert not repo.has_file('spike_waveforms', 'large')
+        repo.undo()
+        repo.undo()
+        assert repo.get('spike_waveforms', 'small').shape == (10, 3, 5)
+        assert repo.get('spike_waveforms', 'large').shape == (20, 3, 5)
+
+    @staticmethod
+    def _small_waveforms(n, prefix='packed'):
+        return [xr.DataArray(np.full((2, 3, 5), float(i)), dims=['time', 'channel', 'sample'], coords={'time': i + np.arange(2) / 10},
+                             attrs={'schema_ref': 'spike_waveforms', 'data_name': f'{prefix}_{i}', 'data_dimensions': ['spike_idx', 'channel', 'sample'],
+                                    'shape': [2, 3, 5], 'dtype': 'float64', 'unit_of_measure': 'microvolts', 'dimension_of_measure': '[charge]',
+                                    'animal_data_ref': {'schema_ref': 'animal', 'data_name': 'test'}, 'session_data_ref': {'schema_ref': 'session', 'data_name': 'test'},
+                                    'probe_data_ref': {'schema_ref': 'probe', 'data_name': 'probe_0'}})
+                for i in range(n)]
+
+    def test_add_packed_objects_share_one_file(self, populated_data_repo):
+        ohes = populated_data_repo.add_packed(self._small_waveforms(3))
+        assert [ohe.has_file for ohe in ohes] == [False] * 3
+        records = populated_data_repo.find({'data_name': {'$regex': '^packed_'}}, sort=[('data_name', 1)])
+        assert len({record['data_pack']['pack'] for record in records}) == 1
+        assert not populated_data_repo._data.exists('spike_waveforms', 'packed_1')
+        assert populated_data_repo.has_file('spike_waveforms', 'packed_1')
+        data = populated_data_repo.get('spike_waveforms', 'packed_1')
+        assert data.shape == (2, 3, 5) and float(data.max()) == 1.0
+        assert (records[1]['time_start'], records[1]['time_stop']) == (1.0, 1.1)
+        found = populated_data_repo.find({'data_name': {'$regex': '^packed_'}}, get_data=True, sort=[('data_name', 1)])
+        assert [float(data.max()) for data in found] == [0.0, 1.0, 2.0]
+        assert [result['record']['data_name'] for result in populated_data_repo.find_overlapping('test', 0.5, 1.5)] == ['packed_1']
+        with pytest.raises(DataRepositoryAlreadyExistsError):
+            populated_data_repo.add_packed(self._small_waveforms(1))
+
+    def test_remove_and_undo_packed_objects(self, populated_data_repo):
+        populated_data_repo.add_packed(self._small_waveforms(2))
+        populated_data_repo.clear_operation_history()
+        populated_data_repo.remove('spike_waveforms', 'packed_0')
+        populated_data_repo.remove_many([{'schema_ref': 'spike_waveforms', 'data_name': 'packed_1'}])
+        assert not populated_data_repo.exists('spike_waveforms', 'packed_0')
+        populated_data_repo.undo_all()
+        assert float(populated_data_repo.get('spike_waveforms', 'packed_1').max()) == 1.0
+
+    def test_update_attrs_of_packed_object_moves_it(self, populated_data_repo):
+        populated_data_repo.add_packed(self._small_waveforms(2))
+        pack = populated_data_repo.find({'data_name': 'packed_0'})[0]['data_pack']['pack']
+        populated_data_repo.update_attrs('spike_waveforms', 'packed_0', 0, {'acquisition_notes': 'noisy channel 2'})
+        record = populated_data_repo.find({'data_name': 'packed_0'})[0]
+        assert record['data_pack']['pack'] != pack
+        assert populated_data_repo.get('spike_waveforms', 'packed_0').attrs['acquisition_notes'] == 'noisy channel 2'
+        populated_data_repo.undo()
+        assert 'acquisition_notes' not in populated_data_repo.get('spike_waveforms', 'packed_0').attrs
+
+    def test_purge_collects_unreferenced_packs(self, populated_data_repo):
+        populated_data_repo.add_packed(self._small_waveforms(2))
+        populated_data_repo.add_packed(self._small_waveforms(1, prefix='other'))
+        file_dao = populated_data_repo._data
+        populated_data_repo.remove_many({'data_name': {'$regex': '^packed_'}})
+        populated_data_repo.purge(time_threshold=populated_data_repo.timestamp() - timedelta(days=1))
+        assert len(file_dao._fs.ls(file_dao._pack_dir)) == 2 # the trashed records can still be restored
+        populated_data_repo.purge()
+        assert len(file_dao._fs.ls(file_dao._pack_dir)) == 1
+        assert float(populated_data_repo.get('spike_waveforms', 'other_0').max()) == 0.0
+
+    def test_operation_history_entries_refer_to_adapters_by_name(self, zarr_data_repo):
+        ohe = zarr_data_repo.add(self._waveform_chunks(2))
+        assert ohe.data_adapter_name == 'zarr'
+        assert not hasattr(ohe, '__dict__')
+        assert repr(ohe).startswith("OperationHistoryEntry(timestamp=")
+        assert 'patch' not in ohe.dict()
+        # entries read back from a journal name adapters the repository has not seen
+        zarr_data_repo._data_adapters.clear()
+        zarr_data_repo.undo()
+        assert not zarr_data_repo._data.exists('spike_waveforms', 'streamed')
+
+    def test_update_attrs_of_netcdf_object(self, windowed_data_repo):
+        before = windowed_data_repo.get('spike_waveforms', 'window_0')
+        windowed_data_repo.update_attrs('spike_waveforms', 'window_0', 0, {'acquisition_notes': 'noisy channel 2'})
+        record = windowed_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'window_0'})[0]
+        assert record['acquisition_notes'] == 'noisy channel 2'
+        data = windowed_data_repo.get('spike_waveforms', 'window_0')
+        assert data.attrs['acquisition_notes'] == 'noisy channel 2'
+        assert data.attrs['session_data_ref'] == {'schema_ref': 'session', 'data_name': 'test'}
+        assert np.array_equal(data.values, before.values)
+        # a second update only rewrites the small reference file
+        windowed_data_repo.update_attrs('spike_waveforms', 'window_0', 0, {'acquisition_notes': 'noisy channels 2 and 3'})
+        assert windowed_data_repo.get('spike_waveforms', 'window_0').attrs['acquisition_notes'] == 'noisy channels 2 and 3'
+        windowed_data_repo.undo()
+        assert windowed_data_repo.get('spike_waveforms', 'window_0').attrs['acquisition_notes'] == 'noisy channel 2'
+        windowed_data_repo.undo()
+        assert 'acquisition_notes' not in windowed_data_repo.get('spike_waveforms', 'window_0').attrs
+        assert 'acquisition_notes' not in windowed_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'window_0'})[0]
+
+    @pytest.fixture
+    def deduplicated_data_repo(self, populated_data_repo, tmp_path):
+        file_dao = FileSystemDAO(filesystem=LocalFileSystem(auto_mkdir=True), project_dir=str(tmp_path / 'deduplicated_project'), deduplicate=True)
+        return DataRepository(record_dao=populated_data_repo._records, file_dao=file_dao, domain_repo=populated_data_repo._domain_models)
+
+    def test_deduplicated_versions_resolve_blobs_from_records(self, deduplicated_data_repo, monkeypatch):
+        repo = deduplicated_data_repo
+        chunk = next(self._waveform_chunks(1, data_name='deduplicated'))
+        repo.add(chunk.copy(), versioning_on=True)
+        repo.add(chunk.copy(), versioning_on=True)
+        records = repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'deduplicated'}, sort=[('version_timestamp', 1)])
+        assert len(records) == 2
+        assert records[0]['data_blob']['blob'] == records[1]['data_blob']['blob']
+        assert len(repo._data._fs.ls(repo._data._blob_dir)) == 1
+        # reads and attr updates take the reference from the record instead of opening the file
+        def fail(*args, **kwargs):
+            raise AssertionError("the reference file was read")
+        monkeypatch.setattr(repo._data, '_read_blob_ref', fail)
+        first, second = (record['version_timestamp'] for record in records)
+        assert np.array_equal(repo.get('spike_waveforms', 'deduplicated', version_timestamp=first).values, chunk.values)
+        repo.update_attrs('spike_waveforms', 'deduplicated', second, {'acquisition_notes': 'noisy channel 2'})
+        record = repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'deduplicated', 'version_timestamp': second})[0]
+        assert record['data_blob']['attrs']['acquisition_notes'] == 'noisy channel 2'
+        assert repo.get('spike_waveforms', 'deduplicated', version_timestamp=second).attrs['acquisition_notes'] == 'noisy channel 2'
+        assert 'acquisition_notes' not in repo.get('spike_waveforms', 'deduplicated', version_timestamp=first).attrs
+        # the blob is kept while a record refers to it and collected with the last one
+        repo.remove('spike_waveforms', 'deduplicated', version_timestamp=first)
+        repo.purge()
+        assert len(repo._data._fs.ls(repo._data._blob_dir)) == 1
+        repo.remove('spike_waveforms', 'deduplicated', version_timestamp=second)
+        repo.purge()
+        assert repo._data._fs.ls(repo._data._blob_dir) == []
+
+    def test_update_attrs_of_zarr_object_in_place(self, zarr_data_repo):
+        zarr_data_repo.add(self._waveform_chunks(1))
+        zarr_data_repo.clear_operation_history()
+        zarr_data_repo.update_attrs('spike_waveforms', 'streamed', 0, {'acquisition_notes': 'noisy channel 2', 'dtype': 'float32'})
+        data = zarr_data_repo.get('spike_waveforms', 'streamed')
+        assert (data.attrs['acquisition_notes'], data.attrs['dtype']) == ('noisy channel 2', 'float32')
+        assert data.dtype == np.float64
+        # the zarr store was updated in place rather than replaced by a reference file
+        assert zarr_data_repo._data._fs.isdir(zarr_data_repo._data.make_filepath('spike_waveforms', 'streamed'))
+        zarr_data_repo.undo_all()
+        data = zarr_data_repo.get('spike_waveforms', 'streamed')
+        assert data.attrs['dtype'] == 'float64'
+        assert 'acquisition_notes' not in data.attrs
+        assert 'acquisition_notes' not in zarr_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'streamed'})[0]
+
+    def test_update_attrs_of_record_without_file(self, populated_data_repo):
+        record = populated_data_repo.get('session', 'test')
+        populated_data_repo.update_attrs('session', 'test', 0, {'session_description': 'edited'})
+        assert populated_data_repo.get('session', 'test')['session_description'] == 'edited'
+        populated_data_repo.undo()
+        assert populated_data_repo.get('session', 'test')['session_description'] == record['session_description']
+
+    @pytest.mark.parametrize("patch, error", [
+        ({'data_name': 'renamed'}, DataRepositoryValidationError),
+        ({'data_summary': {}}, DataRepositoryValidationError),
+        ({'dimension_of_measure': 'charge'}, DataRepositoryValidationError),
+        (['unit_of_measure'], DataRepositoryTypeError),
+    ])
+    def test_update_attrs_with_bad_patch(self, windowed_data_repo, patch, error):
+        with pytest.raises(error):
+            windowed_data_repo.update_attrs('spike_waveforms', 'window_0', 0, patch)
+        assert windowed_data_repo.get('spike_waveforms', 'window_0').attrs['dimension_of_measure'] == '[charge]'
+
+    def test_update_attrs_of_object_that_does_not_exist(self, populated_data_repo):
+        with pytest.raises(DataRepositoryNotFoundError):
+            populated_data_repo.update_attrs('spike_waveforms', 'does_not_exist', 0, {'unit_of_measure': 'volts'})
+
+    @pytest.fixture
+    def staged_data_repo(self, populated_data_repo):
+        return DataRepository(record_dao=populated_data_repo._records, file_dao=populated_data_repo._data, domain_repo=populated_data_repo._domain_models, staged_writes=True)
+
+    def _staged_waveforms(self, repo, n):
+        ohes = []
+        for i in range(n):
+            chunk = next(self._waveform_chunks(1, data_name=f'staged_{i}'))
+            ohes.append(repo.add(chunk))
+        return ohes
+
+    def test_staged_objects_become_visible_on_commit(self, staged_data_repo):
+        self._staged_waveforms(staged_data_repo, 3)
+        assert not staged_data_repo.exists('spike_waveforms', 'staged_0')
+        assert not staged_data_repo._data.exists('spike_waveforms', 'staged_0')
+        published = staged_data_repo.commit_staged()
+        assert [ohe.data_name for ohe in published] == ['staged_0', 'staged_1', 'staged_2']
+        assert staged_data_repo._operation_history[-3:] == published
+        data = staged_data_repo.get('spike_waveforms', 'staged_2')
+        assert data.shape == (10, 3, 5)
+        assert staged_data_repo.find({'data_name': 'staged_1'})[0]['time_start'] == 0.0
+        assert staged_data_repo._data._fs.ls(staged_data_repo._data._directory + '/_staging') == []
+        assert staged_data_repo._staging_executor is None
+        staged_data_repo.undo_all()
+        assert not staged_data_repo.exists('spike_waveforms', 'staged_0')
+
+    def test_discard_staged_deletes_staging_area(self, staged_data_repo):
+        self._staged_waveforms(staged_data_repo, 2)
+        executor = staged_data_repo._staging_executor
+        assert len(staged_data_repo.discard_staged()) == 2
+        assert staged_data_repo._staging_executor is None and executor._shutdown
+        assert staged_data_repo.commit_staged() == []
+        assert not staged_data_repo.exists('spike_waveforms', 'staged_0')
+        assert staged_data_repo._data._fs.ls(staged_data_repo._data._directory + '/_staging') == []
+
+    def test_stage_object_twice(self, staged_data_repo):
+        self._staged_waveforms(staged_data_repo, 1)
+        with pytest.raises(DataRepositoryAlreadyExistsError):
+            self._staged_waveforms(staged_data_repo, 1)
+
+    def test_commit_staged_conflict_publishes_nothing(self, staged_data_repo, populated_data_repo):
+        self._staged_waveforms(staged_data_repo, 2)
+        populated_data_repo.add(next(self._waveform_chunks(1, data_name='staged_1')))
+        with pytest.raises(DataRepositoryAlreadyExistsError):
+            staged_data_repo.commit_staged()
+        assert not staged_data_repo.exists('spike_waveforms', 'staged_0')
+        assert not staged_data_repo._data.exists('spike_waveforms', 'staged_0')
+        assert staged_data_repo.get('spike_waveforms', 'staged_1').shape == (10, 3, 5)
+
+    def test_commit_staged_moves_files_back_when_records_fail(self, staged_data_repo, monkeypatch):
+        self._staged_waveforms(staged_data_repo, 2)
+        def fail(*args, **kwargs):
+            raise MongoDAOUncaughtError("insert failed")
+        monkeypatch.setattr(staged_data_repo._records, 'add_many', fail)
+        with pytest.raises(MongoDAOUncaughtError):
+            staged_data_repo.commit_staged()
+        for data_name in ('staged_0', 'staged_1'):
+            assert not staged_data_repo._data.exists('spike_waveforms', data_name)
+            assert not staged_data_repo.exists('spike_waveforms', data_name)
+        assert staged_data_repo._data._fs.ls(staged_data_repo._data._directory + '/_staging') == []
+        assert staged_data_repo._operation_history == []
+
+    def test_commit_staged_promotes_all_files_or_none(self, staged_data_repo, monkeypatch):
+        self._staged_waveforms(staged_data_repo, 3)
+        fs = staged_data_repo._data._fs
+        mv = fs.mv
+        moves = []
+        def fail_second_promotion(source, destination, **kwargs):
+            moves.append(source)
+            if len(moves) == 2:
+                raise OSError("rename failed")
+            return mv(source, destination, **kwargs)
+        monkeypatch.setattr(fs, 'mv', fail_second_promotion)
+        with pytest.raises(OSError):
+            staged_data_repo.commit_staged()
+        assert not staged_data_repo._data.exists('spike_waveforms', 'staged_0')
+        assert not staged_data_repo.exists('spike_waveforms', 'staged_0')
+
+    def test_added_records_carry_time_extent(self, windowed_data_repo):
+        record = windowed_data_repo.find({'schema_ref': 'spike_waveforms', 'data_name': 'window_1'})[0]
+        assert (record['time_start'], record['time_stop']) == (1.0, 1.9)
+
+    @pytest.mark.parametrize('t_start, t_stop, expected', [
+        (0.25, 0.55, {'window_0': slice(3, 6)}),
+        (1.85, 2.15, {'window_1': slice(9, 10), 'window_2': slice(0, 2)}),
+        (5.0, 6.0, {}),
+    ])
+    def test_find_overlapping(self, windowed_data_repo, t_start, t_stop, expected):
+        results = windowed_data_repo.find_overlapping('test', t_start, t_stop)
+        assert {result['record']['data_name']: result['time_slice'] for result in results} == expected
+        for result in results:
+            times = result['data'].coords['time'].values
+            assert len(times) == result['time_slice'].stop - result['time_slice'].start
+            assert times.min() >= t_start and times.max() <= t_stop
+
+    def test_find_overlapping_other_session(self, windowed_data_repo):
+        assert windowed_data_repo.find_overlapping('other_session', 0, 10) == []
+
+    def test_find_overlapping_with_session_name_ref(self, windowed_data_repo):
+        # session_data_ref can be stored as the session's data_name instead of a reference (as in the data mocks)
+        windowed_data_repo._records._collection.update_one({'data_name': 'window_2'}, {'$set': {'session_data_ref': 'test'}})
+        results = windowed_data_repo.find_overlapping('test', 1.85, 2.15, filter={'schema_ref': 'spike_waveforms'})
+        assert [result['record']['data_name'] for result in results] == ['window_1', 'window_2']
+
+    def test_find_overlapping_opens_netcdf_lazily(self, windowed_data_repo):
+        results = windowed_data_repo.find_overlapping('test', 0.25, 0.55)
+        assert results[0]['data'].chunks is not None
+        assert results[0]['data'].shape == (3, 3, 5)
+
+    def test_iterate_in_pages(self, populated_data_repo):
+        # the fixture records include schema_refs without data models, so skip validation
+        pages = list(populated_data_repo.iterate(page_size=4, validate=False))
+        records = [record for page, token in pages for record in page]
+        assert len(records) == populated_data_repo.count()
+        assert all(token is not None for page, token in pages[:-1])
+        _, token = pages[0]
+        resumed = [record for page, _ in populated_data_repo.iterate(page_size=4, resume_token=token, validate=False) for record in page]
+        assert resumed == records[4:]
+
+    def test_iterate_with_fields(self, populated_data_repo):
+        pages = list(populated_data_repo.iterate(filter={'schema_ref': 'numpy_test'}, page_size=3, fields=['version_timestamp']))
+        records = [record for page, token in pages for record in page]
+        assert len(records) == 10
+        assert all(set(record.keys()) == {'version_timestamp'} for record in records)
+        assert [record['version_timestamp'] for record in records] == sorted(record['version_timestamp'] for record in records)
+
+    def test_iterate_with_bad_resume_token(self, populated_data_repo):
+        with pytest.raises(DataRepositoryTypeError):
+            next(populated_data_repo.iterate(resume_token='not a token'))
+
+    def test_count_and_distinct(self, populated_data_repo):
+        assert populated_data_repo.count({'schema_ref': 'numpy_test'}) == 10
+        assert populated_data_repo.count({'schema_ref': 'does_not_exist'}) == 0
+        assert populated_data_repo.distinct('data_name', {'schema_ref': 'numpy_test'}) == ['numpy_test']
+        populated_data_repo.remove_many([{'schema_ref': 'animal', 'data_name': 'test'}])
+        assert 'animal' not in populated_data_repo.distinct('schema_ref')
+        versions = populated_data_repo.distinct('version_timestamp', {'schema_ref': 'numpy_test'})
+        assert len(versions) == 10 and all(isinstance(version, datetime) for version in versions)
+
+    def test_aggregate_counts_per_group(self, populated_data_repo):
+        rows = populated_data_repo.aggregate(group_by='schema_ref', metrics={'n': 'count', 'names': ('distinct', 'data_name')})
+        by_schema = {row['schema_ref']: row for row in rows}
+        assert by_schema['numpy_test']['n'] == 10
+        assert by_schema['numpy_test']['names'] == ['numpy_test']
+        assert sum(row['n'] for row in rows) == populated_data_repo.count()
+        assert [row['schema_ref'] for row in rows] == sorted(by_schema)
+
+    def test_aggregate_with_bad_metric(self, populated_data_repo):
+        with pytest.raises(DataRepositoryTypeError):
+            populated_data_repo.aggregate(group_by='schema_ref', metrics={'n': ('median', 'data_name')})
+
+    def test_latest_versions(self, populated_data_repo, timestamp):
+        records = populated_data_repo.latest_versions({'schema_ref': 'numpy_test'})
+        assert len(records) == 1
+        newest = max(populated_data_repo.distinct('version_timestamp', {'schema_ref': 'numpy_test'}))
+        assert records[0]['version_timestamp'] == newest
+
+    def test_ensure_indexes_for_indexed_properties(self, populated_data_repo):
+        model = populated_data_repo._domain_models.get(schema_name='session')
+        model = {key: value for key, value in model.items() if key not in ['time_of_save', 'time_of_removal', 'version_timestamp']}
+        model['schema_name'] = 'indexed_session'
+        model['indexed_properties'] = ['animal_data_refs', 'session_description']
+        populated_data_repo._domain_models.add(model)
+        assert populated_data_repo._domain_models.indexed_properties() == ['animal_data_refs', 'session_description']
+        time_range_indexes = ['live__session_data_ref.data_name__time_start__time_stop', 'live__session_data_ref__time_start__time_stop']
+        names = populated_data_repo.ensure_indexes()
+        assert names == ['live__animal_data_refs', *time_range_indexes, 'live__session_description']
+        indexes = populated_data_repo._records._collection.index_information()
+        assert indexes['live__animal_data_refs']['partialFilterExpression'] == {'time_of_removal': None}
+        # indexes of properties that are no longer declared are dropped
+        populated_data_repo._domain_models.remove(schema_name='indexed_session')
+        assert populated_data_repo.ensure_indexes() == time_range_indexes
+        assert sorted(name for name in populated_data_repo._records._collection.index_information() if name.startswith('live__')) == time_range_indexes
+
+    def test_indexed_property_must_be_a_model_property(self, populated_data_repo):
+        model = populated_data_repo._domain_models.get(schema_name='session')
+        model = {key: value for key, value in model.items() if key not in ['time_of_save', 'time_of_removal', 'version_timestamp']}
+        model['schema_name'] = 'indexed_session'
+        model['indexed_properties'] = ['not_a_session_property']
+        with pytest.raises(DomainRepositoryValidationError):
+            populated_data_repo._domain_models.add(model)
+
+    def test_find_with_projection_and_fields(self, populated_data_repo):
+        with pytest.raises(DataRepositoryTypeError):
+            populated_data_repo.find(filter={'schema_ref': 'session'}, projection={'data_name': 1}, fields=['data_name'])
+
     # add tests (test all expected behaviors of add())
     # ------------------------------------------------
     # Category 1: add a data object that is valid
@@ -948,7 +1538,6 @@ class TestDataRepository:
             if 'version_timestamp' in data_object.attrs:
                 del data_object.attrs['version_timestamp']
         populated_data_repo.add(data_object, versioning_on=True)
-        sleep(0.001)
 
     def test_add_file_data_object_that_has_no_has_file_attribute(self, populated_data_repo):
         data_object = populated_data_repo.get(schema_ref='spike_waveforms', data_name='test', version_timestamp=0)
@@ -1092,6 +1681,73 @@ class TestDataRepository:
             populated_data_repo.remove(schema_ref='does_not_exist', data_name='does_not_exist', version_timestamp=bad_version_timestamp)
             assert False, f"Should have raised an Exception for version_timestamp: {bad_version_timestamp}"
 
+    # test remove_many (test all expected behaviors of remove_many())
+    # ----------------------------------------------------------------
+    # Category 1: remove many data objects that exist
+    # Test 1.1: remove many records by key
+    # Test 1.2: remove many versioned data objects with files by filter
+    # Category 2: remove many data objects where some do not exist (error)
+    # Category 3: undo_all restores everything removed by remove_many
+
+    def test_remove_many_records_by_key(self, populated_data_repo):
+        keys = [{'schema_ref': 'animal', 'data_name': 'test'}, {'schema_ref': 'session', 'data_name': 'test', 'version_timestamp': 0}]
+        ohes = populated_data_repo.remove_many(keys)
+        assert len(ohes) == 2
+        for key in keys:
+            assert not populated_data_repo.exists(schema_ref=key['schema_ref'], data_name=key['data_name'])
+
+    def test_remove_many_versioned_data_objects_by_filter(self, populated_data_repo, model_numpy_adapter, timestamp):
+        ohes = populated_data_repo.remove_many({'schema_ref': 'numpy_test'}, data_adapter=model_numpy_adapter)
+        assert len(ohes) == 10
+        assert all(ohe.has_file for ohe in ohes)
+        assert len(populated_data_repo.find({'schema_ref': 'numpy_test'})) == 0
+        assert populated_data_repo._data.n_versions(schema_ref='numpy_test', data_name='numpy_test') == 0
+
+    def test_remove_many_with_duplicate_keys(self, populated_data_repo):
+        keys = [{'schema_ref': 'animal', 'data_name': 'test'}, {'schema_ref': 'animal', 'data_name': 'test', 'version_timestamp': 0}]
+        ohes = populated_data_repo.remove_many(keys)
+        assert len(ohes) == 1
+        assert not populated_data_repo.exists(schema_ref='animal', data_name='test')
+        populated_data_repo.undo_all()
+        assert populated_data_repo.exists(schema_ref='animal', data_name='test')
+
+    def test_remove_many_with_key_that_does_not_exist(self, populated_data_repo):
+        keys = [{'schema_ref': 'animal', 'data_name': 'test'}, {'schema_ref': 'animal', 'data_name': 'does_not_exist'}]
+        with pytest.raises(DataRepositoryNotFoundError):
+            populated_data_repo.remove_many(keys)
+        assert populated_data_repo.exists(schema_ref='animal', data_name='test')
+
+    def test_undo_all_after_remove_many(self, populated_data_repo, model_numpy_adapter):
+        populated_data_repo.remove_many({'schema_ref': 'numpy_test'}, data_adapter=model_numpy_adapter)
+        populated_data_repo.remove_many([{'schema_ref': 'animal', 'data_name': 'test'}])
+        undone_operations = populated_data_repo.undo_all()
+        assert len(undone_operations) == 11
+        assert len(populated_data_repo._operation_history) == 0
+        assert populated_data_repo.exists(schema_ref='animal', data_name='test')
+        assert len(populated_data_repo.find({'schema_ref': 'numpy_test'})) == 10
+        assert populated_data_repo._data.n_versions(schema_ref='numpy_test', data_name='numpy_test') == 10
+
+    def test_remove_many_keeps_records_when_files_cannot_be_marked(self, populated_data_repo, model_numpy_adapter, monkeypatch):
+        def fail(*args, **kwargs):
+            raise FileSystemDAOUncaughtError("rename failed")
+        monkeypatch.setattr(populated_data_repo._data, 'mark_many_for_deletion', fail)
+        with pytest.raises(FileSystemDAOUncaughtError):
+            populated_data_repo.remove_many({'schema_ref': 'numpy_test'}, data_adapter=model_numpy_adapter)
+        assert len(populated_data_repo.find({'schema_ref': 'numpy_test'})) == 10
+        assert len(populated_data_repo._operation_history) == 0
+
+    def test_undo_all_reports_records_added_again(self, populated_data_repo, model_numpy_adapter, timestamp):
+        record = populated_data_repo._records.get(schema_ref='animal', data_name='test')
+        populated_data_repo.remove_many({'schema_ref': 'numpy_test'}, data_adapter=model_numpy_adapter)
+        populated_data_repo.remove_many([{'schema_ref': 'animal', 'data_name': 'test'}])
+        # added again outside of the operation history
+        populated_data_repo._records.add(document=record, timestamp=timestamp)
+        with pytest.raises(DataRepositoryAlreadyExistsError):
+            populated_data_repo.undo_all()
+        assert len(populated_data_repo._operation_history) == 0
+        assert populated_data_repo.exists(schema_ref='animal', data_name='test')
+        assert len(populated_data_repo.find({'schema_ref': 'numpy_test'})) == 10
+
     # test undo (test all expected behaviors of undo())
     # ------------------------------------------------
     # Category 1: undo adding
@@ -1307,3 +1963,21 @@ class TestDataRepository:
         # purge the data objects
         purged = populated_data_repo.purge(time_threshold=None)
         assert len(purged) == 10, f"Should have purged {10} data objects, but purged {len(purged)}"
+
+    def test_purge_dry_run_does_not_delete(self, populated_data_repo, model_numpy_adapter):
+        populated_data_repo.remove_many({'schema_ref': 'numpy_test'}, data_adapter=model_numpy_adapter)
+        report = populated_data_repo.purge(dry_run=True)
+        assert report == PurgeReport(n_records=10, n_files=10, nbytes=report.nbytes, dry_run=True)
+        assert report.nbytes > 0
+        assert len(populated_data_repo.list_marked_for_deletion()) == 10
+
+    def test_purge_after_remove_many(self, populated_data_repo, model_numpy_adapter):
+        populated_data_repo.remove_many({'schema_ref': 'numpy_test'}, data_adapter=model_numpy_adapter)
+        progress = []
+        report = populated_data_repo.purge(progress_callback=lambda done, total: progress.append((done, total)))
+        assert report.n_records == 10
+        assert report.n_files == 10
+        assert progress[-1] == (10, 10)
+        assert len(populated_data_repo.list_marked_for_deletion()) == 0
+        # purging again is a no-op, so an interrupted purge can simply be rerun
+        assert populated_data_repo.purge() == PurgeReport(n_records=0, n_files=0)
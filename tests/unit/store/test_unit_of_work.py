@@ -1,7 +1,220 @@
+from datetime import datetime, timezone
 
+import mongomock
+import numpy as np
+import pytest
+import xarray as xr
+
+from signalstore.store.operation_journal import OperationJournal
+from signalstore.store import datafile_adapters
+from signalstore.store.datafile_adapters import *
+from signalstore.store.repositories import OperationHistoryEntry, DataRepository
 
 class TestUnitOfWork:
 
     def test_initialize(self, unit_of_work):
         with unit_of_work as uow:
-            pass
\ No newline at end of file
+            pass
+
+    def test_indexes_are_maintained_once_per_project_and_on_commit(self, journaled_uow_provider, monkeypatch):
+        calls = []
+        ensure_indexes = DataRepository.ensure_indexes
+        def counting_ensure_indexes(self):
+            calls.append(self)
+            return ensure_indexes(self)
+        monkeypatch.setattr(DataRepository, "ensure_indexes", counting_ensure_indexes)
+        with journaled_uow_provider("testproject") as uow:
+            model = uow.domain_models.get("session")
+            model = {key: value for key, value in model.items() if key not in ("time_of_save", "time_of_removal", "version_timestamp")}
+            model["schema_name"] = "indexed_session"
+            model["indexed_properties"] = ["session_description"]
+            uow.domain_models.add(model)
+            assert calls == []
+            uow.commit()
+            assert len(calls) == 1
+            assert "live__session_description" in uow.data._records._collection.index_information()
+        with journaled_uow_provider("testproject") as uow:
+            pass
+        assert len(calls) == 1
+
+class TestJournaledUnitOfWork:
+
+    @staticmethod
+    def _sessions(uow, n):
+        base = uow.data.get("session", "test")
+        base = {key: value for key, value in base.items() if key not in ("time_of_save", "time_of_removal")}
+        return [{**base, "data_name": f"journaled_{i}"} for i in range(n)]
+
+    @staticmethod
+    def _journal_documents(uow):
+        return list(uow._journal._collection.find({}))
+
+    def test_every_operation_is_journaled(self, journaled_uow_provider):
+        with journaled_uow_provider("testproject") as uow:
+            for session in self._sessions(uow, 7):
+                uow.data.add(session)
+            # memory keeps at most a batch of the most recent entries
+            assert len(uow.data._operation_history) == 1
+            assert uow._journal.count("data") == 7
+            assert [ohe.data_name for ohe in uow.data.operation_history()] == [f"journaled_{i}" for i in range(7)]
+
+    def test_rollback_streams_from_journal(self, journaled_uow_provider):
+        with journaled_uow_provider("testproject") as uow:
+            for session in self._sessions(uow, 7):
+                uow.data.add(session)
+            uow.data.remove("session", "journaled_0")
+        with journaled_uow_provider("testproject") as uow:
+            assert uow.data.count({"data_name": {"$regex": "^journaled_"}}) == 0
+            assert [document["kind"] for document in self._journal_documents(uow)] == ["transaction"]
+
+    def test_undo_pops_from_journal(self, journaled_uow_provider):
+        with journaled_uow_provider("testproject") as uow:
+            for session in self._sessions(uow, 3):
+                uow.data.add(session)
+            assert uow.data._operation_history == []
+            ohe = uow.data.undo()
+            assert ohe.data_name == "journaled_2"
+            assert not uow.data.exists("session", "journaled_2")
+            assert uow.data.exists("session", "journaled_1")
+            assert uow._journal.count("data") == 2
+
+    def test_commit_ends_journal_transaction(self, journaled_uow_provider):
+        with journaled_uow_provider("testproject") as uow:
+            for session in self._sessions(uow, 4):
+                uow.data.add(session)
+            operations = uow.commit()
+            assert [ohe.data_name for ohe in operations["data"]] == [f"journaled_{i}" for i in range(4)]
+            assert uow.data.operation_history() == []
+        with journaled_uow_provider("testproject") as uow:
+            assert uow.data.count({"data_name": {"$regex": "^journaled_"}}) == 4
+
+    def test_recover_rolls_back_abandoned_transaction(self, journaled_uow_provider):
+        uow = journaled_uow_provider("testproject")
+        uow.__enter__()
+        for session in self._sessions(uow, 6):
+            uow.data.add(session)
+        # the process dies here, without leaving the context
+        assert journaled_uow_provider.recover("testproject") == [uow._journal.transaction_id]
+        with journaled_uow_provider("testproject") as uow:
+            assert uow.data.count({"data_name": {"$regex": "^journaled_"}}) == 0
+            assert uow._journal.open_transactions() == [uow._journal.transaction_id]
+        assert journaled_uow_provider.recover("testproject") == []
+
+    def test_recover_rolls_back_transaction_that_died_mid_batch(self, journaled_uow_provider):
+        uow = journaled_uow_provider("testproject")
+        uow.__enter__()
+        # fewer operations than the batch size, so none of them would have been spilled from memory
+        for session in self._sessions(uow, 2):
+            uow.data.add(session)
+        assert journaled_uow_provider.recover("testproject") == [uow._journal.transaction_id]
+        with journaled_uow_provider("testproject") as uow:
+            assert uow.data.count({"data_name": {"$regex": "^journaled_"}}) == 0
+
+    @pytest.mark.parametrize("dies", ["before_the_change", "after_the_change"])
+    def test_recover_undoes_interrupted_operation(self, journaled_uow_provider, monkeypatch, dies):
+        uow = journaled_uow_provider("testproject")
+        uow.__enter__()
+        sessions = self._sessions(uow, 2)
+        uow.data.add(sessions[0])
+        def die(*args, **kwargs):
+            raise KeyboardInterrupt
+        # the process dies while adding the second session, before or after its record was added
+        if dies == "before_the_change":
+            monkeypatch.setattr(uow.data._records, "add", die)
+        else:
+            monkeypatch.setattr(uow.data, "_record_operation", die)
+        with pytest.raises(KeyboardInterrupt):
+            uow.data.add(sessions[1])
+        assert uow._journal.count("data") == 2
+        assert journaled_uow_provider.recover("testproject") == [uow._journal.transaction_id]
+        with journaled_uow_provider("testproject") as uow:
+            assert uow.data.count({"data_name": {"$regex": "^journaled_"}}) == 0
+
+    def test_failed_operation_leaves_no_entry(self, journaled_uow_provider):
+        with journaled_uow_provider("testproject") as uow:
+            session = self._sessions(uow, 1)[0]
+            uow.data.add(session)
+            with pytest.raises(Exception):
+                uow.data.add(session)
+            assert uow._journal.count("data") == 1
+
+    def test_operations_cost_one_journal_write(self, journaled_uow_provider, monkeypatch):
+        with journaled_uow_provider("testproject") as uow:
+            writes = []
+            collection = uow._journal._collection
+            for method in ("insert_one", "insert_many", "update_one", "update_many", "delete_many"):
+                original = getattr(collection, method)
+                def counting(*args, _method=method, _original=original, **kwargs):
+                    writes.append(_method)
+                    return _original(*args, **kwargs)
+                monkeypatch.setattr(collection, method, counting)
+            sessions = self._sessions(uow, 3)
+            for session in sessions:
+                uow.data.add(session)
+            uow.data.remove_many([{"schema_ref": "session", "data_name": session["data_name"]} for session in sessions])
+            assert writes == ["insert_many"] * 4
+
+    def test_recover_deletes_only_staging_areas_of_open_transactions(self, journaled_uow_provider):
+        journaled_uow_provider._staged_writes = True
+        uow = journaled_uow_provider("testproject")
+        uow.__enter__()
+        waveform = xr.DataArray(np.zeros((10, 3, 5)), dims=["time", "channel", "sample"], attrs={
+            "schema_ref": "spike_waveforms", "data_name": "staged", "data_dimensions": ["spike_idx", "channel", "sample"],
+            "shape": [10, 3, 5], "dtype": "float64", "unit_of_measure": "microvolts", "dimension_of_measure": "[charge]",
+            "animal_data_ref": {"schema_ref": "animal", "data_name": "test"}, "session_data_ref": {"schema_ref": "session", "data_name": "test"},
+            "probe_data_ref": {"schema_ref": "probe", "data_name": "probe_0"}})
+        uow.data.add(waveform)
+        uow.data._staged[0][2].result()
+        # a staging area the journal knows nothing about, e.g. of a writer without a journal
+        other = waveform.copy()
+        other.attrs["data_name"] = "other"
+        file_dao = uow.data._data
+        file_dao.stage(other, "unjournaled")
+        staging_dir = file_dao._directory + "/" + file_dao._staging_dirname
+        assert len(file_dao._fs.ls(staging_dir, detail=False)) == 2
+        # the process dies here, without leaving the context
+        journaled_uow_provider.recover("testproject")
+        assert [path.rsplit("/", 1)[-1] for path in file_dao._fs.ls(staging_dir, detail=False)] == ["unjournaled"]
+
+    def test_journal_round_trips_entries(self):
+        journal = OperationJournal(mongomock.MongoClient(), "testproject")
+        ohe = OperationHistoryEntry(
+            datetime.now(timezone.utc), "records", "updated",
+            schema_ref="session", data_name="test", version_timestamp=0, has_file=True,
+            data_adapter_name="zarr", patch={"acquisition_notes": "new"}, previous_attrs={}
+            )
+        entry = journal._serialize(ohe)
+        assert entry["data_adapter_name"] == "zarr"
+        assert "schema_name" not in entry
+        assert journal._deserialize(entry) == ohe
+
+    def test_journal_creates_only_registered_adapters(self, monkeypatch):
+        assert isinstance(data_adapter_from_name("zarr"), XarrayDataArrayZarrAdapter)
+        # names are read back from the database, so import paths are never followed
+        with pytest.raises(DataAdapterNotFoundError):
+            data_adapter_from_name("subprocess:Popen")
+        class CustomAdapter(XarrayDataArrayNetCDFAdapter):
+            pass
+        with pytest.raises(DataAdapterNotFoundError):
+            data_adapter_from_name(data_adapter_name(CustomAdapter()))
+        # register into a copy of the registry that is thrown away after the test
+        monkeypatch.setattr(datafile_adapters, "registered_data_adapters", dict(registered_data_adapters))
+        register_data_adapter("custom", CustomAdapter)
+        assert data_adapter_name(CustomAdapter()) == "custom"
+        assert isinstance(data_adapter_from_name("custom"), CustomAdapter)
+        with pytest.raises(DataAdapterConfigError):
+            register_data_adapter("custom", XarrayDataArrayZarrAdapter)
+        with pytest.raises(DataAdapterConfigError):
+            register_data_adapter("other", dict)
+
+    def test_commit_summary(self, journaled_uow_provider):
+        with journaled_uow_provider("testproject") as uow:
+            for session in self._sessions(uow, 4):
+                uow.data.add(session)
+            uow.data.remove("session", "journaled_0")
+            summary = uow.commit(summary=True)
+        assert summary == {
+            "domain_models": {},
+            "data": {"added": {"session": 4}, "removed": {"session": 1}},
+            "memory": {},
+            }
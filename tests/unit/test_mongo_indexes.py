@@ -0,0 +1,44 @@
+import pytest
+from signalstore.utilities.tools.mongo_indexes import winning_plan_stages, is_collection_scan, report_collection_scans
+
+classic_collscan_plan = {
+    "queryPlanner": {
+        "winningPlan": {"stage": "PROJECTION_SIMPLE", "inputStage": {"stage": "COLLSCAN", "direction": "forward"}},
+        "rejectedPlans": [],
+    }
+}
+
+classic_index_plan = {
+    "queryPlanner": {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "live__session_data_ref"}},
+        # a rejected collection scan must not be reported
+        "rejectedPlans": [{"stage": "COLLSCAN"}],
+    }
+}
+
+sbe_or_plan = {
+    "queryPlanner": {
+        "winningPlan": {
+            "queryPlan": {"stage": "SUBPLAN", "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}},
+            "slotBasedPlan": {"stages": "..."},
+        }
+    }
+}
+
+@pytest.mark.parametrize("plan, stages, collscan", [
+    (classic_collscan_plan, ["PROJECTION_SIMPLE", "COLLSCAN"], True),
+    (classic_index_plan, ["FETCH", "IXSCAN"], False),
+    (sbe_or_plan, ["SUBPLAN", "OR", "IXSCAN", "COLLSCAN"], True),
+])
+def test_winning_plan_stages(plan, stages, collscan):
+    assert winning_plan_stages(plan) == stages
+    assert is_collection_scan(plan) == collscan
+
+def test_report_collection_scans():
+    class ExplainingDAO:
+        def explain(self, filter):
+            return classic_index_plan if "session_data_ref" in filter else classic_collscan_plan
+    filters = [{"session_data_ref": "s1"}, {"notes": "x"}]
+    report = report_collection_scans(ExplainingDAO(), filters)
+    assert [entry["collscan"] for entry in report] == [False, True]
+    assert report[1]["filter"] == {"notes": "x"}
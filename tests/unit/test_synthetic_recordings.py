@@ -0,0 +1,59 @@
+import contextlib
+import io
+import pytest
+import numpy as np
+from signalstore.utilities.testing.synthetic_recordings import *
+from signalstore.adapters.read_adapters.recording_acquisitions.axona.axona_read_adapter import (
+    read_eeg_or_egf,
+    _get_position,
+    _read_tetrode_file,
+    _read_cut_file,
+)
+
+
+@pytest.fixture(scope="module")
+def axona_session(tmp_path_factory):
+    return write_axona_session(tmp_path_factory.mktemp("axona"), duration=10, n_tetrodes=2, spike_rate=10)
+
+
+@pytest.mark.parametrize("file_type, sample_rate", [("eeg", AXONA_EEG_SAMPLE_RATE), ("egf", AXONA_EGF_SAMPLE_RATE)])
+def test_axona_lfp_decodes(axona_session, file_type, sample_rate):
+    with open(axona_session[file_type], "rb") as f:
+        signal = read_eeg_or_egf(f, file_type, "session", None)[0]
+    assert signal.shape == (10 * sample_rate,)
+
+
+def test_axona_pos_decodes(axona_session):
+    x, y, t, sample_rate, ppm = _get_position(axona_session["pos"])
+    assert sample_rate == AXONA_POS_SAMPLE_RATE
+    assert len(t) == 10 * AXONA_POS_SAMPLE_RATE
+    assert not np.isnan(x).any() and not np.isnan(y).any()
+
+
+def test_axona_tetrode_and_cut_decode(axona_session):
+    for tetrode_path, cut_path in zip(axona_session["tetrodes"], axona_session["cuts"]):
+        spike_times, spike_waveforms = _read_tetrode_file(tetrode_path, "session")
+        spike_labels = _read_cut_file(cut_path, "session")
+        n_spikes = axona_spike_count(tetrode_path)
+        assert spike_times.shape == (n_spikes,)
+        assert np.all(np.diff(spike_times.values) >= 0)
+        assert spike_waveforms.shape == (n_spikes, AXONA_TETRODE_CHANNELS, AXONA_SAMPLES_PER_SPIKE)
+        assert spike_labels.shape == (n_spikes,)
+
+
+@pytest.mark.parametrize("file_format, write", [("rhd", write_intan_rhd), ("rhs", write_intan_rhs)])
+def test_intan_recordings_decode(tmp_path, file_format, write):
+    path = write(tmp_path / f"recording.{file_format}", duration=0.1, n_channels=4)
+    read_data = load_intan_reader(file_format)
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = read_data(str(path))
+    n_samples = int(np.ceil(0.1 * 30000 / INTAN_SAMPLES_PER_BLOCK)) * INTAN_SAMPLES_PER_BLOCK
+    assert data["amplifier_data"].shape == (4, n_samples)
+    assert [channel["native_channel_name"] for channel in data["amplifier_channels"]] == ["A-000", "A-001", "A-002", "A-003"]
+
+
+def test_generators_are_deterministic(tmp_path):
+    first = write_intan_spike_dat(tmp_path / "first.dat", duration=1, n_channels=4, seed=3).read_bytes()
+    second = write_intan_spike_dat(tmp_path / "second.dat", duration=1, n_channels=4, seed=3).read_bytes()
+    # the file name is part of the header
+    assert first.replace(b"first.dat", b"") == second.replace(b"second.dat", b"")